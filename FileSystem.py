@@ -1,4 +1,4 @@
-from ImageTools import FatProcessor
+from ImageTools import FatProcessor, PathIndex
 from enums import TypeOfFAT
 from service_classes import InfoAboutImage
 
@@ -8,11 +8,12 @@ class FileSystem:
     Абстаркция описания файловой системы
     """
     def __init__(self, info: InfoAboutImage, fr_proc: FatProcessor, indexed_fat_table: dict,
-                 error_detector):
+                 error_detector, path_index: PathIndex = None):
         self._type_of_fat = info.fat_type
         self._info = info
         self._ft_proc = fr_proc
         self._indexed_fat_table = indexed_fat_table
+        self._path_index = path_index if path_index is not None else PathIndex()
         self._error_detector = error_detector
         self._file_tree_printer = None
 
@@ -58,6 +59,20 @@ class FileSystem:
         """
         return set(map(lambda x: x.dir_entry_info, self._indexed_fat_table.values()))
 
+    def get_path_index(self):
+        """
+        :return: PathIndex
+        """
+        return self._path_index
+
+    def get_entry_by_path(self, path: str):
+        """
+        Поиск записи о файле или директории по полному пути внутри образа
+        :param path: путь от корня образа, разделители '/' или '\\'
+        :return: DirectoryEntryInfo, если путь существует, None - в противном случае
+        """
+        return self._path_index.get(path)
+
     def get_error_detector(self):
         """
         :return: ErrorDetector
@@ -1,12 +1,37 @@
+from overlay import CopyOnWriteOverlay, WriteBackBuffer
+from partitions import PartitionWindow, get_partition
+from stats import CountingFile, Stats
+from vhd import open_image
+
+
 class IOManager:
     """
-    Менеджер работы с образом
+    Менеджер работы с образом. Образ может быть сырым образом тома или образом VHD (фиксированным или динамическим),
+    смещения всегда отсчитываются от начала тома. Если образ - целый диск с таблицей разделов, том выбирается номером
+    раздела
     """
-    def __init__(self, file_path):
+    def __init__(self, file_path, partition: int or None = None, read_only: bool = False):
+        """
+        :param file_path: путь до образа
+        :param partition: номер раздела (начиная с 1) в таблице разделов MBR или GPT, None - том начинается с начала
+        образа
+        :param read_only: открыть образ только для чтения: образ может быть занят другим процессом или лежать на
+        носителе, доступном только для чтения, запись в образ запрещена
+        """
+        self.read_only = read_only
         try:
-            self._image = open(file_path, 'r+b')
+            self._image = open_image(file_path, 'rb' if read_only else 'r+b')
         except FileNotFoundError:
             raise
+        if partition is not None:
+            try:
+                self._image = PartitionWindow(self._image, get_partition(self._image, partition))
+            except ValueError:
+                self._image.close()
+                raise
+        self._overlay = None
+        self._write_back = None
+        self._flush_hooks = []
         self._current_position = 0
 
     def __del__(self):
@@ -17,8 +42,16 @@ class IOManager:
 
     def close(self):
         """
-        Корректное закрытие файла
+        Корректное закрытие файла. Буфер отложенной записи сбрасывается в образ, незавершённая пробная работа
+        отбрасывается
         """
+        if self._overlay is None and not self.read_only:
+            self._run_flush_hooks()
+        while self._image is self._overlay or self._image is self._write_back:
+            if self._image is self._overlay:
+                self.discard_overlay()
+            else:
+                self.stop_write_back()
         self._image.close()
 
     def read_some_bytes(self, count: int):
@@ -33,6 +66,22 @@ class IOManager:
         result = self._image.read(count)
         return result
 
+    def read_into(self, buffer):
+        """
+        Считывает следующие len(buffer) байт в файле в buffer
+        :param buffer: изменяемый буфер (bytearray, memoryview)
+        :return: int, число считанных байт
+        """
+        readinto = getattr(self._image, 'readinto', None)
+        if readinto is not None:
+            count = readinto(buffer)
+        else:
+            data = self._image.read(len(buffer))
+            count = len(data)
+            buffer[:count] = data
+        self._current_position += count
+        return count
+
     def read_bytes_and_convert_to_int(self, count: int):
         """
         Считывает следующие count байт в файле и преобразует их к int
@@ -71,6 +120,7 @@ class IOManager:
         :param length: длинна записываемого значения
         :return: None
         """
+        self._check_writable()
         self._current_position += length
         self._image.write(int.to_bytes(value, length, 'little'))
 
@@ -80,5 +130,142 @@ class IOManager:
         :param value: записываемые байты
         :return: None
         """
+        self._check_writable()
         self._current_position += len(value)
         self._image.write(value)
+
+    def flush(self):
+        """
+        Сбрасывает буферы файла образа, чтобы записанное было видно другим открытиям образа
+        """
+        if not self.read_only or self._overlay is not None:
+            self._run_flush_hooks()
+        self._image.flush()
+
+    def add_flush_hook(self, flush, discard=None, on_safe_point: bool = False):
+        """
+        Регистрирует данные, которые держатся в памяти и должны попасть в образ (например, подсказки FSInfo)
+        :param flush: flush(io_manager) записывает данные через этот IOManager; вызывается в flush, start_overlay,
+                      commit_overlay, stop_write_back, close и перед сбросом буфера отложенной записи в safe_point
+        :param discard: discard(io_manager) вызывается после discard_overlay, когда записанное в пробной работе
+                        отброшено
+        :param on_safe_point: вызывать flush и в каждой безопасной точке без отложенной записи: данные должны
+                              попадать в образ вместе с остальными изменениями (например, кэш таблицы FAT)
+        """
+        self._flush_hooks.append((flush, discard, on_safe_point))
+
+    def _run_flush_hooks(self, only_on_safe_point: bool = False):
+        for flush, _, on_safe_point in self._flush_hooks:
+            if on_safe_point or not only_on_safe_point:
+                flush(self)
+
+    def start_overlay(self):
+        """
+        Начинает пробную работу с образом: дальнейшая запись накапливается в памяти (см. CopyOnWriteOverlay) и
+        попадает в образ только после commit_overlay. Работает и для образа, открытого только для чтения. Данные,
+        изменённые до начала пробной работы и ещё не записанные (см. add_flush_hook), сначала записываются в образ,
+        чтобы discard_overlay их не отбросил
+        """
+        if self._overlay is not None:
+            raise ValueError('Пробная работа с образом уже начата')
+        if not self.read_only:
+            self._run_flush_hooks()
+        self._overlay = self._push_layer(CopyOnWriteOverlay(self._image))
+
+    def has_overlay(self):
+        return self._overlay is not None
+
+    def get_count_of_changed_sectors(self):
+        """
+        :return: int, количество секторов, изменённых с начала пробной работы
+        """
+        return self._overlay.get_count_of_changed_sectors() if self._overlay is not None else 0
+
+    def commit_overlay(self):
+        """
+        Записывает накопленные изменения в образ одним проходом по возрастанию смещения и завершает пробную работу
+        :return: int, количество выполненных записей в образ
+        """
+        if self._overlay is None:
+            raise ValueError('Пробная работа с образом не начата')
+        if self.read_only:
+            raise PermissionError('Образ открыт только для чтения')
+        self._run_flush_hooks()
+        count_of_writes = self._overlay.commit()
+        self._pop_layer(self._overlay)
+        self._overlay = None
+        return count_of_writes
+
+    def discard_overlay(self):
+        """
+        Отбрасывает накопленные изменения и завершает пробную работу, образ остаётся нетронутым
+        """
+        if self._overlay is None:
+            raise ValueError('Пробная работа с образом не начата')
+        self._overlay.discard()
+        self._pop_layer(self._overlay)
+        self._overlay = None
+        for _, discard, _ in self._flush_hooks:
+            if discard is not None:
+                discard(self)
+
+    def start_stats(self, stats: Stats):
+        """
+        Включает подсчёт операций с образом в stats (см. CountingFile). Считаются операции, доходящие до образа: под
+        пробной работой и отложенной записью запись попадает в счётчики только при сбросе в образ, поэтому подсчёт
+        включается до них
+        :param stats: статистика, в которую записываются счётчики
+        """
+        if self._overlay is not None or self._write_back is not None:
+            raise ValueError('Подсчёт операций включается до пробной работы и отложенной записи')
+        self._push_layer(CountingFile(self._image, stats))
+
+    def start_write_back(self, memory_limit: int):
+        """
+        Включает отложенную запись (см. WriteBackBuffer): записи накапливаются в памяти и сбрасываются в образ
+        упорядоченными по смещению в безопасных точках (safe_point) после накопления memory_limit байт
+        :param memory_limit: объём изменённых данных в байтах, после которого буфер сбрасывается
+        """
+        if self._write_back is not None:
+            raise ValueError('Отложенная запись уже включена')
+        self._write_back = self._push_layer(WriteBackBuffer(self._image, memory_limit))
+
+    def safe_point(self):
+        """
+        Сообщает, что структуры файловой системы на образе согласованы: если буфер отложенной записи заполнен, данные
+        из памяти (см. add_flush_hook) и буфер сбрасываются в образ. Без отложенной записи сбрасываются только данные,
+        зарегистрированные с on_safe_point
+        """
+        if self._write_back is None:
+            self._run_flush_hooks(only_on_safe_point=True)
+        elif self._write_back.is_full():
+            self._run_flush_hooks()
+            self._write_back.commit()
+
+    def stop_write_back(self):
+        """
+        Сбрасывает буфер отложенной записи в образ и выключает её
+        :return: int, количество записей в образ при последнем сбросе
+        """
+        if self._write_back is None:
+            return 0
+        self._run_flush_hooks()
+        count_of_writes = self._write_back.commit()
+        self._pop_layer(self._write_back)
+        self._write_back = None
+        return count_of_writes
+
+    def _push_layer(self, layer):
+        self._image = layer
+        self._image.seek(self._current_position)
+        return layer
+
+    def _pop_layer(self, layer):
+        if self._image is not layer:
+            raise ValueError('Сначала нужно завершить работу с верхним слоем образа')
+        self._image = layer.base
+        self._image.seek(self._current_position)
+
+    def _check_writable(self):
+        if self.read_only and not self.has_overlay():
+            raise PermissionError('Образ открыт только для чтения')
@@ -1,12 +1,320 @@
+import array
+import bisect
+import collections
+import io
+import os
+import struct
+import sys
+
 from IOManager import IOManager
-from service_classes import InfoAboutImage, attribute_parser, DirectoryEntryInfo, DirectoryEntryLongNameInfo, \
-    DirectoryInfo, IndexedEntryInfo
+from service_classes import InfoAboutImage, DirectoryEntryInfo, DirectoryEntryLongNameInfo, DirectoryInfo, \
+    FSInfo, IndexedEntryInfo, is_long_name_attr
 from enums import TypeOfFAT
 
 
+PATH_SEPARATOR = '/'
+
+
+class FatAccessor:
+    """
+    Доступ к значениям кластеров в таблицах FAT одного типа. Входные точки таблиц FAT и области данных, длина значения
+    и маска вычисляются один раз при создании, поэтому вычисление входной точки - одно умножение и сложение
+
+    Пакетные варианты (get_entries_in_fat, get_entries_in_data, read_values) принимают последовательность номеров
+    кластеров и возвращают array в том же порядке
+    """
+
+    ENTRY_SIZE = None  # длина значения кластера в таблице FAT в байтах
+    MASK = None  # маска значащих бит значения кластера
+    TYPECODE = None  # typecode array для значений кластеров
+    MAX_SPAN_OF_READ = 1 << 14  # наибольшее количество значений, считываемых read_values одним чтением
+
+    def __init__(self, info: InfoAboutImage):
+        self.count_of_clusters = info.count_of_clusters
+        self.fat_offsets = info.fat_offsets
+        self.bytes_per_cluster = info.bytes_per_cluster
+        self.data_base = info.data_offset - 2 * info.bytes_per_cluster  # входная точка (несуществующего) кластера 0
+
+    def get_entry_in_fat(self, n: int, fat_number: int):
+        """
+        Входная точка n-го кластера в fat_number-ой таблице FAT
+        :return: int
+        """
+        if n < 0 or self.count_of_clusters < n:
+            raise ValueError(f'Out of fat-section, n: {n} / {self.count_of_clusters}')
+        return self.fat_offsets[fat_number] + n * self.ENTRY_SIZE
+
+    def get_entry_in_data(self, n: int):
+        """
+        Входная точка n-го кластера в области данных
+        :return: int
+        """
+        if n < 0 or self.count_of_clusters < n:
+            raise ValueError('Out of data-section')
+        return self.data_base + n * self.bytes_per_cluster
+
+    def get_entries_in_fat(self, clusters, fat_number: int):
+        """
+        Входные точки кластеров clusters в fat_number-ой таблице FAT
+        :param clusters: последовательность номеров кластеров
+        :return: array ('q')
+        """
+        self._check_bounds(clusters, 'Out of fat-section')
+        base = self.fat_offsets[fat_number]
+        size = self.ENTRY_SIZE
+        return array.array('q', [base + n * size for n in clusters])
+
+    def get_entries_in_data(self, clusters):
+        """
+        Входные точки кластеров clusters в области данных
+        :param clusters: последовательность номеров кластеров
+        :return: array ('q')
+        """
+        self._check_bounds(clusters, 'Out of data-section')
+        base = self.data_base
+        size = self.bytes_per_cluster
+        return array.array('q', [base + n * size for n in clusters])
+
+    def _check_bounds(self, clusters, message: str):
+        if len(clusters) and (min(clusters) < 0 or self.count_of_clusters < max(clusters)):
+            raise ValueError(f'{message}, clusters: {min(clusters)}..{max(clusters)} / {self.count_of_clusters}')
+
+    def decode(self, raw: bytes):
+        """
+        Значение кластера по его байтам из таблицы FAT
+        :return: int
+        """
+        return int.from_bytes(raw, 'little') & self.MASK
+
+    def encode(self, value: int):
+        """
+        Байты значения кластера для записи в таблицу FAT
+        :return: bytes
+        """
+        return value.to_bytes(self.ENTRY_SIZE, 'little')
+
+    def decode_table(self, raw: bytes):
+        """
+        Значения идущих подряд кластеров по байтам таблицы FAT
+        :return: array (TYPECODE)
+        """
+        table = array.array(self.TYPECODE)
+        table.frombytes(raw)
+        if sys.byteorder != 'little':
+            table.byteswap()
+        return table
+
+    def read_value(self, io_manager: IOManager, n: int, fat_number: int):
+        """
+        Считывает значение n-го кластера из fat_number-ой таблицы FAT
+        :return: int
+        """
+        io_manager.seek(self.get_entry_in_fat(n, fat_number))
+        return self.decode(io_manager.read_some_bytes(self.ENTRY_SIZE))
+
+    def read_table(self, io_manager: IOManager, first_clus: int, count: int, fat_number: int):
+        """
+        Считывает значения count идущих подряд кластеров из fat_number-ой таблицы FAT одним чтением
+        :return: array (TYPECODE), i-й элемент - значение (first_clus + i)-го кластера
+        """
+        self.get_entry_in_fat(first_clus + count - 1, fat_number)  # проверка границы диапазона
+        io_manager.seek(self.get_entry_in_fat(first_clus, fat_number))
+        return self.decode_table(io_manager.read_some_bytes(count * self.ENTRY_SIZE))
+
+    def read_values(self, io_manager: IOManager, clusters, fat_number: int):
+        """
+        Считывает значения кластеров clusters из fat_number-ой таблицы FAT. Кластеры считываются по возрастанию номеров
+        отрезками таблицы не длиннее MAX_SPAN_OF_READ значений: близкие кластеры - одним чтением
+        :param clusters: последовательность номеров кластеров
+        :return: array (TYPECODE), i-й элемент - значение кластера clusters[i]
+        """
+        self._check_bounds(clusters, 'Out of fat-section')
+        result = array.array(self.TYPECODE, bytes(len(clusters) * self.ENTRY_SIZE))
+        order = sorted(range(len(clusters)), key=clusters.__getitem__)
+        start = 0
+        while start < len(order):
+            first_clus = clusters[order[start]]
+            end = start + 1
+            while end < len(order) and clusters[order[end]] - first_clus < self.MAX_SPAN_OF_READ:
+                end += 1
+            table = self.read_table(io_manager, first_clus, clusters[order[end - 1]] - first_clus + 1, fat_number)
+            for i in order[start:end]:
+                result[i] = table[clusters[i] - first_clus]
+            start = end
+        return result
+
+    def write_value(self, io_manager: IOManager, value: int, n: int, fat_number: int):
+        """
+        Записывает значение n-го кластера в fat_number-ую таблицу FAT
+        """
+        io_manager.seek(self.get_entry_in_fat(n, fat_number))
+        io_manager.write_some_bytes(self.encode(value))
+
+    def write_values(self, io_manager: IOManager, clusters, values, fat_number: int):
+        """
+        Записывает значения values кластеров clusters в fat_number-ую таблицу FAT. Идущие подряд кластеры записываются
+        одной записью
+        :param clusters: последовательность неповторяющихся номеров кластеров
+        :param values: последовательность значений, i-е - для кластера clusters[i]
+        """
+        self._check_bounds(clusters, 'Out of fat-section')
+        pairs = sorted(zip(clusters, values))
+        start = 0
+        while start < len(pairs):
+            end = start + 1
+            while end < len(pairs) and pairs[end][0] == pairs[end - 1][0] + 1:
+                end += 1
+            io_manager.seek(self.fat_offsets[fat_number] + pairs[start][0] * self.ENTRY_SIZE)
+            io_manager.write_some_bytes(b''.join(self.encode(value) for _, value in pairs[start:end]))
+            start = end
+
+
+class Fat16Accessor(FatAccessor):
+    ENTRY_SIZE = 2
+    MASK = 0xFFFF
+    TYPECODE = 'H'
+
+
+class Fat32Accessor(FatAccessor):
+    """
+    Старшие 4 бита значения кластера FAT32 зарезервированы и при чтении отбрасываются
+    """
+
+    ENTRY_SIZE = 4
+    MASK = 0x0FFFFFFF
+    TYPECODE = 'I'
+    _HIGH_NIBBLE_MASK_TABLE = bytes(i & 0x0F for i in range(256))
+
+    def decode_table(self, raw: bytes):
+        raw = bytearray(raw)
+        raw[3::4] = raw[3::4].translate(Fat32Accessor._HIGH_NIBBLE_MASK_TABLE)
+        return super().decode_table(raw)
+
+
+FAT_ACCESSORS = {
+    TypeOfFAT.fat16: Fat16Accessor,
+    TypeOfFAT.fat32: Fat32Accessor
+}
+
+
+class FatPageCache:
+    """
+    Страничный кэш первой таблицы FAT с ограниченной памятью: таблица делится на страницы по PAGE_SIZE байт, в памяти
+    держится не больше memory_limit байт страниц, при переполнении вытесняется давно не использованная страница (LRU)
+
+    Изменённые значения помечаются как dirty и записываются во все таблицы FAT при вытеснении их страницы и при flush,
+    идущие подряд изменённые кластеры - одной записью. Промах по странице, предыдущая страница которой в кэше (обход
+    цепочки почти непрерывного файла), считывает одним чтением и следующую страницу
+
+    Кэш не хранит IOManager (его flush и discard регистрируются в IOManager.add_flush_hook), IOManager передаётся в
+    каждый метод
+    """
+
+    PAGE_SIZE = 4096
+
+    def __init__(self, accessor: FatAccessor, count_of_fats: int, memory_limit: int):
+        """
+        :param accessor: FatAccessor образа
+        :param count_of_fats: количество таблиц FAT, в которые записываются изменения
+        :param memory_limit: наибольший объём страниц в памяти в байтах (не меньше двух страниц)
+        """
+        self._accessor = accessor
+        self._count_of_fats = count_of_fats
+        self._entries_per_page = FatPageCache.PAGE_SIZE // accessor.ENTRY_SIZE
+        self._count_of_entries = accessor.count_of_clusters + 1
+        self._max_pages = max(2, memory_limit // FatPageCache.PAGE_SIZE)
+        self._pages = collections.OrderedDict()
+        self._dirty = {}  # номер страницы: set номеров изменённых кластеров
+
+    def get_count_of_pages(self):
+        return len(self._pages)
+
+    def get(self, io_manager: IOManager, n: int):
+        """
+        Значение n-го кластера
+        :return: int
+        """
+        if not 0 <= n < self._count_of_entries:
+            self._accessor.get_entry_in_fat(n, 0)  # ValueError, как и при чтении без кэша
+        page_num, index = divmod(n, self._entries_per_page)
+        page = self._pages.get(page_num)
+        if page is None:
+            page = self._load(io_manager, page_num)
+        else:
+            self._pages.move_to_end(page_num)
+        return page[index]
+
+    def set(self, io_manager: IOManager, n: int, value: int):
+        """
+        Изменяет значение n-го кластера в кэше, во все таблицы FAT оно записывается позже (см. flush)
+        """
+        self.get(io_manager, n)
+        page_num, index = divmod(n, self._entries_per_page)
+        self._pages[page_num][index] = value
+        dirty = self._dirty.get(page_num)
+        if dirty is None:
+            dirty = self._dirty[page_num] = set()
+        dirty.add(n)
+
+    def flush(self, io_manager: IOManager):
+        """
+        Записывает все изменённые значения во все таблицы FAT
+        """
+        for page_num in list(self._dirty):
+            self._write_dirty(io_manager, page_num, self._pages[page_num])
+
+    def discard(self, io_manager: IOManager = None):
+        """
+        Отбрасывает все страницы вместе с изменениями (после IOManager.discard_overlay)
+        """
+        self._pages.clear()
+        self._dirty.clear()
+
+    def invalidate(self, first_clus: int, count: int):
+        """
+        Убирает из кэша страницы с кластерами first_clus..first_clus + count - 1, записанными в образ в обход кэша.
+        Изменения на этих страницах должны быть уже записаны (см. flush)
+        """
+        for page_num in range(first_clus // self._entries_per_page,
+                              (first_clus + count - 1) // self._entries_per_page + 1):
+            self._pages.pop(page_num, None)
+
+    def _load(self, io_manager: IOManager, page_num: int):
+        first_clus = page_num * self._entries_per_page
+        count_of_pages = 2 if page_num - 1 in self._pages and page_num + 1 not in self._pages else 1
+        count = min(count_of_pages * self._entries_per_page, self._count_of_entries - first_clus)
+        table = self._accessor.read_table(io_manager, first_clus, count, 0)
+        for i in range(0, count, self._entries_per_page):
+            self._pages[page_num + i // self._entries_per_page] = table[i:i + self._entries_per_page]
+        page = self._pages[page_num]
+        while len(self._pages) > self._max_pages:
+            evicted_num, evicted = self._pages.popitem(last=False)
+            self._write_dirty(io_manager, evicted_num, evicted)
+        return page
+
+    def _write_dirty(self, io_manager: IOManager, page_num: int, page):
+        clusters = self._dirty.pop(page_num, None)
+        if not clusters:
+            return
+        first_clus = page_num * self._entries_per_page
+        clusters = sorted(clusters)
+        values = [page[clus - first_clus] for clus in clusters]
+        for fat_num in range(self._count_of_fats):
+            self._accessor.write_values(io_manager, clusters, values, fat_num)
+
+
 class FatProcessor:
     """
     Организует работу с таблицей FAT, и её связь с областью данных
+
+    Входные точки и значения кластеров вычисляются через accessor (см. FatAccessor) для типа FAT образа. Если задан
+    cache_memory_limit, значения первой таблицы FAT читаются и изменяются через страничный кэш (cache, см.
+    FatPageCache), записи во все таблицы FAT попадают в образ при сбросе кэша: при сбросе IOManager и в его безопасных
+    точках. Чтения других таблиц и всей таблицы, записи в одну таблицу и диапазоны сначала сбрасывают кэш
+
+    Для FAT32 считывается сектор FSInfo (fs_info): при записи в первую таблицу FAT кластера, который становится
+    свободным или занятым, его подсказки обновляются в памяти и записываются в образ при сбросе IOManager
+    (см. IOManager.add_flush_hook)
     """
 
     VALUE_MASK_FAT32 = 0x0FFFFFFF
@@ -19,10 +327,16 @@ class FatProcessor:
     END_CLUSTER_IN_WIN_FAT_16 = 0xFFFF
     END_CLUSTER_IN_WIN_FAT_32 = 0x0FFFFFFF
 
-    def __init__(self, info: InfoAboutImage, io_manager: IOManager):
+    def __init__(self, info: InfoAboutImage, io_manager: IOManager, cache_memory_limit: int = 0):
+        """
+        :param info: данные загрузочного сектора образа
+        :param io_manager: менеджер работы с образом
+        :param cache_memory_limit: наибольший объём страничного кэша таблицы FAT в байтах, 0 - без кэша
+        """
         self.fat_type = info.fat_type
         self.info = info
         self.io_manager = io_manager
+        self.accessor = FAT_ACCESSORS[info.fat_type](info)
 
         if self.fat_type == TypeOfFAT.fat16:
             self.end_cluster = FatProcessor.MINIMAL_END_CLUSTER_FAT16
@@ -31,6 +345,55 @@ class FatProcessor:
             self.end_cluster = FatProcessor.MINIMAL_END_CLUSTER_FAT32
             self.bad_cluster = FatProcessor.BAD_CLUSTER_FAT32
 
+        self.fs_info = FSInfo.read(io_manager, info)
+        if self.fs_info is not None:
+            io_manager.add_flush_hook(self.fs_info.flush, self.fs_info.reload)
+
+        self.cache = None
+        if cache_memory_limit > 0:
+            self.cache = FatPageCache(self.accessor, info.BPB_NumFATs, cache_memory_limit)
+            io_manager.add_flush_hook(self.cache.flush, self.cache.discard, on_safe_point=True)
+
+    def get_count_of_free_clusters(self):
+        """
+        Количество свободных кластеров: из FSInfo, если подсказка задана, иначе подсчётом по таблице FAT, которая
+        считывается частями по FAT_SCAN_CHUNK значений
+        :return: int
+        """
+        if self.fs_info is not None and self.fs_info.get_free_count() is not None:
+            return self.fs_info.get_free_count()
+        end = self.info.count_of_clusters + 1
+        count_of_free = 0
+        for first_clus in range(2, end, FAT_SCAN_CHUNK):
+            count_of_free += self.read_fat_table(0, first_clus, min(FAT_SCAN_CHUNK, end - first_clus)).count(0)
+        return count_of_free
+
+    def find_free_clusters(self, num_of_clusters: int):
+        """
+        Ищет свободные кластеры по таблице FAT, начиная с подсказки FSI_Nxt_Free (для FAT16 - с начала таблицы) и
+        продолжая с начала таблицы. Таблица считывается частями по FAT_SCAN_CHUNK значений
+        :param num_of_clusters: количество необходимых кластеров
+        :return: list [номера кластеров], None, если свободных кластеров не хватает
+        """
+        if self.fs_info is not None and self.fs_info.get_free_count() is not None and \
+           self.fs_info.get_free_count() < num_of_clusters:
+            return None
+        end = self.info.count_of_clusters + 1
+        start = 2
+        if self.fs_info is not None and self.fs_info.nxt_free != FSInfo.UNKNOWN:
+            start = min(self.fs_info.nxt_free, end)
+
+        result = []
+        for first, last in [(start, end), (2, start)]:
+            for first_clus in range(first, last, FAT_SCAN_CHUNK):
+                table = self.read_fat_table(0, first_clus, min(FAT_SCAN_CHUNK, last - first_clus))
+                for clus, val_clus in enumerate(table, first_clus):
+                    if val_clus == 0:
+                        result.append(clus)
+                        if len(result) == num_of_clusters:
+                            return result
+        return None
+
     def get_entry_for_cluster_in_fat(self, n: int, fat_number: int):
         """
         Возвращает входную точку в n-го кластера в fat_number-ую таблицу FAT
@@ -38,22 +401,7 @@ class FatProcessor:
         :param fat_number: номер таблицы FAT
         :return: int
         """
-        if n < 0 or self.info.count_of_clusters < n:
-            raise ValueError(f'Out of fat-section, n: {n} / {self.info.count_of_clusters}')
-
-        if self.info.BPB_FATSz16 != 0:
-            fat_sz = self.info.BPB_FATSz16
-        else:
-            fat_sz = self.info.BPB_FATSz32
-
-        if self.fat_type == TypeOfFAT.fat16:
-            fat_offset = n * FatProcessor.LENGTH_CLUSTER_FAT16
-        else:
-            fat_offset = n * FatProcessor.LENGTH_CLUSTER_FAT32
-
-        result = (self.info.BPB_ResvdSecCnt + fat_number * fat_sz) * self.info.BPB_BytsPerSec + fat_offset
-
-        return result
+        return self.accessor.get_entry_in_fat(n, fat_number)
 
     def get_entry_for_cluster_in_data(self, n: int):
         """
@@ -61,10 +409,7 @@ class FatProcessor:
         :param n: номер кластреа
         :return: int
         """
-        if n < 0 or self.info.count_of_clusters < n:
-            raise ValueError('Out of data-section')
-
-        return (self.info.first_data_sector + (n - 2) * self.info.BPB_SecPerClus) * self.info.BPB_BytsPerSec
+        return self.accessor.get_entry_in_data(n)
 
     def get_cluster_value_in_certain_fat(self, n: int, fat_number: int):
         """
@@ -73,13 +418,11 @@ class FatProcessor:
         :param fat_number: номер таблицы FAT
         :return: int
         """
-        entry = self.get_entry_for_cluster_in_fat(n, fat_number)
-        self.io_manager.seek(entry)
-        fat_cluster = self.io_manager.read_bytes_and_convert_to_int(TypeOfFAT.get_length_fat_entry[self.fat_type])
-
-        if self.fat_type == TypeOfFAT.fat32:
-            fat_cluster = fat_cluster & FatProcessor.VALUE_MASK_FAT32
-        return fat_cluster
+        if self.cache is not None:
+            if fat_number == 0:
+                return self.cache.get(self.io_manager, n)
+            self.cache.flush(self.io_manager)
+        return self.accessor.read_value(self.io_manager, n, fat_number)
 
     def get_value_fat_cluster(self, n: int):
         """
@@ -89,6 +432,41 @@ class FatProcessor:
         """
         return self.get_cluster_value_in_certain_fat(n, 0)
 
+    def get_values(self, clusters, fat_number: int = 0):
+        """
+        Получение значений нескольких кластеров таблицы FAT: близкие кластеры считываются одним чтением
+        (см. FatAccessor.read_values)
+        :param clusters: последовательность номеров кластеров
+        :param fat_number: номер таблицы FAT (нумерация с нуля)
+        :return: array, i-й элемент - значение кластера clusters[i]
+        """
+        if self.cache is not None:
+            if fat_number == 0:
+                return array.array(self.accessor.TYPECODE, [self.cache.get(self.io_manager, n) for n in clusters])
+            self.cache.flush(self.io_manager)
+        return self.accessor.read_values(self.io_manager, clusters, fat_number)
+
+    def set_values(self, clusters, values):
+        """
+        Запись значений нескольких кластеров во все таблицы FAT: идущие подряд кластеры записываются одной записью в
+        каждую таблицу. Если кластер повторяется, записывается последнее из его значений
+        :param clusters: последовательность номеров кластеров
+        :param values: последовательность значений, i-е - для кластера clusters[i]
+        :return: None
+        """
+        new_values = dict(zip(clusters, values))
+        clusters = list(new_values)
+        values = list(new_values.values())
+        if self.fs_info is not None:
+            for clus, old_value, new_value in zip(clusters, self.get_values(clusters), values):
+                self._update_fs_info(clus, old_value, new_value)
+        if self.cache is not None:
+            for clus, value in zip(clusters, values):
+                self.cache.set(self.io_manager, clus, value)
+            return
+        for i in range(self.info.BPB_NumFATs):
+            self.accessor.write_values(self.io_manager, clusters, values, i)
+
     def is_end_cluster(self, fat_cluster_value: int):
         """
         Проверка значения кластера из таблицы FAT на эквивалентность EOC значению
@@ -105,6 +483,20 @@ class FatProcessor:
         """
         return fat_cluster_value == self.bad_cluster
 
+    def read_fat_table(self, fat_number: int, first_clus: int = 0, count: int or None = None):
+        """
+        Считывает значения идущих подряд кластеров таблицы FAT номер fat_number одним чтением
+        :param fat_number: номер таблицы FAT (нумерация с нуля)
+        :param first_clus: номер первого считываемого кластера
+        :param count: количество считываемых кластеров, None - до конца таблицы
+        :return: array, i-й элемент - значение (first_clus + i)-го кластера (для FAT32 уже без старших 4 бит)
+        """
+        if count is None:
+            count = self.info.count_of_clusters + 1 - first_clus
+        if self.cache is not None:
+            self.cache.flush(self.io_manager)
+        return self.accessor.read_table(self.io_manager, first_clus, count, fat_number)
+
     def write_val_in_all_fat(self, val: int, clus: int):
         """
         Запись значения в кластер номер clus во все таблицы FAT
@@ -112,9 +504,33 @@ class FatProcessor:
         :param clus: номер кластера в который будет идти запись
         :return: None
         """
+        if self.cache is not None:
+            self.set_values((clus,), (val,))
+            return
         for i in range(self.info.BPB_NumFATs):
             self.write_val_in_certain_fat(val, clus, i)
 
+    def write_val_range_in_all_fat(self, val: int, first_clus: int, count: int):
+        """
+        Запись одного значения в count идущих подряд кластеров во все таблицы FAT, одной записью на каждую таблицу
+        :param val: записываемое значение
+        :param first_clus: номер первого кластера диапазона
+        :param count: количество кластеров в диапазоне
+        :return: None
+        """
+        self.get_entry_for_cluster_in_fat(first_clus + count - 1, 0)  # проверка границы диапазона
+        if self.cache is not None:
+            self.cache.flush(self.io_manager)
+        if self.fs_info is not None:
+            for i, old_value in enumerate(self.read_fat_table(0, first_clus, count)):
+                self._update_fs_info(first_clus + i, old_value, val)
+        value = self.accessor.encode(val) * count
+        for i in range(self.info.BPB_NumFATs):
+            self.io_manager.seek(self.get_entry_for_cluster_in_fat(first_clus, i))
+            self.io_manager.write_some_bytes(value)
+        if self.cache is not None:
+            self.cache.invalidate(first_clus, count)
+
     def write_val_in_certain_fat(self, val: int, clus: int, fat_num: int):
         """
         Запись значения в кластер clus в таблицу FAT под номером fat_num (нумерация с нуля)
@@ -123,12 +539,18 @@ class FatProcessor:
         :param fat_num: номер таблицы FAT (нумерация с нуля)
         :return: None
         """
-        entry = self.get_entry_for_cluster_in_fat(clus, fat_num)
-        length = self.LENGTH_CLUSTER_FAT16 if \
-            self.info.fat_type == TypeOfFAT.fat16 else \
-            self.LENGTH_CLUSTER_FAT32
-        self.io_manager.seek(entry)
-        self.io_manager.write_int_value(val, length)
+        if fat_num == 0 and self.fs_info is not None:
+            self._update_fs_info(clus, self.get_value_fat_cluster(clus), val)
+        if self.cache is not None:
+            self.cache.flush(self.io_manager)
+            self.cache.invalidate(clus, 1)
+        self.accessor.write_value(self.io_manager, val, clus, fat_num)
+
+    def _update_fs_info(self, clus: int, old_value: int, new_value: int):
+        if old_value == 0 and new_value != 0:
+            self.fs_info.on_allocated(clus)
+        elif old_value != 0 and new_value == 0:
+            self.fs_info.on_freed(clus)
 
     def read_all_cluster_in_data(self, clus_num: int):
         """
@@ -163,6 +585,8 @@ class DirectoryParser:
     EMPTY_RECORD = 0xe5
     END_OF_RECORDS = 0x00
     ENTRY_SIZE = 32
+    SHORT_NAME_ENTRY_STRUCT = struct.Struct('<11sBBBHHHHHHHI')
+    LONG_NAME_ENTRY_STRUCT = struct.Struct('<B10sBBB12sH4s')
 
     def __init__(self, fat_proc: FatProcessor):
         self._io_manager = fat_proc.io_manager
@@ -214,80 +638,63 @@ class DirectoryParser:
         :param max_entries_num: максимальное количество записей в одном кластере директории
         :return: DirectoryInfo
         """
-        current_point = directory_entry_point
+        self._io_manager.seek(directory_entry_point)
+        raw_entries = self._io_manager.read_some_bytes(max_entries_num * DirectoryParser.ENTRY_SIZE)
 
-        entries_with_long_name = {}
+        long_name_parts = []
+        long_name_check_sum = None
         entries = []
 
-        for i in range(max_entries_num):
-            entry = self._parse_entry(current_point)
-
-            self._io_manager.seek(current_point)
-            type_entry = self._io_manager.read_bytes_and_convert_to_int(1)
-
-            current_point = current_point + DirectoryParser.ENTRY_SIZE
+        for offset in range(0, len(raw_entries), DirectoryParser.ENTRY_SIZE):
+            type_entry = raw_entries[offset]
 
             if type_entry == DirectoryParser.EMPTY_RECORD:
+                long_name_parts = []
                 continue
             elif type_entry == DirectoryParser.END_OF_RECORDS:
                 break
 
-            if isinstance(entry, DirectoryEntryInfo):
-                if len(entries_with_long_name) != 0:
-                    keys = [e.value for e in entries_with_long_name.values()]
-                    keys.sort()
-
-                    entry.name = ''.join([entries_with_long_name[v].get_full_name() for v in keys])
-                    cut = entry.name.find('\x00')
-                    if cut != -1:
-                        entry.name = entry.name[:cut]
+            entry = self._parse_entry(raw_entries, offset, directory_entry_point + offset)
 
-                    entries_with_long_name = {}
-                else:
-                    entry.name = entry.name.decode()
+            if isinstance(entry, DirectoryEntryInfo):
+                if len(long_name_parts) != 0:
+                    long_name_parts.reverse()
+                    entry.set_long_name(b''.join(long_name_parts), long_name_check_sum)
+                    long_name_parts = []
                 entries.append(entry)
             else:
-                entries_with_long_name[entry.value] = entry
+                if entry.is_last_long_entry() or len(long_name_parts) == 0:
+                    long_name_parts = []
+                    long_name_check_sum = entry.check_sum
+                elif entry.check_sum != long_name_check_sum:
+                    long_name_check_sum = None
+                long_name_parts.append(entry.get_raw_name())
 
         return DirectoryInfo(entries)
 
-    def _parse_entry(self, input_recording_point: int):
+    def _parse_entry(self, raw_entries: bytes, offset: int, input_recording_point: int):
         """
         Парсинг одной записи в директории
+        :param raw_entries: считанные байты записей директории
+        :param offset: смещение записи в raw_entries
         :param input_recording_point: входная точка записи
         :return: DirectoryEntryInfo or DirectoryEntryLongNameInfo
         """
-        self._io_manager.seek(input_recording_point + 11)
-        attr = attribute_parser(self._io_manager.read_bytes_and_convert_to_int(1))
-
-        self._io_manager.seek(input_recording_point)
-        if attr.is_long_name():
-            Ord = self._io_manager.read_bytes_and_convert_to_int(1)
-            Name1 = self._io_manager.read_some_bytes(10)
-            Attr = self._io_manager.read_bytes_and_convert_to_int(1)
-            Type = self._io_manager.read_bytes_and_convert_to_int(1)
-            Chksum = self._io_manager.read_bytes_and_convert_to_int(1)
-            Name2 = self._io_manager.read_some_bytes(12)
-            FstClusLO = self._io_manager.read_bytes_and_convert_to_int(2)
-            Name3 = self._io_manager.read_some_bytes(4)
+        if is_long_name_attr(raw_entries[offset + 11]):
+            Ord, Name1, Attr, Type, Chksum, Name2, FstClusLO, Name3 = \
+                DirectoryParser.LONG_NAME_ENTRY_STRUCT.unpack_from(raw_entries, offset)
             return DirectoryEntryLongNameInfo(Ord, Name1, Chksum, Name2, Name3)
         else:
-            name = self._io_manager.read_some_bytes(11)
-            attr = self._io_manager.read_bytes_and_convert_to_int(1)
-            NTRes = self._io_manager.read_bytes_and_convert_to_int(1)
-            CrtTimeTenth = self._io_manager.read_bytes_and_convert_to_int(1)
-            CrtTime = self._io_manager.read_bytes_and_convert_to_int(2)
-            CrtDate = self._io_manager.read_bytes_and_convert_to_int(2)
-            LstAccDate = self._io_manager.read_bytes_and_convert_to_int(2)
-            FstClusHI = self._io_manager.read_bytes_and_convert_to_int(2)
-            WrtTime = self._io_manager.read_bytes_and_convert_to_int(2)
-            WrtDate = self._io_manager.read_bytes_and_convert_to_int(2)
-            FstClusLO = self._io_manager.read_bytes_and_convert_to_int(2)
-            FileSize = self._io_manager.read_bytes_and_convert_to_int(4)
+            name, attr, NTRes, CrtTimeTenth, CrtTime, CrtDate, LstAccDate, FstClusHI, WrtTime, WrtDate, FstClusLO, \
+                FileSize = DirectoryParser.SHORT_NAME_ENTRY_STRUCT.unpack_from(raw_entries, offset)
             return DirectoryEntryInfo(name,
                                       attr,
                                       ((FstClusHI << 16) + FstClusLO if FstClusHI != 0 else FstClusLO),
-                                      input_recording_point)
+                                      input_recording_point,
+                                      FileSize,
+                                      (CrtDate << 24) | (CrtTime << 8) | CrtTimeTenth,
+                                      (WrtDate << 16) | WrtTime,
+                                      LstAccDate)
 
     def find_empty_entry_in_directory(self, directory_entry_point: int):
         """
@@ -378,7 +785,7 @@ class FileTreePrinter:  # pragma: no cover
                 print(self._get_offset(off + 1) + f.name)
 
             for d in dir_info.get_directories():
-                if d.name.strip() != '.' and d.name.strip() != '..':
+                if not d.is_dot_entry():
                     stack.append((off + 1, d.name, self._dir_parser.get_full_directory_info(d.first_cluster_num)))
 
     @staticmethod
@@ -397,12 +804,27 @@ class FileTreePrinter:  # pragma: no cover
 class FatTableIndexer:
     """
     Индерксирует таблицу FAT, составляя словарь номер_кластера: сущность_файла, которому принадлежит кластер
+
+    Во время индексирования находит зацикленные и пересекающиеся файлы. Каждая цепочка проходится один раз: для каждого
+    кластера хранится номер файла-владельца (первого файла, дошедшего до кластера) и номер последнего файла,
+    посетившего кластер. Повторное посещение кластера тем же файлом - цикл, посещение кластера другого владельца -
+    пересечение (дальше цепочки совпадают, поэтому обход файла прекращается). Итоговая сложность - O(число кластеров)
     """
 
+    NO_FILE = -1
+
     def __init__(self, dir_parser: DirectoryParser):
         self._dir_parser = dir_parser
         self._info = dir_parser.fat_proc.info
         self._indexed_fat_table = {}
+        self._path_index = PathIndex()
+
+        self._owners = array.array('i', [FatTableIndexer.NO_FILE]) * (self._info.count_of_clusters + 1)
+        self._visited = array.array('i', [FatTableIndexer.NO_FILE]) * (self._info.count_of_clusters + 1)
+        self._count_of_files = 0
+        self._looped_files = []
+        self._intersecting_files = {}
+
         self._index_fat_table()
 
     def get_full_indexed_fat_table(self):
@@ -422,21 +844,47 @@ class FatTableIndexer:
             result[i] = self._indexed_fat_table[i][0]
         return result
 
+    def get_looped_files(self):
+        """
+        Получение зацикленных файлов, найденных при индексировании
+        :return: list [IndexedEntryInfo], кластер, на котором замыкается цикл, - cur_clus
+        """
+        return self._looped_files
+
+    def get_intersecting_files(self):
+        """
+        Получение пересекающихся файлов, найденных при индексировании
+        :return: list [list [IndexedEntryInfo]], файлы каждого списка сходятся на кластере cur_clus
+        """
+        return [self._indexed_fat_table[clus] for clus in self._intersecting_files]
+
+    def get_path_index(self):
+        """
+        Получение индекса путей, построенного во время индексирования
+        :return: PathIndex
+        """
+        return self._path_index
+
     def _index_fat_table(self):
         if self._info.fat_type == TypeOfFAT.fat16:
+            root_entry = DirectoryEntryInfo('\\', None, 0, -1)
             root_dir = self._dir_parser.get_fat16_root_directory_info()
         else:
-            root_dir = self._get_all_dir_info_and_index(self._info.BPB_RootClus,
-                                                        DirectoryEntryInfo('\\', None, self._info.BPB_RootClus, -1))
-        stack = [root_dir]
+            root_entry = DirectoryEntryInfo('\\', None, self._info.BPB_RootClus, -1)
+            root_dir = self._get_all_dir_info_and_index(self._info.BPB_RootClus, root_entry)
+        root_num = self._path_index.add(None, root_entry)
+
+        stack = [(root_dir, root_num)]
         while stack:
-            cur_dir = stack.pop()
+            cur_dir, cur_dir_num = stack.pop()
             for f in cur_dir.get_files():
+                self._path_index.add(cur_dir_num, f)
                 self._index_all_file(f.first_cluster_num, f)
 
             for d in cur_dir.get_directories():
-                if d.name.strip() != '.' and d.name.strip() != '..':
-                    stack.append(self._get_all_dir_info_and_index(d.first_cluster_num, d))
+                if not d.is_dot_entry():
+                    dir_num = self._path_index.add(cur_dir_num, d)
+                    stack.append((self._get_all_dir_info_and_index(d.first_cluster_num, d), dir_num))
 
     def _get_all_dir_info_and_index(self, num_first_dir_clus: int, dir_entry_info: DirectoryEntryInfo):
         """
@@ -445,18 +893,15 @@ class FatTableIndexer:
         :param dir_entry_info: информация о записи в директории
         :return: DirectoryInfo
         """
+        file_num = self._get_new_file_num()
         fat_clus_value = num_first_dir_clus
         last_clus = None
-        dir_info = None
+        dir_info = DirectoryInfo([])
         while True:
-            new_dir_info = self._dir_parser.get_dir_info_on_one_cluster(fat_clus_value,
-                                                                        self._info.get_count_entries_in_dir_cluster())
-            if self._index_cluster(num_first_dir_clus, last_clus, dir_entry_info, True):
+            if self._index_cluster(fat_clus_value, last_clus, dir_entry_info, True, file_num):
                 break
-            if dir_info is None:
-                dir_info = new_dir_info
-            else:
-                dir_info = dir_info.merge(new_dir_info)
+            dir_info = dir_info.merge(self._dir_parser.get_dir_info_on_one_cluster(
+                fat_clus_value, self._info.get_count_entries_in_dir_cluster()))
             last_clus = fat_clus_value
             fat_clus_value = self._dir_parser.fat_proc.get_value_fat_cluster(fat_clus_value)
             if self._dir_parser.fat_proc.is_end_cluster(fat_clus_value):
@@ -471,42 +916,56 @@ class FatTableIndexer:
         :param dir_entry_info: информация о записи в директории
         :return: None
         """
+        if num_first_file_clus < 2:  # пустой файл или метка тома
+            return
+
+        file_num = self._get_new_file_num()
         fat_clus_value = num_first_file_clus
         last_clus = None
         while True:
-            if self._index_cluster(fat_clus_value, last_clus, dir_entry_info, False):
+            if self._index_cluster(fat_clus_value, last_clus, dir_entry_info, False, file_num):
                 break
             last_clus = fat_clus_value
             fat_clus_value = self._dir_parser.fat_proc.get_value_fat_cluster(fat_clus_value)
             if self._dir_parser.fat_proc.is_end_cluster(fat_clus_value):
                 break
 
-    def _index_cluster(self, clus_num: int, last_clus: int or None, dir_entry_info: DirectoryEntryInfo, is_dir: bool):
+    def _get_new_file_num(self):
+        """
+        Получение номера для очередного индексируемого файла или директории
+        :return: int
+        """
+        self._count_of_files += 1
+        return self._count_of_files - 1
+
+    def _index_cluster(self, clus_num: int, last_clus: int or None, dir_entry_info: DirectoryEntryInfo, is_dir: bool,
+                       file_num: int):
         """
         Индексирование кластера
         :param clus_num: номер кластера
         :param dir_entry_info: информация о записи в директории
         :param is_dir: является ли кластер частью дириктории
+        :param file_num: номер индексируемого файла (см. _get_new_file_num)
         :return: True, если требуется завершить дальнейшее индексирование файла, False - в противном случае
         """
-        if clus_num not in self._indexed_fat_table:
-            self._indexed_fat_table[clus_num] = []
+        indexed_entry_info = IndexedEntryInfo(dir_entry_info, clus_num, last_clus, is_dir)
 
-        has_loop = False
+        if self._visited[clus_num] == file_num:
+            self._looped_files.append(indexed_entry_info)
+            return True
+        self._visited[clus_num] = file_num
 
-        for entry in self._indexed_fat_table[clus_num]:
-            if entry.dir_entry_info.name == dir_entry_info.name:
-                has_loop = True
+        if clus_num not in self._indexed_fat_table:
+            self._indexed_fat_table[clus_num] = []
+        self._indexed_fat_table[clus_num].append(indexed_entry_info)
 
-        self._indexed_fat_table[clus_num].append(IndexedEntryInfo(dir_entry_info, clus_num, last_clus, is_dir))
+        if self._owners[clus_num] != FatTableIndexer.NO_FILE:
+            self._intersecting_files[clus_num] = None
+            return True
+        self._owners[clus_num] = file_num
 
-        is_next_cluster_bad = False
         f_proc = self._dir_parser.fat_proc
-
-        if f_proc.is_bad_cluster(f_proc.get_value_fat_cluster(clus_num)):
-            is_next_cluster_bad = True
-
-        return has_loop or is_next_cluster_bad
+        return f_proc.is_bad_cluster(f_proc.get_value_fat_cluster(clus_num))
 
 
 class ClusterSwapper:
@@ -537,17 +996,18 @@ class ClusterSwapper:
         if first_clus == second_clus:
             return
 
-        value_in_fat_first = self._ft_proc.get_value_fat_cluster(first_clus)
-        value_in_fat_second = self._ft_proc.get_value_fat_cluster(second_clus)
+        value_in_fat_first, value_in_fat_second = self._ft_proc.get_values((first_clus, second_clus))
 
         # меняем значения во всех FATs ---------------
-        self._swap_value_in_fats(first_clus, second_clus)
+        # новые значения кластеров собираются в new_values и записываются во все таблицы FAT одним set_values
+        new_values = {first_clus: value_in_fat_second, second_clus: value_in_fat_first}
 
         # меняем значение в предыдущих кластерах -----
         first_indexed_entry_info = self._get_indexed_entry_info(first_clus)
         second_indexed_entry_info = self._get_indexed_entry_info(second_clus)
-        self._change_all_reference(second_clus, value_in_fat_first, first_indexed_entry_info)
-        self._change_all_reference(first_clus, value_in_fat_second, second_indexed_entry_info)
+        self._change_all_reference(second_clus, value_in_fat_first, first_indexed_entry_info, new_values)
+        self._change_all_reference(first_clus, value_in_fat_second, second_indexed_entry_info, new_values)
+        self._ft_proc.set_values(new_values.keys(), new_values.values())
 
         # меняем записи в индексированной таблице ----
         self._swap_value_in_indexed_table_fat(first_clus, second_clus)
@@ -562,11 +1022,12 @@ class ClusterSwapper:
             if i in self._indexed_fat_table and self._indexed_fat_table[i].is_directory:
                 dir_info = dir_parser.get_dir_info_on_one_cluster(i, cnt_entries)
                 for entry in dir_info.entries_list:
-                    if entry.name.strip() == '.' or entry.name.strip() == '..':
+                    if entry.is_dot_entry() or entry.first_cluster_num < 2:
+                        continue  # пустые файлы и метки тома не индексируются (см. FatTableIndexer._index_all_file)
+                    indexed_entry_info = self._indexed_fat_table.get(entry.first_cluster_num)
+                    if indexed_entry_info is None or type(indexed_entry_info) == list:
                         continue
-                    clus_num = entry.first_cluster_num
-                    dir_entry_info = self._indexed_fat_table[clus_num].dir_entry_info
-                    dir_entry_info.entry_point = entry.entry_point
+                    indexed_entry_info.dir_entry_info.entry_point = entry.entry_point
 
     def _swap_value_in_indexed_table_fat(self, first_clus: int, second_clus: int):
         """
@@ -600,18 +1061,6 @@ class ClusterSwapper:
         self._indexed_fat_table[clus_with_zero] = self._indexed_fat_table[clus_without_zero]
         self._indexed_fat_table.pop(clus_without_zero)
 
-    def _swap_value_in_fats(self, first_clus: int, second_clus: int):
-        """
-        Меняет местами два значения в таблице FAT
-        :param first_clus: номер первого кластера
-        :param second_clus: номер второго кластера
-        :return: None
-        """
-        val_first_in_fat = self._ft_proc.get_value_fat_cluster(first_clus)
-        val_second_in_fat = self._ft_proc.get_value_fat_cluster(second_clus)
-        self._ft_proc.write_val_in_all_fat(val_second_in_fat, first_clus)
-        self._ft_proc.write_val_in_all_fat(val_first_in_fat, second_clus)
-
     def _swap_cluster_in_data(self, first_clus: int, second_clus: int):
         """
         Меняет местами кластеры в области данных
@@ -625,27 +1074,28 @@ class ClusterSwapper:
         self._ft_proc.write_all_cluster_in_data(second_val_in_data, first_clus)
 
     def _change_all_reference(self, new_value: int, next_value_for_cur_clus: int,
-                              indexed_entry_info_of_ch_clus: IndexedEntryInfo or None):
+                              indexed_entry_info_of_ch_clus: IndexedEntryInfo or None, new_values: dict):
         """
         Изменяет сслыки на текущий кластер у предыдущего кластера и правит значение ссылки на текущий у слудующего
         кластера в цепочке
         :param new_value: значение, которые будет записана, в вышеуказанные ссылки
         :param next_value_for_cur_clus: номер следующего в цепочке кластера для текущего (значение из таблицы FAT)
         :param indexed_entry_info_of_ch_clus: IndexedEntryInfo для меняемого кластера
+        :param new_values: новые значения кластеров в таблице FAT после свопа, дополняется изменёнными ссылками
         :return: None
         """
         if indexed_entry_info_of_ch_clus is not None:
             last_clus = indexed_entry_info_of_ch_clus.last_clus
-            cur_value_in_fat = self._ft_proc.get_value_fat_cluster(indexed_entry_info_of_ch_clus.cur_clus)
+            cur_value_in_fat = new_values[indexed_entry_info_of_ch_clus.cur_clus]
 
             if last_clus is None:
                 self._write_first_clus_in_dir_entry(new_value, indexed_entry_info_of_ch_clus.dir_entry_info.entry_point)
                 indexed_entry_info_of_ch_clus.dir_entry_info.first_cluster_num = new_value
             elif indexed_entry_info_of_ch_clus.cur_clus == cur_value_in_fat:  # особый случай при свопе
-                self._ft_proc.write_val_in_all_fat(new_value, indexed_entry_info_of_ch_clus.cur_clus)
+                new_values[indexed_entry_info_of_ch_clus.cur_clus] = new_value
                 indexed_entry_info_of_ch_clus.last_clus = indexed_entry_info_of_ch_clus.cur_clus
             else:
-                self._ft_proc.write_val_in_all_fat(new_value, last_clus)
+                new_values[last_clus] = new_value
 
             if not self._ft_proc.is_end_cluster(next_value_for_cur_clus) and next_value_for_cur_clus != new_value:
                 self._indexed_fat_table[next_value_for_cur_clus].last_clus = new_value
@@ -677,23 +1127,355 @@ class ClusterSwapper:
         return None
 
 
+class FileReader(io.RawIOBase):
+    """
+    Файловый объект для чтения содержимого файла образа
+
+    Цепочка кластеров проходится через страничный кэш таблицы FAT (см. FatPageCache), поэтому память не зависит от
+    размера тома, и только до кластера, в котором заканчивается файл. Идущие подряд кластеры объединяются в отрезки, и
+    каждый отрезок читается одним чтением. Читается не больше file_size байт
+    """
+    def __init__(self, fat_proc: FatProcessor, first_cluster: int, file_size: int,
+                 fat_cache: FatPageCache or None = None):
+        """
+        :param fat_proc: FatProcessor образа
+        :param first_cluster: первый кластер файла
+        :param file_size: размер файла в байтах
+        :param fat_cache: кэш первой таблицы FAT для обхода цепочки (общий для нескольких файлов), None - кэш
+                          fat_proc, а если его нет - свой кэш на две страницы
+        :raises ValueError: первый кластер непустого файла вне области данных или цепочка кластеров обрывается
+        """
+        super().__init__()
+        self._fat_proc = fat_proc
+        self._size = file_size
+        self._position = 0
+
+        bytes_per_cluster = fat_proc.info.get_bytes_per_cluster()
+        count_of_clusters = -(-file_size // bytes_per_cluster)
+        if count_of_clusters == 0:
+            chain = []
+        else:
+            if not 2 <= first_cluster <= fat_proc.info.count_of_clusters + 1:
+                raise ValueError(f'Неверный первый кластер файла: {first_cluster}')
+            if fat_cache is None:
+                fat_cache = fat_proc.cache if fat_proc.cache is not None else \
+                    FatPageCache(fat_proc.accessor, fat_proc.info.BPB_NumFATs, 2 * FatPageCache.PAGE_SIZE)
+            count_of_entries = fat_proc.info.count_of_clusters + 1
+            chain = [first_cluster]
+            while len(chain) < count_of_clusters:
+                value = fat_cache.get(fat_proc.io_manager, chain[-1]) if chain[-1] < count_of_entries else 0
+                if value < 2 or value >= count_of_entries or fat_proc.is_bad_cluster(value):
+                    raise ValueError(f'Цепочка кластеров файла обрывается на кластере {chain[-1]}')
+                chain.append(value)
+
+        self._runs = []
+        self._run_offsets = []
+        offset = 0
+        for first_clus, count in get_cluster_ranges(chain):
+            self._runs.append((fat_proc.get_entry_for_cluster_in_data(first_clus), count * bytes_per_cluster))
+            self._run_offsets.append(offset)
+            offset += count * bytes_per_cluster
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, position: int, whence: int = os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            position += self._position
+        elif whence == os.SEEK_END:
+            position += self._size
+        if position < 0:
+            raise ValueError('Отрицательная позиция в файле')
+        self._position = position
+        return position
+
+    def readinto(self, buffer):
+        """
+        Читает в buffer не больше одного отрезка файла за раз, без промежуточных копий
+        :return: int, количество прочитанных байт, 0 - конец файла
+        """
+        left_in_file = self._size - self._position
+        if left_in_file <= 0 or len(buffer) == 0:
+            return 0
+
+        i = bisect.bisect_right(self._run_offsets, self._position) - 1
+        entry, length = self._runs[i]
+        offset_in_run = self._position - self._run_offsets[i]
+        count = min(len(buffer), length - offset_in_run, left_in_file)
+
+        io_manager = self._fat_proc.io_manager
+        io_manager.seek(entry + offset_in_run)
+        count = io_manager.read_into(memoryview(buffer)[:count])
+        self._position += count
+        return count
+
+
+class PathIndex:
+    """
+    Индекс путей: словарь нормализованный_полный_путь: DirectoryEntryInfo (см. normalize_path). Имена в путях - длинные,
+    а у записей без длинного имени - короткие в виде 'NAME.EXT' (см. DirectoryEntryInfo.get_path_name). Как и в FAT,
+    регистр букв при поиске не учитывается
+
+    Во время индексирования запоминаются только записи и номера их родительских директорий, сами пути (а значит и
+    декодирование имён) строятся при первом поиске. Поиск по пути выполняется за O(глубина пути)
+    """
+    def __init__(self):
+        self._entries = []  # (номер родительской директории в _entries или None, DirectoryEntryInfo)
+        self._paths = None  # путь: номер записи в _entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, parent_num: int or None, dir_entry_info: DirectoryEntryInfo):
+        """
+        Добавляет запись в индекс
+        :param parent_num: номер родительской директории, полученный при её добавлении, None - для корня
+        :param dir_entry_info: информация о записи в директории
+        :return: int, номер добавленной записи
+        """
+        self._entries.append((parent_num, dir_entry_info))
+        self._paths = None
+        return len(self._entries) - 1
+
+    def get(self, path: str):
+        """
+        Поиск записи по пути
+        :param path: путь до файла или директории от корня образа
+        :return: DirectoryEntryInfo, None, если путь не существует
+        """
+        num = self._get_num(path)
+        return self._entries[num][1] if num is not None else None
+
+    def get_entries_in_tree_order(self, path: str or None = None):
+        """
+        Записи в порядке обхода дерева в глубину: директория, сразу за ней её файлы, затем поддиректории
+        :param path: путь до директории, обходится только её поддерево (вместе с ней самой); None - всё дерево
+        :return: list [DirectoryEntryInfo], пустой, если путь не существует
+        """
+        children = [[] for _ in self._entries]
+        roots = []
+        for num, (parent_num, _) in enumerate(self._entries):
+            (roots if parent_num is None else children[parent_num]).append(num)
+        if path is not None:
+            num = self._get_num(path)
+            roots = [num] if num is not None else []
+
+        result = []
+        stack = roots[::-1]
+        while stack:
+            num = stack.pop()
+            result.append(self._entries[num][1])
+            directories = []
+            for child_num in children[num]:
+                dir_entry_info = self._entries[child_num][1]
+                if dir_entry_info.attr.is_directory():
+                    directories.append(child_num)
+                else:
+                    result.append(dir_entry_info)
+            stack.extend(reversed(directories))
+        return result
+
+    def _get_num(self, path: str):
+        if self._paths is None:
+            self._build_paths()
+        return self._paths.get(normalize_path(path).casefold())
+
+    def _build_paths(self):
+        paths = []
+        self._paths = {}
+        for num, (parent_num, dir_entry_info) in enumerate(self._entries):
+            if parent_num is None:
+                path = PATH_SEPARATOR
+            else:
+                parent_path = paths[parent_num]
+                if parent_path == PATH_SEPARATOR:
+                    parent_path = ''
+                path = parent_path + PATH_SEPARATOR + dir_entry_info.get_path_name().strip().casefold()
+            paths.append(path)
+            self._paths[path] = num
+
+
+class FreeSpaceIndex:
+    """
+    Индекс свободного места образа: набор непрерывных отрезков свободных кластеров, упорядоченный по длине, что
+    позволяет за O(log n) выбирать наименьший подходящий отрезок (best fit)
+
+    Отрезки строятся при первом обращении по нулевым значениям таблицы FAT, таблица считывается частями по
+    FAT_SCAN_CHUNK значений, поэтому память зависит только от количества отрезков. Перед выделением значения
+    кластеров проверяются ещё раз (например, на BAD CLUSTER)
+    """
+    def __init__(self, fat_proc: FatProcessor):
+        """
+        :param fat_proc: FatProcessor образа
+        """
+        self._fat_proc = fat_proc
+        self._extents_by_size = None  # отсортированный список (длина, первый кластер), None - отрезки ещё не построены
+        self._extents_by_start = {}  # первый кластер: длина
+        self._extents_by_end = {}  # кластер, следующий за последним: первый кластер
+
+    def _build_extents(self):
+        self._extents_by_size = []
+        count_of_clusters = self._fat_proc.info.count_of_clusters
+        start = None
+        for first_clus in range(2, count_of_clusters, FAT_SCAN_CHUNK):
+            count = min(FAT_SCAN_CHUNK, count_of_clusters - first_clus)
+            for clus, val_clus in enumerate(self._fat_proc.read_fat_table(0, first_clus, count), first_clus):
+                if val_clus == 0:
+                    if start is None:
+                        start = clus
+                elif start is not None:
+                    self._add_extent(start, clus - start)
+                    start = None
+        if start is not None:
+            self._add_extent(start, count_of_clusters - start)
+
+    def get_count_of_free_clusters(self):
+        """
+        :return: int, количество кластеров во всех отрезках индекса
+        """
+        if self._extents_by_size is None:
+            self._build_extents()
+        return sum(self._extents_by_start.values())
+
+    def allocate(self, num_of_clusters: int):
+        """
+        Выделяет num_of_clusters свободных кластеров. Если есть отрезок, вмещающий все кластеры, используется наименьший
+        из таких, иначе кластеры набираются из наибольших отрезков
+        :param num_of_clusters: количество необходимых кластеров
+        :return: list [номера кластеров], None, если свободного места недостаточно
+        """
+        if num_of_clusters <= 0:
+            raise ValueError('Incorrect num_of_clusters: ' + str(num_of_clusters))
+        if self._extents_by_size is None:
+            self._build_extents()
+
+        result = []
+        while len(result) < num_of_clusters:
+            need = num_of_clusters - len(result)
+            pos = bisect.bisect_left(self._extents_by_size, (need, 0))
+            if pos == len(self._extents_by_size):
+                pos -= 1
+            if pos < 0:
+                self.release(result)
+                return None
+
+            length, start = self._extents_by_size[pos]
+            self._remove_extent(start, length)
+            taken = min(length, need)
+
+            bad_clus = self._find_used_cluster(start, taken)
+            if bad_clus is not None:
+                self._add_extent(start, bad_clus - start)
+                self._add_extent(bad_clus + 1, start + length - bad_clus - 1)
+                continue
+
+            self._add_extent(start + taken, length - taken)
+            result.extend(range(start, start + taken))
+        return result
+
+    def release(self, clusters: list):
+        """
+        Возвращает кластеры в индекс, объединяя их с соседними свободными отрезками
+        :param clusters: номера освободившихся кластеров
+        :return: None
+        """
+        if self._extents_by_size is None:
+            return  # отрезки ещё не построены, освободившиеся кластеры попадут в них при построении
+        for clus in clusters:
+            start, length = clus, 1
+
+            if start in self._extents_by_end:
+                prev_start = self._extents_by_end[start]
+                prev_length = self._extents_by_start[prev_start]
+                self._remove_extent(prev_start, prev_length)
+                start, length = prev_start, prev_length + length
+
+            if start + length in self._extents_by_start:
+                next_length = self._extents_by_start[start + length]
+                self._remove_extent(start + length, next_length)
+                length += next_length
+
+            self._add_extent(start, length)
+
+    def _find_used_cluster(self, start: int, length: int):
+        """
+        Ищет в отрезке кластер, который нельзя использовать (например, BAD CLUSTER)
+        :return: int, номер такого кластера, None - если весь отрезок свободен
+        """
+        for clus in range(start, start + length):
+            if self._fat_proc.get_value_fat_cluster(clus) != 0:
+                return clus
+        return None
+
+    def _add_extent(self, start: int, length: int):
+        if length <= 0:
+            return
+        bisect.insort(self._extents_by_size, (length, start))
+        self._extents_by_start[start] = length
+        self._extents_by_end[start + length] = start
+
+    def _remove_extent(self, start: int, length: int):
+        self._extents_by_size.pop(bisect.bisect_left(self._extents_by_size, (length, start)))
+        self._extents_by_start.pop(start)
+        self._extents_by_end.pop(start + length)
+
+
+def get_cluster_ranges(clusters: list):
+    """
+    Разбивает список кластеров на диапазоны идущих подряд кластеров с сохранением порядка
+    :param clusters: список номеров кластеров
+    :return: list [(первый кластер, количество кластеров)]
+    """
+    ranges = []
+    for clus in clusters:
+        if ranges and ranges[-1][0] + ranges[-1][1] == clus:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + 1)
+        else:
+            ranges.append((clus, 1))
+    return ranges
+
+
+def normalize_path(path: str):
+    """
+    Приводит путь внутри образа к виду, используемому в качестве ключа индекса путей: разделитель - '/', путь
+    начинается от корня, пустые части и пробелы по краям имён отбрасываются. Корень ('', '/' или '\\') - это '/'
+    :param path: путь до файла или директории внутри образа
+    :return: str
+    """
+    parts = [part.strip() for part in path.replace('\\', PATH_SEPARATOR).split(PATH_SEPARATOR)]
+    return PATH_SEPARATOR + PATH_SEPARATOR.join(part for part in parts if part != '')
+
+
+FAT_SCAN_CHUNK = 1 << 16  # количество значений таблицы FAT, считываемых одним чтением при просмотре всей таблицы
+
+
 def get_fragmentation_data(fat_processor: FatProcessor):
     """
-    Выдаёт данные о фрагментированности образа - float на отрезке [0, 100]
+    Выдаёт данные о фрагментированности образа - float на отрезке [0, 100]. Таблица FAT считывается частями по
+    FAT_SCAN_CHUNK значений, поэтому память не зависит от размера тома
     :param fat_processor: FatProcessor
     :return: float [0, 100]
     """
     incorrect_clusters = 0
     count = 0
-    for i in range(fat_processor.info.count_of_clusters):
-        val_clus = fat_processor.get_value_fat_cluster(i)
-        if val_clus == 0:
-            continue
-        count += 1
-        if fat_processor.is_end_cluster(val_clus):
-            continue
-        if val_clus != i + 1:
-            incorrect_clusters += 1
+    count_of_clusters = fat_processor.info.count_of_clusters
+    for first_clus in range(0, count_of_clusters, FAT_SCAN_CHUNK):
+        chunk_size = min(FAT_SCAN_CHUNK, count_of_clusters - first_clus)
+        fat_table = fat_processor.read_fat_table(0, first_clus, chunk_size)
+        for i, val_clus in enumerate(fat_table, first_clus):
+            if val_clus == 0:
+                continue
+            count += 1
+            if fat_processor.is_end_cluster(val_clus):
+                continue
+            if val_clus != i + 1:
+                incorrect_clusters += 1
     return incorrect_clusters * 100 / count
 
 
@@ -1,35 +1,39 @@
 from FileSystem import FileSystem
 from IOManager import IOManager
 from error_in_fat import ErrorDetector
+from progress import ProgressReporter
 from service_classes import InfoAboutImage
 import ImageTools
 
 
-def parse_disk_image(io_manager: IOManager):
+def parse_disk_image(io_manager: IOManager, progress: ProgressReporter or None = None, fat_cache_memory: int = 0):
     """
     Разбирает образ диска, доступ к которому получен через io_manager
     :param io_manager: менеджер, необходимый для работы с образом
+    :param progress: отчёт о прогрессе проверки таблиц FAT, None - не сообщать
+    :param fat_cache_memory: наибольший объём страничного кэша таблицы FAT в байтах (см. FatPageCache), 0 - без кэша
     :return: FileSystem
     """
     info = InfoAboutImage(io_manager)
 
-    f_processor = ImageTools.FatProcessor(info, io_manager)
+    f_processor = ImageTools.FatProcessor(info, io_manager, fat_cache_memory)
     error_detector = ErrorDetector(f_processor)
     d_parser = ImageTools.DirectoryParser(f_processor)
     ft_printer = ImageTools.FileTreePrinter(d_parser)
 
-    if error_detector.check_differences_fats():
+    if error_detector.check_differences_fats(progress):
         return FileSystem(info, f_processor, {}, error_detector)
 
     ft_indexer = ImageTools.FatTableIndexer(d_parser)
     full_indexed_fat_table = ft_indexer.get_full_indexed_fat_table()
+    path_index = ft_indexer.get_path_index()
 
-    if error_detector.analysis_fat_indexed_table(full_indexed_fat_table):
-        return FileSystem(info, f_processor, full_indexed_fat_table, error_detector)
+    if error_detector.analysis_fat_indexed_table(ft_indexer):
+        return FileSystem(info, f_processor, full_indexed_fat_table, error_detector, path_index)
 
     correct_indexed_fat_table = ft_indexer.get_correct_indexed_fat_table()
 
-    file_system = FileSystem(info, f_processor, correct_indexed_fat_table, error_detector)
+    file_system = FileSystem(info, f_processor, correct_indexed_fat_table, error_detector, path_index)
     file_system.set_file_tree_printer(ft_printer)
 
     return file_system
@@ -0,0 +1,139 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from random import Random
+
+from IOManager import IOManager
+from ImageTools import get_fragmentation_data
+from ParsingDiskImage import parse_disk_image
+from defrag import Defragmenter
+from fragm import Fragmenter
+from fsck import ConsistencyChecker
+
+
+BATCH_ACTIONS = ["check", "fragmentation", "defragmentation"]
+
+
+def process_image(path: str, action: str, num_of_swaps: int = 1000, seed: int or None = None):
+    """
+    Выполняет действие над одним образом без вопросов пользователю. Образы с различающимися таблицами FAT, зацикленными
+    или пересекающимися файлами не изменяются
+    :param path: путь до образа
+    :param action: одно из BATCH_ACTIONS
+    :param num_of_swaps: количество перемещений кластеров для фрагментации
+    :param seed: начальное значение генератора случайных чисел для фрагментации
+    :return: dict, результат обработки образа
+    """
+    result = {'image': path, 'action': action, 'status': 'ok'}
+    start = time.perf_counter()
+    try:
+        if action == 'check':
+            report = ConsistencyChecker(path, 1).check()
+            result['report'] = report
+            if not report['clean']:
+                result['status'] = 'errors'
+        else:
+            _change_image(path, action, num_of_swaps, seed, result)
+    except Exception as ex:
+        result['status'] = 'failed'
+        result['error'] = f'{type(ex).__name__}: {ex}'
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def _change_image(path: str, action: str, num_of_swaps: int, seed: int or None, result: dict):
+    """
+    Фрагментирует или дефрагментирует образ, записывая фрагментированность до и после в result
+    """
+    io_manager = IOManager(path)
+    try:
+        file_system = parse_disk_image(io_manager)
+        error_detector = file_system.get_error_detector()
+        if error_detector.is_differences_fats() or error_detector.is_looped_files() or \
+           error_detector.is_intersecting_files():
+            result['status'] = 'errors'
+            result['error'] = 'Image has FAT differences, looped or intersecting files, run "check" for details'
+            return
+
+        error_detector.clearing_fat_table(file_system.get_indexed_fat_table())
+        result['orphan_clusters_removed'] = len(error_detector.refresh_clus)
+        result['fragmentation_before'] = get_fragmentation_data(file_system.get_fat_processor())
+
+        if action == 'fragmentation':
+            Fragmenter(file_system, io_manager, Random(seed)).fragmentation(num_of_swaps)
+        else:
+            Defragmenter(file_system, io_manager).defragmentation()
+
+        result['fragmentation_after'] = get_fragmentation_data(file_system.get_fat_processor())
+    finally:
+        io_manager.close()
+
+
+def expand_images(patterns: list):
+    """
+    Раскрывает шаблоны путей до образов (glob), сохраняя порядок и убирая повторения
+    :param patterns: пути или шаблоны путей
+    :return: list [пути до образов]
+    """
+    images = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for image in matches:
+            if image not in images:
+                images.append(image)
+    return images
+
+
+def run_batch(images: list, action: str, output, workers: int or None = None, num_of_swaps: int = 1000,
+              seed: int or None = None):
+    """
+    Обрабатывает образы параллельно в пуле процессов и пишет результаты в output в формате NDJSON (одна строка JSON на
+    образ, по мере готовности)
+    :param images: пути до образов
+    :param action: одно из BATCH_ACTIONS
+    :param output: файловый объект для отчёта
+    :param workers: количество процессов, None - по числу процессоров
+    :return: dict {статус: количество образов}
+    """
+    summary = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(process_image, image, action, num_of_swaps, seed) for image in images]
+        for future in as_completed(futures):
+            result = future.result()
+            summary[result['status']] = summary.get(result['status'], 0) + 1
+            output.write(json.dumps(result, ensure_ascii=False) + '\n')
+            output.flush()
+    return summary
+
+
+if __name__ == '__main__':  # pragma: no cover
+    parser = argparse.ArgumentParser(description='Run one action over many FAT images in parallel, NDJSON report')
+    parser.add_argument("images", nargs='*', help='paths or glob patterns of FAT images')
+    parser.add_argument("-a", "--action", choices=BATCH_ACTIONS, required=True, help='action for every image')
+    parser.add_argument("-l", "--list", dest="image_list", type=str,
+                        help='file with paths of images, one per line')
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument("-o", "--output", type=str, help='NDJSON report file (default: stdout)')
+    parser.add_argument("--swaps", type=int, default=1000, help='number of swaps for "fragmentation"')
+    parser.add_argument("--seed", type=int, help='random seed for "fragmentation"')
+    parsed_args = parser.parse_args()
+
+    patterns = list(parsed_args.images)
+    if parsed_args.image_list is not None:
+        with open(parsed_args.image_list) as image_list:
+            patterns.extend(line.strip() for line in image_list if line.strip())
+    images = expand_images(patterns)
+    if not images:
+        print('Не указаны образы для обработки', file=sys.stderr)
+        raise SystemExit(2)
+
+    output = sys.stdout if parsed_args.output is None else open(parsed_args.output, 'w')
+    summary = run_batch(images, parsed_args.action, output, parsed_args.workers, parsed_args.swaps, parsed_args.seed)
+    if output is not sys.stdout:
+        output.close()
+    print(f'Обработано образов: {len(images)}, {summary}', file=sys.stderr)
+    raise SystemExit(0 if set(summary) == {'ok'} else 1)
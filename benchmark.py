@@ -0,0 +1,131 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import ImageTools
+from IOManager import IOManager
+from ParsingDiskImage import parse_disk_image
+from defrag import Defragmenter, PLACEMENT_POLICIES
+from service_classes import InfoAboutImage
+
+
+def benchmark_indexing(path: str, repeats: int):  # pragma: no cover
+    """
+    Замеряет время индексирования образа и память, занимаемую индексом
+    :param path: путь до образа
+    :param repeats: количество повторений замера времени
+    :return: dict с результатами замеров
+    """
+    io_manager = IOManager(path, read_only=True)
+    info = InfoAboutImage(io_manager)
+    d_parser = ImageTools.DirectoryParser(ImageTools.FatProcessor(info, io_manager))
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        ImageTools.FatTableIndexer(d_parser)
+    elapsed = (time.perf_counter() - start) / repeats
+
+    tracemalloc.start()
+    ft_indexer = ImageTools.FatTableIndexer(d_parser)
+    current_memory, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    io_manager.close()
+    return {
+        'indexed_clusters': len(ft_indexer.get_full_indexed_fat_table()),
+        'indexed_paths': len(ft_indexer.get_path_index()),
+        'seconds': elapsed,
+        'index_memory_bytes': current_memory,
+        'peak_memory_bytes': peak_memory
+    }
+
+
+def benchmark_tree_read(path: str, repeats: int):  # pragma: no cover
+    """
+    Замеряет скорость последовательного чтения образа при обходе дерева: директория, её файлы, затем поддиректории
+    (см. PathIndex.get_entries_in_tree_order), содержимое каждого файла читается целиком
+    :param path: путь до образа
+    :param repeats: количество повторений замера времени
+    :return: dict с результатами замеров, jumps - количество переходов чтения не к следующему кластеру
+    """
+    io_manager = IOManager(path, read_only=True)
+    f_proc = ImageTools.FatProcessor(InfoAboutImage(io_manager), io_manager)
+    entries = ImageTools.FatTableIndexer(ImageTools.DirectoryParser(f_proc)).get_path_index() \
+        .get_entries_in_tree_order()
+    fat_table = f_proc.read_fat_table(0)
+    bytes_per_cluster = f_proc.info.get_bytes_per_cluster()
+
+    runs = []
+    for entry in entries:
+        if entry.first_cluster_num < 2:
+            continue
+        chain = [entry.first_cluster_num]
+        while not f_proc.is_end_cluster(fat_table[chain[-1]]) and 2 <= fat_table[chain[-1]] < len(fat_table):
+            chain.append(fat_table[chain[-1]])
+        count_of_clusters = entry.get_count_of_clusters(bytes_per_cluster)
+        runs.extend(ImageTools.get_cluster_ranges(chain[:count_of_clusters] if count_of_clusters is not None
+                                                  else chain))
+    jumps = sum(1 for i in range(1, len(runs)) if runs[i][0] != runs[i - 1][0] + runs[i - 1][1])
+
+    buffer = bytearray(max([count for _, count in runs], default=0) * bytes_per_cluster)
+    view = memoryview(buffer)
+    count_of_bytes = sum(count for _, count in runs) * bytes_per_cluster
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for first_clus, count in runs:
+            io_manager.seek(f_proc.get_entry_for_cluster_in_data(first_clus))
+            io_manager.read_into(view[:count * bytes_per_cluster])
+    elapsed = (time.perf_counter() - start) / repeats
+
+    io_manager.close()
+    return {
+        'read_bytes': count_of_bytes,
+        'jumps': jumps,
+        'seconds': elapsed,
+        'mib_per_second': count_of_bytes / elapsed / (1 << 20) if elapsed > 0 else 0
+    }
+
+
+def benchmark_placement(path: str, repeats: int):  # pragma: no cover
+    """
+    Дефрагментирует копии образа с каждым порядком размещения файлов (см. PLACEMENT_POLICIES) и замеряет на них
+    скорость чтения при обходе дерева (см. benchmark_tree_read). Сам образ не изменяется
+    :param path: путь до образа
+    :param repeats: количество повторений замера времени
+    :return: dict {порядок размещения: результаты замера}
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for policy in PLACEMENT_POLICIES:
+            copy_path = os.path.join(directory, policy)
+            shutil.copyfile(path, copy_path)
+            io_manager = IOManager(copy_path)
+            Defragmenter(parse_disk_image(io_manager), io_manager).defragmentation(policy)
+            io_manager.close()
+            results[policy] = benchmark_tree_read(copy_path, repeats)
+    return results
+
+
+BENCHMARKS = {
+    'indexing': benchmark_indexing,
+    'tree_read': benchmark_tree_read,
+    'placement': benchmark_placement
+}
+
+
+if __name__ == '__main__':  # pragma: no cover
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="path to FAT image")
+    parser.add_argument("benchmark", choices=list(BENCHMARKS), help='benchmark to run. "indexing" - time and memory '
+                                                                    'of FAT table indexing, "tree_read" - sequential '
+                                                                    'read throughput of a tree traversal, "placement" '
+                                                                    '- "tree_read" after defragmentation of copies of '
+                                                                    'the image with every placement policy')
+    parser.add_argument("-r", "--repeats", type=int, default=5, help='number of timed runs')
+    parsed_args = parser.parse_args()
+
+    for key, value in BENCHMARKS[parsed_args.benchmark](parsed_args.path, parsed_args.repeats).items():
+        print(f'{key}: {value}')
@@ -0,0 +1,184 @@
+from FileSystem import FileSystem
+from IOManager import IOManager
+from ImageTools import DirectoryParser, FatProcessor, get_cluster_ranges, PATH_SEPARATOR
+from enums import TypeOfFAT
+from service_classes import DirectoryEntryInfo, is_long_name_attr
+
+
+class DirectoryCompactor:
+    """
+    Уплотнение директорий: записи каждой директории переписываются подряд без удалённых (0xE5) записей, а ставшие
+    ненужными кластеры в конце цепочки директории освобождаются
+
+    Записи остаются в прежнем порядке и на тех же кластерах цепочки, поэтому новая входная точка записи - входная точка
+    слота, номер которого равен номеру записи среди оставшихся. Входные точки записей в индексе (а значит и в
+    IndexedEntryInfo) обновляются, записи '.' и '..' каждой поддиректории переписываются по актуальным номерам
+    первых кластеров
+    """
+
+    DOT_NAME = b'.          '
+    DOT_DOT_NAME = b'..         '
+
+    def __init__(self, file_system: FileSystem, io_manager: IOManager):
+        """
+        :param file_system: Актуальная файловая система для образа
+        :param io_manager: Актуальный IOManager для образа
+        """
+        self._file_system = file_system
+        self._io_manager = io_manager
+        self._f_proc = file_system.get_fat_processor()
+        self._info = self._f_proc.info
+        self._end_clus_val = (FatProcessor.END_CLUSTER_IN_WIN_FAT_16 if self._info.fat_type == TypeOfFAT.fat16 else
+                              FatProcessor.END_CLUSTER_IN_WIN_FAT_32)
+        self._entries_by_point = {}
+
+    def compaction(self):
+        """
+        Уплотняет все директории образа
+        :return: (количество переписанных директорий, количество освобождённых кластеров)
+        """
+        entries = self._file_system.get_path_index().get_entries_in_tree_order()
+        self._entries_by_point = {e.entry_point: e for e in entries}
+
+        count_of_directories = 0
+        count_of_freed_clusters = 0
+        stack = [(self._file_system.get_entry_by_path(PATH_SEPARATOR), None)]
+        while stack:
+            dir_entry, parent_entry = stack.pop()
+            if parent_entry is None:
+                parent_first_clus = None
+            elif parent_entry.attr is None:
+                parent_first_clus = 0  # '..' поддиректории корня указывает на кластер 0
+            else:
+                parent_first_clus = parent_entry.first_cluster_num
+
+            changed, freed_clusters, sub_directories = self._compact_directory(dir_entry, parent_first_clus)
+            self._io_manager.safe_point()
+            count_of_directories += changed
+            count_of_freed_clusters += freed_clusters
+            stack.extend((sub_directory, dir_entry) for sub_directory in reversed(sub_directories))
+        return count_of_directories, count_of_freed_clusters
+
+    def _get_directory_clusters(self, dir_entry: DirectoryEntryInfo):
+        """
+        Цепочка кластеров директории
+        :return: list [int], пустой, если цепочка зациклена или выходит за пределы таблицы FAT (такая директория
+                 не уплотняется)
+        """
+        clusters = []
+        visited = set()
+        clus = dir_entry.first_cluster_num
+        while 2 <= clus and not self._f_proc.is_end_cluster(clus) and not self._f_proc.is_bad_cluster(clus):
+            if clus in visited or clus > self._info.count_of_clusters:
+                return []
+            visited.add(clus)
+            clusters.append(clus)
+            clus = self._f_proc.get_value_fat_cluster(clus)
+        return clusters
+
+    def _compact_directory(self, dir_entry: DirectoryEntryInfo, parent_first_clus: int or None):
+        """
+        Уплотняет одну директорию
+        :param dir_entry: запись о директории (для корня - запись индекса с именем '\\')
+        :param parent_first_clus: первый кластер родительской директории для записи '..', None - для корня
+        :return: (bool, была ли директория переписана; количество освобождённых кластеров;
+                 list [DirectoryEntryInfo] поддиректорий)
+        """
+        if dir_entry.attr is None and self._info.fat_type == TypeOfFAT.fat16:
+            clusters = None
+            segments = [(self._info.first_root_dir_sec, self._info.BPB_RootEntCnt * DirectoryParser.ENTRY_SIZE)]
+        else:
+            clusters = self._get_directory_clusters(dir_entry)
+            if not clusters:
+                return False, 0, []
+            segments = [(self._f_proc.get_entry_for_cluster_in_data(clus), self._info.get_bytes_per_cluster())
+                        for clus in clusters]
+
+        raw = bytearray()
+        slot_points = []
+        for point, length in segments:
+            self._io_manager.seek(point)
+            raw += self._io_manager.read_some_bytes(length)
+            slot_points.extend(range(point, point + length, DirectoryParser.ENTRY_SIZE))
+
+        kept = self._get_kept_slots(raw)
+        compacted = bytearray()
+        sub_directories = []
+        moves = []
+        for new_num, old_num in enumerate(kept):
+            entry_raw = bytearray(raw[old_num * DirectoryParser.ENTRY_SIZE:(old_num + 1) * DirectoryParser.ENTRY_SIZE])
+            if not is_long_name_attr(entry_raw[11]):
+                if entry_raw[:11] == DirectoryCompactor.DOT_NAME:
+                    self._set_first_cluster(entry_raw, dir_entry.first_cluster_num)
+                elif entry_raw[:11] == DirectoryCompactor.DOT_DOT_NAME and parent_first_clus is not None:
+                    self._set_first_cluster(entry_raw, parent_first_clus)
+                else:
+                    entry = self._entries_by_point.get(slot_points[old_num])
+                    if entry is not None:
+                        moves.append((entry, slot_points[new_num]))
+                        if entry.attr.is_directory():
+                            sub_directories.append(entry)
+            compacted += entry_raw
+
+        if clusters is None:
+            count_of_needed = 1
+            size = len(raw)
+        else:
+            count_of_needed = max(1, -(-len(compacted) // self._info.get_bytes_per_cluster()))
+            size = count_of_needed * self._info.get_bytes_per_cluster()
+        compacted += bytes(size - len(compacted))
+
+        if compacted == raw[:size] and (clusters is None or count_of_needed == len(clusters)):
+            return False, 0, sub_directories
+
+        offset = 0
+        for point, length in segments[:count_of_needed] if clusters is not None else segments:
+            if compacted[offset:offset + length] != raw[offset:offset + length]:
+                self._io_manager.seek(point)
+                self._io_manager.write_some_bytes(bytes(compacted[offset:offset + length]))
+            offset += length
+
+        for entry, _ in moves:
+            self._entries_by_point.pop(entry.entry_point, None)
+        for entry, new_point in moves:
+            entry.entry_point = new_point
+            self._entries_by_point[new_point] = entry
+
+        freed_clusters = clusters[count_of_needed:] if clusters is not None else []
+        if freed_clusters:
+            indexed_table = self._file_system.get_indexed_fat_table()
+            self._f_proc.write_val_in_all_fat(self._end_clus_val, clusters[count_of_needed - 1])
+            for first_clus, count in get_cluster_ranges(sorted(freed_clusters)):
+                self._f_proc.write_val_range_in_all_fat(0, first_clus, count)
+            for clus in freed_clusters:
+                indexed_table.pop(clus, None)
+        return True, len(freed_clusters), sub_directories
+
+    @staticmethod
+    def _get_kept_slots(raw: bytes):
+        """
+        Номера слотов директории, которые остаются после уплотнения: все записи до конца записей (0x00), кроме
+        удалённых, и записи длинных имён, относящиеся к оставшимся коротким записям
+        :param raw: содержимое директории
+        :return: list [int]
+        """
+        kept = []
+        long_name_slots = []
+        for num in range(len(raw) // DirectoryParser.ENTRY_SIZE):
+            offset = num * DirectoryParser.ENTRY_SIZE
+            if raw[offset] == DirectoryParser.END_OF_RECORDS:
+                break
+            if raw[offset] == DirectoryParser.EMPTY_RECORD:
+                long_name_slots = []
+            elif is_long_name_attr(raw[offset + 11]):
+                long_name_slots.append(num)
+            else:
+                kept.extend(long_name_slots)
+                kept.append(num)
+                long_name_slots = []
+        return kept
+
+    @staticmethod
+    def _set_first_cluster(entry_raw: bytearray, first_clus: int):
+        entry_raw[20:22] = (first_clus >> 16).to_bytes(2, 'little')
+        entry_raw[26:28] = (first_clus & 0xFFFF).to_bytes(2, 'little')
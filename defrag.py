@@ -1,6 +1,7 @@
 from FileSystem import FileSystem
 from IOManager import IOManager
-from ImageTools import ClusterSwapper
+from ImageTools import ClusterSwapper, FreeSpaceIndex, get_fragmentation_data, normalize_path
+from progress import ProgressReporter
 from service_classes import DirectoryEntryInfo, IndexedEntryInfo
 
 
@@ -18,10 +19,19 @@ class Defragmenter:
         self._cluster_swapper = ClusterSwapper(file_system.get_indexed_fat_table(), file_system.get_fat_processor(),
                                                io_manager)
 
-    def defragmentation(self):  # подробнее описание алгоритма смотреть в README
-        all_dir_entries_info_list = self._file_system.get_a_set_all_dir_entries_info()
+    def defragmentation(self, policy: str = 'any', progress: ProgressReporter or None = None):
+        """
+        Подробнее описание алгоритма смотреть в README
+        :param policy: порядок, в котором файлы выстраиваются с начала образа (см. PLACEMENT_POLICIES)
+        :param progress: отчёт о прогрессе, None - не сообщать
+        """
+        all_dir_entries_info_list = PLACEMENT_POLICIES[policy](self._file_system)
         f_proc = self._file_system.get_fat_processor()
         ind_table = self._file_system.get_indexed_fat_table()
+        bytes_per_swap = 2 * f_proc.info.get_bytes_per_cluster()
+        if progress is not None:
+            total = sum(1 for e in ind_table.values() if e.dir_entry_info.name != '\\')
+            progress.start('defragmentation', total, lambda: get_fragmentation_data(f_proc))
 
         current_cluster = 2
 
@@ -39,6 +49,9 @@ class Defragmenter:
                     continue
 
                 self._cluster_swapper.swap_cluster(current_cluster, current_file_cluster)
+                self._io_manager.safe_point()
+                if progress is not None:
+                    progress.update(1, bytes_per_swap if current_cluster != current_file_cluster else 0)
                 next_clus = f_proc.get_value_fat_cluster(current_cluster)
 
                 if f_proc.is_end_cluster(next_clus):
@@ -48,3 +61,130 @@ class Defragmenter:
                     current_file_cluster = next_clus
 
                 current_cluster += 1
+
+        if progress is not None:
+            progress.finish()
+
+    def defragmentation_of_path(self, path: str):
+        """
+        Дефрагментирует только файл или файлы поддерева директории, расположенных по пути path. Каждый фрагментированный
+        файл переносится в наиболее подходящий непрерывный отрезок свободного места, остальные кластеры образа не
+        затрагиваются, поэтому время работы пропорционально размеру выбранных файлов, а не образа
+        :param path: путь до файла или директории от корня образа
+        :return: int, количество перемещённых файлов
+        """
+        free_space = FreeSpaceIndex(self._file_system.get_fat_processor())
+        moved_files = 0
+
+        for dir_entry_info in self._get_files_by_path(path):
+            if self._relocate_file(dir_entry_info, free_space):
+                moved_files += 1
+        return moved_files
+
+    def _get_files_by_path(self, path: str):
+        """
+        Получение записей всех файлов по пути path: самого файла или всех файлов поддерева директории
+        :param path: путь до файла или директории от корня образа
+        :return: list [DirectoryEntryInfo]
+        """
+        path = normalize_path(path)
+        entry = self._file_system.get_entry_by_path(path)
+        if entry is None:
+            raise ValueError(f'Path "{path}" does not exist')
+        if entry.attr is not None and not entry.attr.is_directory():
+            return [entry]
+
+        return [e for e in self._file_system.get_path_index().get_entries_in_tree_order(path)
+                if e.attr is not None and not e.attr.is_directory() and not e.attr.volume_id]
+
+    def _relocate_file(self, dir_entry_info: DirectoryEntryInfo, free_space: FreeSpaceIndex):
+        """
+        Переносит фрагментированный файл в свободные кластеры, выделенные free_space. Файл переносится, только если
+        после переноса он будет состоять из меньшего числа фрагментов
+        :param dir_entry_info: запись о файле
+        :param free_space: индекс свободного места
+        :return: bool, был ли перенесён файл
+        """
+        f_proc = self._file_system.get_fat_processor()
+        expected_count = dir_entry_info.get_count_of_clusters(f_proc.info.get_bytes_per_cluster())
+
+        chain = []
+        current_cluster = dir_entry_info.first_cluster_num
+        while current_cluster != 0 and not f_proc.is_end_cluster(current_cluster):
+            if f_proc.is_bad_cluster(current_cluster) or not 2 <= current_cluster <= f_proc.info.count_of_clusters:
+                return False  # цепочка ведёт в BAD CLUSTER или за пределы таблицы - такой файл не переносится
+            if expected_count is not None and len(chain) == expected_count:
+                return False  # цепочка длиннее размера файла - такой файл не переносится
+            chain.append(current_cluster)
+            current_cluster = f_proc.get_value_fat_cluster(current_cluster)
+
+        if self._count_fragments(chain) <= 1:
+            return False
+
+        new_clusters = free_space.allocate(len(chain))
+        if new_clusters is None:
+            return False
+        if self._count_fragments(new_clusters) >= self._count_fragments(chain):
+            free_space.release(new_clusters)
+            return False
+
+        for old_clus, new_clus in zip(chain, new_clusters):
+            self._cluster_swapper.swap_cluster(new_clus, old_clus)
+            self._io_manager.safe_point()
+        free_space.release(chain)
+        return True
+
+    @staticmethod
+    def _count_fragments(clusters: list):
+        """
+        Количество непрерывных участков в цепочке кластеров
+        :param clusters: цепочка кластеров
+        :return: int
+        """
+        return sum(1 for i in range(len(clusters)) if i == 0 or clusters[i] != clusters[i - 1] + 1)
+
+
+def place_in_any_order(file_system: FileSystem):
+    """
+    Файлы в произвольном порядке (порядке обхода множества записей)
+    :return: list [DirectoryEntryInfo]
+    """
+    return list(file_system.get_a_set_all_dir_entries_info())
+
+
+def place_by_directories(file_system: FileSystem):
+    """
+    Файлы в порядке обхода дерева: за кластерами директории сразу идут её файлы, затем поддиректории. Обход дерева
+    читает образ почти последовательно
+    :return: list [DirectoryEntryInfo]
+    """
+    indexed_entries = file_system.get_a_set_all_dir_entries_info()
+    return [e for e in file_system.get_path_index().get_entries_in_tree_order() if e in indexed_entries]
+
+
+def place_by_size(file_system: FileSystem):
+    """
+    Сначала директории в порядке обхода дерева, затем файлы по возрастанию размера: мелкие файлы оказываются рядом
+    с директориями и друг с другом
+    :return: list [DirectoryEntryInfo]
+    """
+    entries = place_by_directories(file_system)
+    return sorted(entries, key=lambda e: (e.attr is None or not e.attr.is_directory(), e.file_size))
+
+
+def place_by_recency(file_system: FileSystem):
+    """
+    Файлы по убыванию даты последнего доступа (LstAccDate), при равных датах - времени последней записи (WrtDate,
+    WrtTime): недавно использованные файлы оказываются в начале образа рядом друг с другом
+    :return: list [DirectoryEntryInfo]
+    """
+    entries = place_by_directories(file_system)
+    return sorted(entries, key=lambda e: (e.access_date, e.write_time), reverse=True)
+
+
+PLACEMENT_POLICIES = {
+    'any': place_in_any_order,
+    'directories': place_by_directories,
+    'size': place_by_size,
+    'recency': place_by_recency
+}
@@ -1,8 +1,11 @@
+import itertools
+import operator
 import random
 
 import ImageTools
 from FileSystem import FileSystem
 from enums import TypeOfFAT
+from progress import ProgressReporter
 
 
 class ErrorDetector:
@@ -15,7 +18,7 @@ class ErrorDetector:
         self.looped_files = None
         self.intersecting_files = None
         self.refresh_clus = None
-        self._name_of_indexed_files_to_remove = set()
+        self._entry_points_of_removed_files = set()
 
     def is_differences_fats(self):
         """
@@ -55,93 +58,99 @@ class ErrorDetector:
         """
         return self.refresh_clus is not None and len(self.refresh_clus) != 0
 
-    def check_differences_fats(self):
+    def check_differences_fats(self, progress: ProgressReporter or None = None):
         """
         Проверяет таблицы FAT на совпадение, результат проверки сохраняет в специальное поле
+        :param progress: отчёт о прогрессе (по одной таблице FAT), None - не сообщать
         :return: True, если некторые кластеры в таблицах отличаются, False, если не отличаются
         """
-        self.differences_fats_detected = []
-
-        info = self._fat_proc.info
-        for i in range(info.count_of_clusters):
-            value_in_first_fat = self._fat_proc.get_cluster_value_in_certain_fat(i, 0)
-            for j in range(info.BPB_NumFATs):
-                if value_in_first_fat != self._fat_proc.get_cluster_value_in_certain_fat(i, j):
-                    self.differences_fats_detected.append(i)
+        self.differences_fats_detected = find_differences_fats(self._fat_proc, progress=progress)
         return self.is_differences_fats()
 
-    def analysis_fat_indexed_table(self, indexed_table):
+    def analysis_fat_indexed_table(self, ft_indexer: ImageTools.FatTableIndexer):
         """
-        Проверяет образ на наличие зацикленных и пересекающихся файлов. Все найденные файлы сохраняет во внутренние
-        структуры
-        :param indexed_table: индексированная таблица FAT
+        Проверяет образ на наличие зацикленных и пересекающихся файлов, найденных при индексировании таблицы FAT. Все
+        найденные файлы сохраняет во внутренние структуры
+        :param ft_indexer: индексатор таблицы FAT
         :return: bool, были ли найдены зацикленныые или пересекающиеся файлы
         """
-        self.looped_files = []
-        self.intersecting_files = []
-
-        for ind in indexed_table:
-            list_values = indexed_table[ind]
-            if len(list_values) == 1:
-                continue
-
-            d = {}
-            for entity in list_values:
-                if entity.dir_entry_info.name in d:
-                    self.looped_files.append(entity)
-                else:
-                    d[entity.dir_entry_info.name] = entity
-
-            if len(d):
-                self.intersecting_files.append(list(d.values()))
+        self.looped_files = list(ft_indexer.get_looped_files())
+        self.intersecting_files = [list(entries) for entries in ft_indexer.get_intersecting_files()]
 
         return self.is_intersecting_files() or self.is_looped_files()
 
-    def clearing_fat_table(self, indexed_table):
+    def clearing_fat_table(self, indexed_table, progress: ProgressReporter or None = None):
         """
-        Ищет и очищает таблицу FAT от сиротских кластеров
+        Ищет и очищает таблицу FAT от сиротских кластеров: кластеров с ненулевым значением в FAT, которые не
+        принадлежат ни одному файлу (в том числе удалённому при исправлении ошибок). Таблица FAT считывается частями
+        (см. get_orphan_clusters), а обнуление идущих подряд сиротских кластеров делается одной записью в каждую
+        таблицу FAT
         :param indexed_table:
+        :param progress: отчёт о прогрессе поиска, None - не сообщать
         :return: bool, были ли найдены сиротские файлы
         """
-        info = self._fat_proc.info
-        refresh_clus = []
-        for i in range(2, info.count_of_clusters):
-            if (self._fat_proc.get_value_fat_cluster(i) != 0 and i != 1 and i not in indexed_table) or\
-               self._check_name_to_remove(i, indexed_table):
-                self._fat_proc.write_val_in_all_fat(0, i)
-                refresh_clus.append(i)
+        refresh_clus = self.get_orphan_clusters(indexed_table, progress)
+
+        for first_clus, count in ImageTools.get_cluster_ranges(refresh_clus):
+            self._fat_proc.write_val_range_in_all_fat(0, first_clus, count)
+
         self.refresh_clus = refresh_clus
         return self.found_orphan_clusters()
 
-    def _check_name_to_remove(self, clus_num: int, indexed_table):
+    def get_orphan_clusters(self, indexed_table, progress: ProgressReporter or None = None):
         """
-        Проверка на принадлежность имени файла, которому принадлежит текущий кластер, к сиписку файлов на удаление
-        :param clus_num: номер кластера
+        Ищет сиротские кластеры, ничего не изменяя в образе. Таблица FAT считывается частями по FAT_SCAN_CHUNK значений
         :param indexed_table: индексированная таблица FAT
-        :return: bool, результат проверки
-        """
-        if clus_num not in indexed_table:
-            return False
-        if type(indexed_table[clus_num]) == list:
-            for entry in indexed_table[clus_num]:
-                if entry.dir_entry_info.name in self._name_of_indexed_files_to_remove:
-                    return True
-            return False
-        else:
-            return indexed_table[clus_num].dir_entry_info.name in self._name_of_indexed_files_to_remove
+        :param progress: отчёт о прогрессе поиска (после каждой считанной части), None - не сообщать
+        :return: list [номера сиротских кластеров по возрастанию]
+        """
+        length = self._fat_proc.info.count_of_clusters + 1
+        if progress is not None:
+            progress.start('orphan_clusters', length)
+        owned = self._get_ownership_bitmap(indexed_table, length)
+        orphan_clusters = []
+        for first_clus in range(0, length, ImageTools.FAT_SCAN_CHUNK):
+            count = min(ImageTools.FAT_SCAN_CHUNK, length - first_clus)
+            fat_table = self._fat_proc.read_fat_table(0, first_clus, count)
+            orphan_clusters.extend(find_orphan_clusters(self._fat_proc, fat_table,
+                                                        owned[first_clus:first_clus + count], first_clus))
+            if progress is not None:
+                progress.update(count)
+        if progress is not None:
+            progress.finish()
+        return orphan_clusters
+
+    def _get_ownership_bitmap(self, indexed_table, length: int):
+        """
+        Получение битовой карты занятости кластеров: 1 - кластер принадлежит хотя бы одному файлу, не удалённому при
+        исправлении ошибок, или зарезервирован (0 и 1-й кластеры)
+        :param indexed_table: индексированная таблица FAT
+        :param length: длина карты
+        :return: bytearray
+        """
+        owned = bytearray(length)
+        owned[0:2] = b'\x01\x01'
+
+        for clus, indexed_entries in indexed_table.items():
+            if clus >= length:
+                continue
+            if type(indexed_entries) != list:
+                indexed_entries = [indexed_entries]
+            for entry in indexed_entries:
+                if entry.dir_entry_info.entry_point not in self._entry_points_of_removed_files:
+                    owned[clus] = 1
+                    break
+        return owned
 
     def fix_differences_fats(self, correct_fat_table_num: int):
         """
-        Исправление несовпадения таблиц FAT
+        Исправление несовпадения таблиц FAT: значения различающихся кластеров считываются из корректной таблицы и
+        записываются во все таблицы FAT (см. FatProcessor.get_values, FatProcessor.set_values)
         :param correct_fat_table_num: номер корректной таблицы FAT
         :return: None
         """
-        for clus in self.differences_fats_detected:
-            correct_value = self._fat_proc.get_cluster_value_in_certain_fat(clus, correct_fat_table_num)
-            for fat_num in range(self._fat_proc.info.BPB_NumFATs):
-                if fat_num == correct_fat_table_num:
-                    continue
-                self._fat_proc.write_val_in_certain_fat(correct_value, clus, fat_num)
+        clusters = self.differences_fats_detected
+        self._fat_proc.set_values(clusters, self._fat_proc.get_values(clusters, correct_fat_table_num))
         self.differences_fats_detected = []
 
     def fix_looped_files(self):
@@ -152,7 +161,7 @@ class ErrorDetector:
         dir_parser = ImageTools.DirectoryParser(self._fat_proc)
         for entry in self.looped_files:
             dir_parser.delete_entry_in_directory(entry.dir_entry_info.entry_point)
-            self._name_of_indexed_files_to_remove.add(entry.dir_entry_info.name)
+            self._entry_points_of_removed_files.add(entry.dir_entry_info.entry_point)
         self.looped_files = []
 
     def fix_intersecting_files(self):
@@ -164,10 +173,60 @@ class ErrorDetector:
         for list_entries in self.intersecting_files:
             for entry in list_entries:
                 dir_parser.delete_entry_in_directory(entry.dir_entry_info.entry_point)
-                self._name_of_indexed_files_to_remove.add(entry.dir_entry_info.name)
+                self._entry_points_of_removed_files.add(entry.dir_entry_info.entry_point)
         self.intersecting_files = []
 
 
+def find_differences_fats(fat_proc: ImageTools.FatProcessor, first_clus: int = 0, count: int or None = None,
+                          progress: ProgressReporter or None = None):
+    """
+    Ищет кластеры, значения которых различаются в таблицах FAT. Таблицы сравниваются частями по FAT_SCAN_CHUNK значений,
+    каждая часть таблицы считывается одним чтением
+    :param fat_proc: FatProcessor образа
+    :param first_clus: номер первого проверяемого кластера
+    :param count: количество проверяемых кластеров, None - до конца таблицы
+    :param progress: отчёт о прогрессе (после каждой сравненной части), None - не сообщать
+    :return: list [номера кластеров по возрастанию]
+    """
+    if count is None:
+        count = fat_proc.info.count_of_clusters + 1 - first_clus
+    if progress is not None:
+        progress.start('differences_fats', count * fat_proc.info.BPB_NumFATs)
+    differences = []
+    end = first_clus + count
+    for chunk_first in range(first_clus, end, ImageTools.FAT_SCAN_CHUNK):
+        chunk_size = min(ImageTools.FAT_SCAN_CHUNK, end - chunk_first)
+        first_fat = fat_proc.read_fat_table(0, chunk_first, chunk_size)
+        chunk_differences = set()
+        for fat_num in range(1, fat_proc.info.BPB_NumFATs):
+            other_fat = fat_proc.read_fat_table(fat_num, chunk_first, chunk_size)
+            if other_fat == first_fat:
+                continue
+            changed = itertools.compress(range(chunk_size), map(operator.ne, first_fat, other_fat))
+            chunk_differences.update(chunk_first + i for i in changed)
+        differences.extend(sorted(chunk_differences))
+        if progress is not None:
+            progress.update(chunk_size * fat_proc.info.BPB_NumFATs)
+    if progress is not None:
+        progress.finish()
+    return differences
+
+
+def find_orphan_clusters(fat_proc: ImageTools.FatProcessor, fat_table, owned, first_clus: int = 0):
+    """
+    Ищет сиротские кластеры: ненулевые в таблице FAT и не отмеченные в битовой карте занятости. Кластеры, отмеченные
+    как BAD CLUSTER, сиротскими не считаются
+    :param fat_proc: FatProcessor образа
+    :param fat_table: значения идущих подряд кластеров таблицы FAT (см. FatProcessor.read_fat_table)
+    :param owned: битовая карта занятости тех же кластеров, 1 - кластер занят
+    :param first_clus: номер кластера, значение которого - первый элемент fat_table
+    :return: list [номера кластеров]
+    """
+    return [first_clus + i for i in itertools.compress(range(len(fat_table)),
+                                                       map(operator.gt, map(bool, fat_table), owned))
+            if first_clus + i < fat_proc.info.count_of_clusters and not fat_proc.is_bad_cluster(fat_table[i])]
+
+
 class ErrorMaker:
     """
     Класс внесения ошибок
@@ -197,47 +256,39 @@ class ErrorMaker:
 
     def make_looped_file(self, name_dir: str):
         """
-        Создаёт зацикленный файл в директории с названием name_dir, отличной от корневой директории
-        :param name_dir: название директории, в которой будет создан зацикленный файл
+        Создаёт зацикленный файл в директории name_dir
+        :param name_dir: путь до директории, в которой будет создан зацикленный файл
         :return: None
         """
         empty_entry_point = self._get_free_entry_point_in_dir(name_dir)
 
-        free_clusters = ImageTools.find_empty_clusters(3, self._info, self._file_system.get_indexed_fat_table())
+        free_clusters = self._ft_proc.find_free_clusters(3)
 
         if free_clusters is None:
             raise ValueError("Not enough free image clusters. Clusters required: " + str(3))
 
         self._dir_parser.create_entry_in_directory(empty_entry_point, 'ERRORLOOP  ', 0x00, free_clusters[0])
 
-        for i in range(len(free_clusters)):
-            if i == len(free_clusters) - 1:
-                self._ft_proc.write_val_in_all_fat(free_clusters[0], free_clusters[i])
-            else:
-                self._ft_proc.write_val_in_all_fat(free_clusters[i + 1], free_clusters[i])
+        self._ft_proc.set_values(free_clusters, free_clusters[1:] + free_clusters[:1])
 
     def make_intersecting_files(self, name_dir: str):
         """
-        Создаёт два пересекающихся файла в директории с названием name_dir, отличной от корневой директории
-        :param name_dir: название директории, в которой будут созданы файлы
+        Создаёт два пересекающихся файла в директории name_dir
+        :param name_dir: путь до директории, в которой будут созданы файлы
         :return: None
         """
         empty_entry_point = self._get_free_entry_point_in_dir(name_dir)
-        free_clusters = ImageTools.find_empty_clusters(3, self._info, self._file_system.get_indexed_fat_table())
+        free_clusters = self._ft_proc.find_free_clusters(3)
 
         if free_clusters is None:
             raise ValueError("Not enough free image clusters. Clusters required: " + str(3))
 
         self._dir_parser.create_entry_in_directory(empty_entry_point, 'ERRINTERSEC', 0x00, free_clusters[0])
 
-        for i in range(len(free_clusters)):
-            if i == len(free_clusters) - 1:
-                self._ft_proc.write_val_in_all_fat(self.end_clus_val, free_clusters[i])
-            else:
-                self._ft_proc.write_val_in_all_fat(free_clusters[i + 1], free_clusters[i])
+        self._ft_proc.set_values(free_clusters, free_clusters[1:] + [self.end_clus_val])
 
         empty_entry_point = self._get_free_entry_point_in_dir(name_dir)
-        new_free_clusters = ImageTools.find_empty_clusters(1, self._info, self._file_system.get_indexed_fat_table())
+        new_free_clusters = self._ft_proc.find_free_clusters(1)
 
         if new_free_clusters is None:
             raise ValueError("Not enough free image clusters. Clusters required: " + str(1))
@@ -248,20 +299,17 @@ class ErrorMaker:
     def _get_free_entry_point_in_dir(self, name_dir: str):
         """
         Получение точки входа для свободной записи в директории name_dir
-        :param name_dir: название директории
+        :param name_dir: путь до директории от корня образа
         :return: int, точка входа в свободную записись
         """
-        if name_dir == '\\':
+        if ImageTools.normalize_path(name_dir) == ImageTools.PATH_SEPARATOR:
             dir_entry_point = self._file_system.get_fat_processor().info.first_root_dir_sec
         else:
-            set_of_files = self._file_system.get_a_set_all_dir_entries_info()
+            dir_entry_info = self._file_system.get_entry_by_path(name_dir)
 
-            for dir_entry_info in set_of_files:
-                if dir_entry_info.name.strip() == name_dir.strip() and dir_entry_info.attr.is_directory():
-                    dir_entry_point = self._ft_proc.get_entry_for_cluster_in_data(dir_entry_info.first_cluster_num)
-                    break
-            else:
+            if dir_entry_info is None or not dir_entry_info.attr.is_directory():
                 raise ValueError(f"Directory \"{name_dir}\" does not exist")
+            dir_entry_point = self._ft_proc.get_entry_for_cluster_in_data(dir_entry_info.first_cluster_num)
 
         empty_entry_point = self._dir_parser.find_empty_entry_in_directory(dir_entry_point)
 
@@ -0,0 +1,114 @@
+import os
+import sys
+
+from FileSystem import FileSystem
+from ImageTools import DirectoryParser, FatPageCache, FileReader, normalize_path, PATH_SEPARATOR
+from enums import TypeOfFAT
+from service_classes import DirectoryEntryInfo
+
+
+class Extractor:
+    """
+    Копирование файлов и директорий из образа в файловую систему компьютера
+
+    Цепочки файлов проходятся через один на всё копирование страничный кэш таблицы FAT (кэш FatProcessor, а если его
+    нет - свой, на FAT_CACHE_MEMORY байт), файлы читаются через FileReader отрезками подряд идущих кластеров в один
+    переиспользуемый буфер. Файлы и директории, которые не удалось скопировать (оборванная цепочка кластеров,
+    недопустимое имя), пропускаются с сообщением в stderr
+    """
+
+    BUFFER_SIZE = 1 << 20
+    FAT_CACHE_MEMORY = 1 << 20
+
+    def __init__(self, file_system: FileSystem):
+        self._file_system = file_system
+        self._f_proc = file_system.get_fat_processor()
+        self._dir_parser = DirectoryParser(self._f_proc)
+        self._fat_cache = self._f_proc.cache if self._f_proc.cache is not None else \
+            FatPageCache(self._f_proc.accessor, self._f_proc.info.BPB_NumFATs, Extractor.FAT_CACHE_MEMORY)
+        self._buffer = bytearray(Extractor.BUFFER_SIZE)
+
+    def extract(self, path: str, destination: str):
+        """
+        Копирует файл или поддерево директории, расположенные по пути path, в директорию destination
+        :param path: путь до файла или директории от корня образа
+        :param destination: директория, в которую копируются файлы
+        :return: (количество скопированных файлов, количество скопированных байт, количество пропущенных файлов и
+                 директорий)
+        :raises ValueError: путь не существует или единственный копируемый файл скопировать нельзя
+        """
+        path = normalize_path(path)
+        entry = self._file_system.get_entry_by_path(path)
+        if entry is None:
+            raise ValueError(f'Path "{path}" does not exist')
+
+        os.makedirs(destination, exist_ok=True)
+        if entry.attr is not None and not entry.attr.is_directory():
+            return 1, self._extract_file(entry, os.path.join(destination, get_file_name(entry))), 0
+
+        count_of_files = 0
+        count_of_bytes = 0
+        count_of_skipped = 0
+        visited = set()  # первые кластеры пройденных директорий, защита от зацикленного дерева директорий
+        stack = [(entry, destination, path)]
+        while stack:
+            dir_entry, dir_destination, dir_path = stack.pop()
+            if dir_entry.first_cluster_num in visited:
+                continue
+            visited.add(dir_entry.first_cluster_num)
+            try:
+                os.makedirs(dir_destination, exist_ok=True)
+                if dir_entry.name == '\\' and self._f_proc.fat_type == TypeOfFAT.fat16:
+                    dir_info = self._dir_parser.get_fat16_root_directory_info()
+                else:
+                    dir_info = self._dir_parser.get_full_directory_info(dir_entry.first_cluster_num)
+            except ValueError as ex:
+                print(f'{dir_path}: {ex.args[0]}', file=sys.stderr)
+                count_of_skipped += 1
+                continue
+
+            for f in dir_info.entries_list:
+                if f.is_dot_entry() or f.attr.volume_id:
+                    continue
+                f_path = normalize_path(dir_path + PATH_SEPARATOR + f.get_path_name())
+                try:
+                    f_destination = os.path.join(dir_destination, get_file_name(f))
+                    if f.attr.is_directory():
+                        stack.append((f, f_destination, f_path))
+                    else:
+                        count_of_bytes += self._extract_file(f, f_destination)
+                        count_of_files += 1
+                except ValueError as ex:
+                    print(f'{f_path}: {ex.args[0]}', file=sys.stderr)
+                    count_of_skipped += 1
+        return count_of_files, count_of_bytes, count_of_skipped
+
+    def _extract_file(self, entry: DirectoryEntryInfo, file_path: str):
+        """
+        Копирует один файл. Цепочка кластеров проверяется до создания файла, поэтому файл с оборванной цепочкой не
+        создаётся
+        :return: int, количество скопированных байт
+        """
+        reader = FileReader(self._f_proc, entry.first_cluster_num, entry.file_size, self._fat_cache)
+        view = memoryview(self._buffer)
+        count_of_bytes = 0
+        with open(file_path, 'wb') as output:
+            while True:
+                count = reader.readinto(view)
+                if count == 0:
+                    break
+                output.write(view[:count])
+                count_of_bytes += count
+        return count_of_bytes
+
+
+def get_file_name(entry: DirectoryEntryInfo):
+    """
+    Имя файла для копирования: длинное имя, если оно есть, иначе короткое в виде 'NAME.EXT'
+    :param entry: запись о файле
+    :return: str
+    """
+    name = entry.name if entry.has_long_name() else entry.get_short_name()
+    if name in ('', '.', '..') or PATH_SEPARATOR in name or '\\' in name:
+        raise ValueError(f'Недопустимое имя файла: "{name}"')
+    return name
@@ -3,7 +3,8 @@ from random import Random
 from FileSystem import FileSystem
 from IOManager import IOManager
 
-from ImageTools import ClusterSwapper
+from ImageTools import ClusterSwapper, get_fragmentation_data
+from progress import ProgressReporter
 
 
 class Fragmenter:
@@ -18,13 +19,18 @@ class Fragmenter:
         self._cluster_swapper = ClusterSwapper(file_system.get_indexed_fat_table(), file_system.get_fat_processor(),
                                                io_manager)
 
-    def fragmentation(self, num_of_swaps: int):
+    def fragmentation(self, num_of_swaps: int, progress: ProgressReporter or None = None):
         """
         Фрагментирует файлы у данного образа
         :param num_of_swaps: количество перемещений, каждое из которых делается между двумя случайными кластерами
+        :param progress: отчёт о прогрессе (обработанные кластеры - сделанные попытки перемещения), None - не сообщать
         :return:
         """
         indexed_table = self._file_system.get_indexed_fat_table()
+        f_proc = self._file_system.get_fat_processor()
+        bytes_per_swap = 2 * f_proc.info.get_bytes_per_cluster()
+        if progress is not None:
+            progress.start('fragmentation', num_of_swaps, lambda: get_fragmentation_data(f_proc))
 
         for _ in range(num_of_swaps):
             nums_clus = list(indexed_table.keys())
@@ -34,6 +40,14 @@ class Fragmenter:
                indexed_table[second_clus].dir_entry_info.name == '\\' or \
                indexed_table[first_clus].is_directory or \
                indexed_table[second_clus].is_directory:
+                if progress is not None:
+                    progress.update()
                 continue
 
             self._cluster_swapper.swap_cluster(first_clus, second_clus)
+            self._io_manager.safe_point()
+            if progress is not None:
+                progress.update(1, bytes_per_swap if first_clus != second_clus else 0)
+
+        if progress is not None:
+            progress.finish()
@@ -0,0 +1,256 @@
+import array
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from IOManager import IOManager
+from ImageTools import FatProcessor, DirectoryParser, get_cluster_ranges, normalize_path, PATH_SEPARATOR
+from enums import TypeOfFAT
+from error_in_fat import find_differences_fats, find_orphan_clusters
+from service_classes import InfoAboutImage, DirectoryInfo
+
+
+class ConsistencyChecker:
+    """
+    Проверка целостности образа без внесения изменений: различия таблиц FAT, зацикленные и пересекающиеся файлы,
+    сиротские кластеры, записи в директориях, указывающие за пределы образа или на свободные кластеры, и файлы,
+    длина цепочки которых не соответствует размеру
+
+    Сравнение таблиц FAT разбивается на диапазоны кластеров, обход директорий - на поддеревья корневой директории.
+    Диапазоны и поддеревья проверяются параллельно в пуле процессов, результаты объединяются в один отчёт
+    """
+
+    FAT_RANGE_SIZE = 1 << 18
+
+    def __init__(self, image_path: str, workers: int or None = None, partition: int or None = None):
+        """
+        :param image_path: путь до образа
+        :param workers: количество процессов, None - по числу процессоров, 1 - проверка без пула процессов
+        :param partition: номер проверяемого раздела (см. IOManager)
+        """
+        self._image_path = image_path
+        self._partition = partition
+        self._workers = workers if workers is not None else os.cpu_count() or 1
+
+    def check(self):
+        """
+        Выполняет все проверки
+        :return: dict, отчёт о проверке
+        """
+        io_manager = IOManager(self._image_path, self._partition, read_only=True)
+        info = InfoAboutImage(io_manager)
+        f_proc = FatProcessor(info, io_manager)
+
+        fat_ranges = [(first, min(ConsistencyChecker.FAT_RANGE_SIZE, info.count_of_clusters + 1 - first))
+                      for first in range(0, info.count_of_clusters + 1, ConsistencyChecker.FAT_RANGE_SIZE)]
+        subtrees = self._split_into_subtrees(f_proc)
+
+        if self._workers == 1:
+            fat_results = [check_fats_range(self._image_path, self._partition, first, count)
+                           for first, count in fat_ranges]
+            tree_results = [check_directory_trees(self._image_path, self._partition, subtree) for subtree in subtrees]
+        else:
+            with ProcessPoolExecutor(max_workers=self._workers) as executor:
+                fat_futures = [executor.submit(check_fats_range, self._image_path, self._partition, first, count)
+                               for first, count in fat_ranges]
+                tree_futures = [executor.submit(check_directory_trees, self._image_path, self._partition, subtree)
+                                for subtree in subtrees]
+                fat_results = [future.result() for future in fat_futures]
+                tree_results = [future.result() for future in tree_futures]
+
+        report = self._merge_results(f_proc, [clus for result in fat_results for clus in result], tree_results)
+        io_manager.close()
+        return report
+
+    def _split_into_subtrees(self, f_proc: FatProcessor):
+        """
+        Разбивает дерево директорий на не более чем self._workers задач: корневая директория проверяется без
+        вложенных директорий, каждая директория корня - вместе со всем своим поддеревом
+        :param f_proc: FatProcessor образа
+        :return: list [list [(путь, первый кластер, проверять ли поддерево)]]
+        """
+        info = f_proc.info
+        root_clus = 0 if info.fat_type == TypeOfFAT.fat16 else info.BPB_RootClus
+        items = [(PATH_SEPARATOR, root_clus, False)]
+
+        if info.fat_type == TypeOfFAT.fat16:
+            root_chain = None
+        else:
+            fat_table = f_proc.read_fat_table(0)
+            root_chain, _, _ = walk_chain(f_proc, fat_table, root_clus, 0, array.array('i', [-1]) * len(fat_table))
+        root_info = read_directory(DirectoryParser(f_proc), root_chain)
+        for d in root_info.get_directories():
+            if not d.is_dot_entry():
+                items.append((normalize_path(PATH_SEPARATOR + d.get_path_name()), d.first_cluster_num, True))
+
+        count_of_tasks = max(1, min(self._workers, len(items)))
+        return [items[i::count_of_tasks] for i in range(count_of_tasks)]
+
+    def _merge_results(self, f_proc: FatProcessor, differences_fats: list, tree_results: list):
+        """
+        Объединяет результаты проверок: ищет пересечения цепочек разных поддеревьев и сиротские кластеры
+        :return: dict, отчёт о проверке
+        """
+        info = f_proc.info
+        owners = array.array('i', [-1]) * (info.count_of_clusters + 1)
+        files = []
+        looped_files = []
+        bad_entries = []
+        intersecting_files = {}
+
+        for result in tree_results:
+            looped_files.extend(result['looped_files'])
+            bad_entries.extend(result['bad_entries'])
+            for path, runs in result['files']:
+                file_num = len(files)
+                files.append(path)
+                for first_clus, count in runs:
+                    for clus in range(first_clus, first_clus + count):
+                        owner = owners[clus]
+                        if owner == -1:
+                            owners[clus] = file_num
+                        elif owner != file_num:
+                            key = (files[owner], path)
+                            if key not in intersecting_files:
+                                intersecting_files[key] = [clus, 0]
+                            intersecting_files[key][1] += 1
+
+        fat_table = f_proc.read_fat_table(0)
+        owned = bytearray(map((-1).__ne__, owners))
+        owned[0:2] = b'\x01\x01'
+        orphan_clusters = find_orphan_clusters(f_proc, fat_table, owned)
+
+        report = {
+            'image': self._image_path,
+            'partition': self._partition,
+            'fat_type': TypeOfFAT.get_name_by_type[info.fat_type],
+            'count_of_clusters': info.count_of_clusters,
+            'checked_entries': len(files),
+            'differences_fats': get_cluster_ranges(sorted(set(differences_fats))),
+            'looped_files': sorted(looped_files),
+            'intersecting_files': [{'files': list(key), 'first_cluster': value[0], 'count_of_clusters': value[1]}
+                                   for key, value in sorted(intersecting_files.items())],
+            'orphan_clusters': get_cluster_ranges(orphan_clusters),
+            'bad_entries': sorted(bad_entries, key=lambda e: e['path'])
+        }
+        report['clean'] = not any(report[key] for key in ['differences_fats', 'looped_files', 'intersecting_files',
+                                                          'orphan_clusters', 'bad_entries'])
+        return report
+
+
+def check_fats_range(image_path: str, partition: int or None, first_clus: int, count: int):
+    """
+    Сравнивает таблицы FAT на диапазоне кластеров (выполняется в отдельном процессе)
+    :return: list [номера различающихся кластеров]
+    """
+    io_manager = IOManager(image_path, partition, read_only=True)
+    f_proc = FatProcessor(InfoAboutImage(io_manager), io_manager)
+    result = find_differences_fats(f_proc, first_clus, count)
+    io_manager.close()
+    return result
+
+
+def check_directory_trees(image_path: str, partition: int or None, items: list):
+    """
+    Проверяет цепочки всех записей в директориях (выполняется в отдельном процессе)
+    :param image_path: путь до образа
+    :param partition: номер раздела (см. IOManager)
+    :param items: list [(путь до директории, первый кластер директории, проверять ли поддерево)]
+    :return: dict {'files': [(путь, [(первый кластер, количество кластеров)])], 'looped_files': [путь],
+                   'bad_entries': [{'path', 'problem', 'cluster'}]}
+    """
+    io_manager = IOManager(image_path, partition, read_only=True)
+    f_proc = FatProcessor(InfoAboutImage(io_manager), io_manager)
+    d_parser = DirectoryParser(f_proc)
+    fat_table = f_proc.read_fat_table(0)
+    visited = array.array('i', [-1]) * len(fat_table)
+    bytes_per_cluster = f_proc.info.get_bytes_per_cluster()
+    result = {'files': [], 'looped_files': [], 'bad_entries': []}
+
+    def check_chain(path: str, first_clus: int, expected_count: int or None = None):
+        chain, problem, problem_clus = walk_chain(f_proc, fat_table, first_clus, len(result['files']), visited)
+        result['files'].append((path, get_cluster_ranges(chain)))
+        if problem is None and expected_count is not None and len(chain) != expected_count:
+            problem = 'chain_longer_than_size' if len(chain) > expected_count else 'chain_shorter_than_size'
+            problem_clus = chain[min(len(chain), expected_count) - 1] if expected_count > 0 else chain[0]
+            result['bad_entries'].append({'path': path, 'problem': problem, 'cluster': problem_clus})
+            return None
+        if problem == 'loop':
+            result['looped_files'].append(path)
+        elif problem is not None:
+            result['bad_entries'].append({'path': path, 'problem': problem, 'cluster': problem_clus})
+        return chain if problem is None else None
+
+    stack = []
+    for dir_path, first_clus, recursive in items:
+        if dir_path == PATH_SEPARATOR and f_proc.fat_type == TypeOfFAT.fat16:
+            stack.append((dir_path, None, recursive))
+            continue
+        chain = check_chain(dir_path, first_clus)
+        if chain is not None:
+            stack.append((dir_path, chain, recursive))
+
+    while stack:
+        dir_path, chain, recursive = stack.pop()
+        for entry in read_directory(d_parser, chain).entries_list:
+            if entry.is_dot_entry() or entry.attr.volume_id:
+                continue
+            path = normalize_path(dir_path + PATH_SEPARATOR + entry.get_path_name())
+            if entry.attr.is_directory():
+                if recursive:
+                    sub_chain = check_chain(path, entry.first_cluster_num)
+                    if sub_chain is not None:
+                        stack.append((path, sub_chain, True))
+            elif entry.first_cluster_num != 0:
+                check_chain(path, entry.first_cluster_num, entry.get_count_of_clusters(bytes_per_cluster))
+
+    io_manager.close()
+    return result
+
+
+def walk_chain(f_proc: FatProcessor, fat_table, first_clus: int, file_num: int, visited):
+    """
+    Проходит цепочку кластеров по считанной таблице FAT, не выходя за пределы образа и не зацикливаясь
+    :param f_proc: FatProcessor образа
+    :param fat_table: значения кластеров таблицы FAT (см. FatProcessor.read_fat_table)
+    :param first_clus: первый кластер цепочки
+    :param file_num: номер файла, которым помечаются посещённые кластеры
+    :param visited: массив номеров файлов, последними посетивших кластер
+    :return: (list [кластеры цепочки], проблема: None, 'loop', 'out_of_range', 'free_cluster' или 'bad_cluster',
+              кластер, на котором обнаружена проблема)
+    """
+    chain = []
+    clus = first_clus
+    while True:
+        if clus < 2 or clus >= len(fat_table):
+            return chain, 'out_of_range', clus
+        if visited[clus] == file_num:
+            return chain, 'loop', clus
+        visited[clus] = file_num
+
+        value = fat_table[clus]
+        if value == 0:
+            return chain, 'free_cluster', clus
+        chain.append(clus)
+
+        if f_proc.is_end_cluster(value):
+            return chain, None, None
+        if f_proc.is_bad_cluster(value):
+            return chain, 'bad_cluster', clus
+        clus = value
+
+
+def read_directory(d_parser: DirectoryParser, chain: list or None):
+    """
+    Получение содержимого директории по цепочке её кластеров
+    :param d_parser: DirectoryParser образа
+    :param chain: кластеры директории, None - корневая директория FAT16
+    :return: DirectoryInfo
+    """
+    if chain is None:
+        return d_parser.get_fat16_root_directory_info()
+
+    dir_info = DirectoryInfo([])
+    for clus in chain:
+        dir_info = dir_info.merge(d_parser.get_dir_info_on_one_cluster(
+            clus, d_parser.fat_proc.info.get_count_entries_in_dir_cluster()))
+    return dir_info
@@ -1,13 +1,21 @@
 import argparse
+import json
 from random import Random
 from sys import stderr
 
 from IOManager import IOManager
-from ImageTools import get_fragmentation_data, DirectoryParser
+from ImageTools import get_fragmentation_data, ClusterSwapper, DirectoryParser, FatProcessor, PATH_SEPARATOR
 from ParsingDiskImage import parse_disk_image
-from defrag import Defragmenter
+from compact import DirectoryCompactor
+from defrag import Defragmenter, PLACEMENT_POLICIES
 from error_in_fat import ErrorMaker, ErrorDetector
+from extract import Extractor
 from fragm import Fragmenter
+from fsck import ConsistencyChecker
+from partitions import get_fat_partitions_of_image
+from progress import ProgressReporter, PROGRESS_RENDERERS
+from stats import Stats, profiling
+from verify import ManifestBuilder, compare_manifests, load_manifest, save_manifest
 
 
 class ArgumentsException(Exception):  # pragma: no cover
@@ -15,7 +23,8 @@ class ArgumentsException(Exception):  # pragma: no cover
         super().__init__(*args, **kwargs)
 
 
-def error_handler(file_system, error_detector: ErrorDetector):  # pragma: no cover
+def error_handler(file_system, error_detector: ErrorDetector,
+                  progress: ProgressReporter or None = None):  # pragma: no cover
     if error_detector.is_differences_fats():
         print("Таблицы FAT различаются", file=stderr)
         fat_nums = [i for i in range(file_system.get_fat_processor().info.BPB_NumFATs)]
@@ -59,38 +68,183 @@ def error_handler(file_system, error_detector: ErrorDetector):  # pragma: no cov
         print("Пересекающиеся файлы удалены: " + str(error_detector.refresh_clus), file=stderr)
         raise SystemExit
 
-    error_detector.clearing_fat_table(file_system.get_indexed_fat_table())
+    error_detector.clearing_fat_table(file_system.get_indexed_fat_table(), progress)
     if error_detector.found_orphan_clusters():
         print("Были удалены кластеры, не принадлежащие ни одному файлу: " + str(error_detector.refresh_clus),
               file=stderr)
 
 
-def main(parsed_args):  # pragma: no cover
+def error_reporter(file_system, error_detector: ErrorDetector):  # pragma: no cover
+    """
+    Сообщает об ошибках в образе, ничего не исправляя (для образов, открытых только для чтения)
+    """
+    if error_detector.is_differences_fats():
+        print("Таблицы FAT различаются, для исправления запустите действие fix", file=stderr)
+        raise SystemExit(1)
+
+    if error_detector.is_looped_files() or error_detector.is_intersecting_files():
+        if error_detector.is_looped_files():
+            print("Некоторые файлы зациклены: " + str([i.dir_entry_info.name for i in error_detector.looped_files]),
+                  file=stderr)
+        if error_detector.is_intersecting_files():
+            print("Некоторые файлы пересекаются: " +
+                  str([[i.dir_entry_info.name for i in int_fls] for int_fls in error_detector.intersecting_files]),
+                  file=stderr)
+        print("Для исправления запустите действие fix", file=stderr)
+        raise SystemExit(1)
+
+    orphan_clusters = error_detector.get_orphan_clusters(file_system.get_indexed_fat_table())
+    if orphan_clusters:
+        print(f"Найдены кластеры, не принадлежащие ни одному файлу: {len(orphan_clusters)}, для удаления запустите "
+              f"действие fix", file=stderr)
+
+
+READ_ONLY_ACTIONS = ['tree', 'check', 'verify', 'extract']
+
+# методы, время которых считается с --stats: чтения и записи FAT, свопы кластеров, разбор директорий
+INSTRUMENTED_METHODS = [
+    (FatProcessor, ['get_cluster_value_in_certain_fat', 'get_values', 'set_values', 'write_val_in_certain_fat',
+                    'write_val_range_in_all_fat', 'read_fat_table', 'read_all_cluster_in_data',
+                    'write_all_cluster_in_data']),
+    (ClusterSwapper, ['swap_cluster']),
+    (DirectoryParser, ['get_full_directory_info', 'get_fat16_root_directory_info', 'get_dir_info_on_one_cluster'])
+]
+
+
+def main(parsed_args, stats: Stats or None = None):  # pragma: no cover
+    if not parsed_args.all_partitions and parsed_args.partition is None:
+        process_image(parsed_args, None, stats)
+        return
+
+    try:
+        partitions = get_fat_partitions_of_image(parsed_args.path)
+    except FileNotFoundError:
+        print('Неверный параметр пути до файла', file=stderr)
+        return
+
+    if not parsed_args.all_partitions:
+        if parsed_args.partition not in [partition.number for partition in partitions]:
+            print(f'Раздел {parsed_args.partition} не найден или не содержит том FAT', file=stderr)
+            return
+        process_image(parsed_args, parsed_args.partition, stats)
+        return
+
+    if not partitions:
+        print('В образе не найдено разделов FAT', file=stderr)
+        return
+
+    exit_code = 0
+    for partition in partitions:
+        print(f'Раздел {partition.number}:')
+        try:
+            process_image(parsed_args, partition.number, stats)
+        except SystemExit as ex:
+            exit_code = max(exit_code, ex.code or 0)
+    raise SystemExit(exit_code)
+
+
+def process_image(parsed_args, partition: int or None, stats: Stats or None = None):  # pragma: no cover
     try:
-        io_manager = IOManager(parsed_args.path)
+        io_manager = IOManager(parsed_args.path, partition,
+                               parsed_args.type_action in READ_ONLY_ACTIONS or parsed_args.overlay == 'discard')
     except FileNotFoundError:
         print('Неверный параметр пути до файла', file=stderr)
         return
     except PermissionError:
         print('Выбранный файл используется каким-то другим процессом', file=stderr)
         return
+    except ValueError as ex:
+        print(ex.args[0], file=stderr)
+        return
+    if stats is not None:
+        io_manager.start_stats(stats)
+
+    if parsed_args.type_action == 'check':
+        io_manager.close()
+        report = ConsistencyChecker(parsed_args.path, parsed_args.workers, partition).check()
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        raise SystemExit(0 if report['clean'] else 1)
+
+    if parsed_args.type_action == 'verify':
+        io_manager.close()
+        verify_manifest(parsed_args, partition)
+        return
 
-    file_system_of_image = parse_disk_image(io_manager)
+    try:
+        manifest_before = run_action(parsed_args, io_manager, partition)
+    finally:
+        io_manager.close()  # данные в памяти (кэш FAT, подсказки FSInfo) записываются и при выходе через SystemExit
+
+    if manifest_before is not None:
+        manifest_after = ManifestBuilder(parsed_args.path, partition, parsed_args.workers).build()
+        if parsed_args.manifest is not None:
+            save_manifest(manifest_after, parsed_args.manifest)
+        print_comparison(compare_manifests(manifest_before, manifest_after))
+
+
+def run_action(parsed_args, io_manager: IOManager, partition: int or None):  # pragma: no cover
+    """
+    Разбирает образ, исправляет или сообщает найденные ошибки и выполняет действие. IOManager закрывает вызывающий
+    :return: dict, манифест образа до действия (с --verify), иначе None
+    """
+    progress = None
+    if parsed_args.progress is not None:
+        progress = ProgressReporter(PROGRESS_RENDERERS[parsed_args.progress]())
+
+    file_system_of_image = parse_disk_image(io_manager, progress, parsed_args.fat_cache_mb << 20)
     print(file_system_of_image.get_name_type_of_fat(), end='\n')
 
-    error_handler(file_system_of_image, file_system_of_image.get_error_detector())
+    if io_manager.read_only:
+        error_reporter(file_system_of_image, file_system_of_image.get_error_detector())
+    else:
+        error_handler(file_system_of_image, file_system_of_image.get_error_detector(), progress)
+
+    manifest_before = None
+    if parsed_args.verify:
+        io_manager.flush()
+        manifest_before = ManifestBuilder(parsed_args.path, partition, parsed_args.workers).build(
+            load_manifest(parsed_args.manifest) if parsed_args.manifest is not None else None)
+
+    if parsed_args.overlay is not None:
+        io_manager.start_overlay()
+    if parsed_args.type_action in ['fragmentation', 'defragmentation', 'compact'] and parsed_args.write_back_mb > 0:
+        io_manager.start_write_back(parsed_args.write_back_mb << 20)
 
     if parsed_args.type_action == 'tree':
         file_system_of_image.print_file_tree()
+        print(f'Свободно кластеров: {file_system_of_image.get_fat_processor().get_count_of_free_clusters()}')
+
+    elif parsed_args.type_action == 'extract':
+        if parsed_args.output is None:
+            print("Не указана папка, в которую будут скопированы файлы")
+            raise SystemExit(52)
+        try:
+            count_of_files, count_of_bytes, count_of_skipped = Extractor(file_system_of_image).extract(
+                parsed_args.target_path if parsed_args.target_path is not None else PATH_SEPARATOR,
+                parsed_args.output)
+            print(f'Скопировано файлов: {count_of_files}, байт: {count_of_bytes}, пропущено: {count_of_skipped}')
+        except ValueError as ex:
+            print(ex.args[0], file=stderr)
 
     elif parsed_args.type_action == 'fragmentation':
         print(f'Fragmentation (BEFORE): ~{int(get_fragmentation_data(file_system_of_image.get_fat_processor()))}%')
         fragm = Fragmenter(file_system_of_image, io_manager, Random())
-        fragm.fragmentation(1000)
+        fragm.fragmentation(1000, progress)
 
     elif parsed_args.type_action == 'defragmentation':
         defrag = Defragmenter(file_system_of_image, io_manager)
-        defrag.defragmentation()
+        if parsed_args.target_path is None:
+            defrag.defragmentation(parsed_args.placement, progress)
+        else:
+            try:
+                moved_files = defrag.defragmentation_of_path(parsed_args.target_path)
+                print(f'Перемещено файлов: {moved_files}')
+            except ValueError as ex:
+                print(ex.args[0], file=stderr)
+
+    elif parsed_args.type_action == 'compact':
+        count_of_directories, count_of_freed = DirectoryCompactor(file_system_of_image, io_manager).compaction()
+        print(f'Переписано директорий: {count_of_directories}, освобождено кластеров: {count_of_freed}')
 
     elif parsed_args.type_action == 'error_fat_table':
         if parsed_args.fat_num is None:
@@ -122,19 +276,136 @@ def main(parsed_args):  # pragma: no cover
     print()
     print(f'Fragmentation: ~{int(get_fragmentation_data(file_system_of_image.get_fat_processor()))}%')
 
-    io_manager.close()
+    io_manager.stop_write_back()
+    if io_manager.has_overlay():
+        finish_overlay(io_manager, parsed_args.overlay)
+    return manifest_before
+
+
+def verify_manifest(parsed_args, partition: int or None):  # pragma: no cover
+    """
+    Строит манифест образа и сравнивает его с сохранённым в --manifest (если он есть), новый манифест сохраняется
+    """
+    previous = load_manifest(parsed_args.manifest) if parsed_args.manifest is not None else None
+    try:
+        manifest = ManifestBuilder(parsed_args.path, partition, parsed_args.workers).build(previous)
+    except ValueError as ex:
+        print(ex.args[0], file=stderr)
+        raise SystemExit(1)
+    print(f'Файлов в манифесте: {len(manifest["files"])}')
+    if parsed_args.manifest is not None:
+        save_manifest(manifest, parsed_args.manifest)
+    if previous is not None:
+        print_comparison(compare_manifests(previous, manifest))
+
+
+def print_comparison(comparison: dict):  # pragma: no cover
+    if comparison['same']:
+        print('Содержимое файлов не изменилось')
+        return
+    for key, title in [('missing', 'Пропавшие файлы'), ('added', 'Новые файлы'), ('changed', 'Изменённые файлы')]:
+        if comparison[key]:
+            print(f'{title}: {", ".join(comparison[key])}', file=stderr)
+    raise SystemExit(1)
+
+
+def run_with_stats(parsed_args):  # pragma: no cover
+    """
+    Выполняет main, собирая статистику (--stats) и профиль (--profile), если они запрошены. Статистика выводится в
+    stderr текстовой сводкой или JSON
+    """
+    stats = None
+    if parsed_args.stats is not None:
+        stats = Stats()
+        for cls, method_names in INSTRUMENTED_METHODS:
+            stats.instrument(cls, method_names)
+    try:
+        with profiling(parsed_args.profile):
+            main(parsed_args, stats)
+    finally:
+        if stats is not None:
+            stats.restore()
+            if parsed_args.stats == 'json':
+                print(json.dumps(stats.to_dict(), indent=2), file=stderr)
+            else:
+                print(stats.format_summary(), file=stderr)
+
+
+def finish_overlay(io_manager: IOManager, mode: str):  # pragma: no cover
+    """
+    Проверяет образ с накопленными изменениями и записывает их в образ (mode == 'commit') или отбрасывает
+    """
+    print(f'Изменено секторов: {io_manager.get_count_of_changed_sectors()}')
+    file_system = parse_disk_image(io_manager)
+    error_detector = file_system.get_error_detector()
+    consistent = not error_detector.is_differences_fats() and not error_detector.is_looped_files() and \
+        not error_detector.is_intersecting_files() and \
+        not error_detector.get_orphan_clusters(file_system.get_indexed_fat_table())
+    print('Проверка образа после изменений: ' + ('ошибок нет' if consistent else 'найдены ошибки'))
+
+    if mode == 'commit' and consistent:
+        print(f'Изменения записаны в образ, операций записи: {io_manager.commit_overlay()}')
+    else:
+        io_manager.discard_overlay()
+        print('Изменения отброшены, образ не изменён')
 
 
 if __name__ == '__main__':  # pragma: no cover
     parser = argparse.ArgumentParser()
     parser.add_argument("path", help="path to FAT image")
     parser.add_argument("type_action", choices=["tree", "fragmentation", "defragmentation", "error_fat_table",
-                                                "error_looped_file", "error_intersected_files"],
-                        help='type of action with this image. "tree" - print file tree, "fragmentation" - '
+                                                "error_looped_file", "error_intersected_files", "check", "fix",
+                                                "verify", "extract", "compact"],
+                        help='type of action with this image. "tree" - print file tree (read-only), "fix" - fix '
+                             'errors in image, "fragmentation" - '
                              'fragmentation image, "defragmentation - defragmentation image, "error_fat_table" - make '
                              'error in second fat table, "error_looped_file" - make looped file, '
-                             '"error_intersected_files" - make intersected files')
-    parser.add_argument("-f", "--folder", type=str, help='only name of error folder')
+                             '"error_intersected_files" - make intersected files, "check" - read-only consistency '
+                             'check with JSON report (exit code 1 if errors were found), "verify" - hash contents '
+                             'of all files and compare them with --manifest, "extract" - copy files of --path '
+                             '(default: whole image) into --output, "compact" - rewrite directories without deleted '
+                             'entries and free their unused trailing clusters')
+    parser.add_argument("-f", "--folder", type=str,
+                        help='path to error folder from image root, e.g. "FIRST/inside_folder"')
     parser.add_argument("-n", "--fat_num", type=int, help='table number with error')
+    parser.add_argument("-w", "--workers", type=int, help='number of worker processes for "check" and threads for '
+                                                          'hashing (default: number of CPUs)')
+    parser.add_argument("--verify", action='store_true',
+                        help='hash contents of all files before and after the action and compare them')
+    parser.add_argument("--manifest", type=str,
+                        help='file with saved hashes of files: reused if the image has not changed since, replaced '
+                             'with the new hashes')
+    parser.add_argument("-p", "--path", dest="target_path", type=str,
+                        help='defragment or extract only this file or directory subtree (path from image root)')
+    parser.add_argument("-o", "--output", type=str, help='directory for "extract"')
+    parser.add_argument("--placement", choices=list(PLACEMENT_POLICIES), default='any',
+                        help='order of files after "defragmentation": "any" - no particular order, "directories" - '
+                             'each directory followed by its files, "size" - directories, then files from the '
+                             'smallest, "recency" - recently accessed files first (default: any)')
+    parser.add_argument("--partition", type=int, help='number of the partition (from 1) in the MBR or GPT partition '
+                                                      'table of a whole-disk image')
+    parser.add_argument("--all-partitions", action='store_true', help='process every FAT partition of a whole-disk '
+                                                                      'image in turn')
+    parser.add_argument("--overlay", choices=['commit', 'discard'],
+                        help='keep all changes of the action in memory, then verify the image: "commit" - write them '
+                             'in one sorted pass if the image is consistent, "discard" - dry run, drop them')
+    parser.add_argument("--write-back-mb", type=int, default=32,
+                        help='size in MiB of the write-back buffer for "fragmentation", "defragmentation" and '
+                             '"compact": writes are sorted by offset and merged before reaching the image, 0 - write '
+                             'immediately (default: 32)')
+    parser.add_argument("--stats", choices=['summary', 'json'],
+                        help='count reads, writes and seeks of the image, FAT lookups, cluster swaps and directory '
+                             'parses with their time, print them to stderr as a summary or JSON')
+    parser.add_argument("--fat-cache-mb", type=int, default=0,
+                        help='size in MiB of the paged cache of the first FAT table for FAT lookups and changes of '
+                             'indexing, "fragmentation" and "defragmentation", 0 - read and write the FAT directly '
+                             '(default: 0)')
+    parser.add_argument("--progress", choices=list(PROGRESS_RENDERERS),
+                        help='report progress of FAT checks, "fragmentation" and "defragmentation" to stderr: '
+                             '"terminal" - one updating line, "ndjson" - one JSON object per line for job schedulers')
+    parser.add_argument("--profile", type=str, help='profile the run with cProfile and save the result to this file')
     parsed_args = parser.parse_args()
-    main(parsed_args)
+    if parsed_args.verify and parsed_args.overlay == 'discard':
+        parser.error('--verify cannot be used with --overlay discard: the changes are dropped before the image is '
+                     'hashed again')
+    run_with_stats(parsed_args)
@@ -0,0 +1,130 @@
+import os
+
+
+class CopyOnWriteOverlay:
+    """
+    Файловый объект, накапливающий запись в памяти поверх образа
+
+    Записанные данные хранятся посекторно в словаре {номер сектора: содержимое}, чтение берёт изменённые сектора из
+    словаря, остальные - из образа. Образ не изменяется, пока не вызван commit: он записывает все изменённые сектора
+    одним проходом по возрастанию смещения, объединяя идущие подряд сектора в одну запись
+    """
+    SECTOR_SIZE = 512
+
+    def __init__(self, base):
+        """
+        :param base: файловый объект образа
+        """
+        self.base = base
+        self._sectors = {}
+        self._position = 0
+
+    def get_count_of_changed_sectors(self):
+        return len(self._sectors)
+
+    def _read_base(self, position: int, count: int):
+        self.base.seek(position)
+        return self.base.read(count)
+
+    def read(self, count: int = -1):
+        if count < 0:
+            count = self.base.seek(0, os.SEEK_END) - self._position
+        first_sector = self._position // CopyOnWriteOverlay.SECTOR_SIZE
+        last_sector = (self._position + count - 1) // CopyOnWriteOverlay.SECTOR_SIZE
+        sectors = self._sectors
+        if count <= 0 or not any(sector in sectors for sector in range(first_sector, last_sector + 1)):
+            result = self._read_base(self._position, max(count, 0))
+        else:
+            start = first_sector * CopyOnWriteOverlay.SECTOR_SIZE
+            data = bytearray(self._read_base(start, (last_sector + 1) * CopyOnWriteOverlay.SECTOR_SIZE - start))
+            for sector in range(first_sector, last_sector + 1):
+                if sector in sectors:
+                    offset = (sector - first_sector) * CopyOnWriteOverlay.SECTOR_SIZE
+                    data[offset:offset + CopyOnWriteOverlay.SECTOR_SIZE] = sectors[sector]
+            offset = self._position - start
+            result = bytes(data[offset:offset + count])
+        self._position += len(result)
+        return result
+
+    def write(self, value: bytes):
+        position = self._position
+        end = position + len(value)
+        while position < end:
+            sector, offset = divmod(position, CopyOnWriteOverlay.SECTOR_SIZE)
+            length = min(CopyOnWriteOverlay.SECTOR_SIZE - offset, end - position)
+            data = self._sectors.get(sector)
+            if data is None:
+                if length == CopyOnWriteOverlay.SECTOR_SIZE:
+                    data = bytearray(CopyOnWriteOverlay.SECTOR_SIZE)
+                else:
+                    data = bytearray(self._read_base(sector * CopyOnWriteOverlay.SECTOR_SIZE,
+                                                     CopyOnWriteOverlay.SECTOR_SIZE))
+                    data.extend(bytes(CopyOnWriteOverlay.SECTOR_SIZE - len(data)))
+                self._sectors[sector] = data
+            start = position - self._position
+            data[offset:offset + length] = value[start:start + length]
+            position += length
+        self._position = end
+        return len(value)
+
+    def commit(self):
+        """
+        Записывает изменённые сектора в образ по возрастанию смещения и очищает накопленные изменения
+        :return: int, количество выполненных записей в образ
+        """
+        count_of_writes = 0
+        sectors = sorted(self._sectors)
+        i = 0
+        while i < len(sectors):
+            j = i + 1
+            while j < len(sectors) and sectors[j] == sectors[j - 1] + 1:
+                j += 1
+            self.base.seek(sectors[i] * CopyOnWriteOverlay.SECTOR_SIZE)
+            self.base.write(b''.join(self._sectors[sector] for sector in sectors[i:j]))
+            count_of_writes += 1
+            i = j
+        self.base.flush()
+        self._sectors = {}
+        return count_of_writes
+
+    def discard(self):
+        """
+        Отбрасывает накопленные изменения
+        """
+        self._sectors = {}
+
+    def seek(self, position: int, whence: int = os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            position += self._position
+        elif whence == os.SEEK_END:
+            position += self.base.seek(0, os.SEEK_END)
+        self._position = position
+        return position
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.base.close()
+
+
+class WriteBackBuffer(CopyOnWriteOverlay):
+    """
+    Буфер отложенной записи: изменённые сектора накапливаются в памяти и записываются в образ по возрастанию смещения,
+    идущие подряд сектора - одной записью. Сбрасывать буфер можно только в безопасных точках, когда структуры
+    файловой системы согласованы (см. IOManager.safe_point), поэтому ограничение памяти может быть превышено до
+    ближайшей такой точки
+    """
+    def __init__(self, base, memory_limit: int):
+        """
+        :param base: файловый объект образа
+        :param memory_limit: объём изменённых данных в байтах, после которого буфер сбрасывается в безопасной точке
+        """
+        super().__init__(base)
+        self._memory_limit = memory_limit
+
+    def is_full(self):
+        return self.get_count_of_changed_sectors() * CopyOnWriteOverlay.SECTOR_SIZE >= self._memory_limit
@@ -0,0 +1,232 @@
+import os
+import struct
+import uuid
+
+from vhd import open_image
+
+
+SECTOR_SIZE = 512
+
+MBR_ENTRY_STRUCT = struct.Struct('<B3sB3sII')
+MBR_ENTRIES_OFFSET = 446
+MBR_SIGNATURE = b'\x55\xaa'
+MBR_GPT_PROTECTIVE_TYPE = 0xEE
+MBR_EXTENDED_TYPES = frozenset([0x05, 0x0F, 0x85])
+MBR_FIRST_LOGICAL_NUMBER = 5
+MBR_FAT_TYPES = frozenset([0x01, 0x04, 0x06, 0x0B, 0x0C, 0x0E, 0x11, 0x14, 0x16, 0x1B, 0x1C, 0x1E])
+
+GPT_SIGNATURE = b'EFI PART'
+GPT_HEADER_STRUCT = struct.Struct('<8sIIIIQQQQ16sQIII')
+GPT_ENTRY_STRUCT = struct.Struct('<16s16sQQQ72s')
+GPT_BASIC_DATA_TYPE = uuid.UUID('EBD0A0A2-B9E5-4433-87C0-68B6B72699C7')
+
+
+class Partition:
+    """
+    Раздел диска
+    """
+    __slots__ = ('number', 'offset', 'size', 'type')
+
+    def __init__(self, number: int, offset: int, size: int, partition_type):
+        """
+        :param number: номер раздела, начиная с 1 (номер записи в MBR или GPT; логические разделы расширенного
+                       раздела MBR нумеруются с 5)
+        :param offset: смещение раздела от начала диска в байтах
+        :param size: размер раздела в байтах
+        :param partition_type: тип раздела: int для MBR, uuid.UUID для GPT
+        """
+        self.number = number
+        self.offset = offset
+        self.size = size
+        self.type = partition_type
+
+    def __repr__(self):
+        return f'Partition({self.number}, {self.offset}, {self.size}, {self.type})'
+
+
+def is_fat_boot_sector(raw: bytes):
+    """
+    Похож ли сектор на загрузочный сектор тома FAT (а не на MBR диска)
+    :param raw: первые 512 байт тома
+    :return: bool
+    """
+    if len(raw) < SECTOR_SIZE or raw[510:512] != MBR_SIGNATURE or raw[0] not in (0xEB, 0xE9):
+        return False
+    byts_per_sec = int.from_bytes(raw[11:13], 'little')
+    sec_per_clus = raw[13]
+    return byts_per_sec in (512, 1024, 2048, 4096) and sec_per_clus != 0 and sec_per_clus & (sec_per_clus - 1) == 0 \
+        and int.from_bytes(raw[14:16], 'little') != 0 and raw[16] != 0
+
+
+def read_partitions(image):
+    """
+    Разбирает таблицу разделов диска (MBR или GPT). Основные разделы MBR нумеруются с 1 по 4, логические разделы
+    первого расширенного раздела (цепочка EBR) - с 5, сам расширенный раздел тоже возвращается
+    :param image: файловый объект диска, открытый в двоичном режиме
+    :return: list [Partition], пустой, если на диске нет таблицы разделов
+    :raises ValueError: повреждён заголовок GPT или цепочка EBR
+    """
+    image.seek(0)
+    mbr = image.read(SECTOR_SIZE)
+    if len(mbr) < SECTOR_SIZE or mbr[510:512] != MBR_SIGNATURE or is_fat_boot_sector(mbr):
+        return []
+
+    partitions = []
+    extended = None
+    for i in range(4):
+        _, _, partition_type, _, first_lba, count_of_sectors = MBR_ENTRY_STRUCT.unpack_from(
+            mbr, MBR_ENTRIES_OFFSET + i * MBR_ENTRY_STRUCT.size)
+        if partition_type == MBR_GPT_PROTECTIVE_TYPE:
+            return _read_gpt_partitions(image)
+        if partition_type != 0 and count_of_sectors != 0:
+            partitions.append(Partition(i + 1, first_lba * SECTOR_SIZE, count_of_sectors * SECTOR_SIZE,
+                                        partition_type))
+            if partition_type in MBR_EXTENDED_TYPES and extended is None:
+                extended = first_lba
+    if extended is not None:
+        partitions.extend(_read_logical_partitions(image, extended))
+    return partitions
+
+
+def _read_logical_partitions(image, extended_lba: int):
+    """
+    Разбирает цепочку EBR расширенного раздела MBR. Первая запись EBR описывает логический раздел (начало отсчитывается
+    от сектора EBR), вторая - ссылку на следующий EBR (начало отсчитывается от начала расширенного раздела)
+    :param extended_lba: первый сектор расширенного раздела
+    :return: list [Partition], логические разделы с номерами с 5
+    """
+    partitions = []
+    visited = set()  # сектора пройденных EBR, защита от зацикленной цепочки
+    ebr_lba = extended_lba
+    while True:
+        if ebr_lba in visited:
+            raise ValueError(f'Цепочка EBR зациклена на секторе {ebr_lba}')
+        visited.add(ebr_lba)
+        image.seek(ebr_lba * SECTOR_SIZE)
+        ebr = image.read(SECTOR_SIZE)
+        if len(ebr) < SECTOR_SIZE or ebr[510:512] != MBR_SIGNATURE:
+            raise ValueError(f'Повреждён EBR в секторе {ebr_lba}')
+
+        _, _, partition_type, _, first_lba, count_of_sectors = MBR_ENTRY_STRUCT.unpack_from(ebr, MBR_ENTRIES_OFFSET)
+        if partition_type != 0 and count_of_sectors != 0:
+            partitions.append(Partition(MBR_FIRST_LOGICAL_NUMBER + len(partitions), (ebr_lba + first_lba) * SECTOR_SIZE,
+                                        count_of_sectors * SECTOR_SIZE, partition_type))
+
+        _, _, next_type, _, next_lba, _ = MBR_ENTRY_STRUCT.unpack_from(ebr, MBR_ENTRIES_OFFSET + MBR_ENTRY_STRUCT.size)
+        if next_type not in MBR_EXTENDED_TYPES:
+            return partitions
+        ebr_lba = extended_lba + next_lba
+
+
+def _read_gpt_partitions(image):
+    """
+    Разбирает таблицу разделов GPT (заголовок во втором секторе диска)
+    :return: list [Partition]
+    """
+    image.seek(SECTOR_SIZE)
+    header = image.read(GPT_HEADER_STRUCT.size)
+    (signature, _, _, _, _, _, _, _, _, _, entries_lba, count_of_entries, entry_size,
+     _) = GPT_HEADER_STRUCT.unpack(header)
+    if signature != GPT_SIGNATURE:
+        raise ValueError('Повреждён заголовок GPT')
+
+    image.seek(entries_lba * SECTOR_SIZE)
+    raw_entries = image.read(count_of_entries * entry_size)
+    partitions = []
+    for i in range(count_of_entries):
+        type_guid, _, first_lba, last_lba, _, _ = GPT_ENTRY_STRUCT.unpack_from(raw_entries, i * entry_size)
+        if type_guid != bytes(16):
+            partitions.append(Partition(i + 1, first_lba * SECTOR_SIZE, (last_lba - first_lba + 1) * SECTOR_SIZE,
+                                        uuid.UUID(bytes_le=type_guid)))
+    return partitions
+
+
+def get_fat_partitions(image):
+    """
+    Разделы диска, содержащие тома FAT: тип раздела допускает FAT и его первый сектор - загрузочный сектор FAT
+    :param image: файловый объект диска, открытый в двоичном режиме
+    :return: list [Partition]
+    """
+    fat_partitions = []
+    for partition in read_partitions(image):
+        if partition.type not in MBR_FAT_TYPES and partition.type != GPT_BASIC_DATA_TYPE:
+            continue
+        image.seek(partition.offset)
+        if is_fat_boot_sector(image.read(SECTOR_SIZE)):
+            fat_partitions.append(partition)
+    return fat_partitions
+
+
+def get_fat_partitions_of_image(file_path: str):
+    """
+    Разделы образа диска, содержащие тома FAT
+    :param file_path: путь до образа
+    :return: list [Partition]
+    """
+    image = open_image(file_path, 'rb')
+    try:
+        return get_fat_partitions(image)
+    finally:
+        image.close()
+
+
+def get_partition(image, number: int):
+    """
+    Поиск раздела по номеру
+    :param image: файловый объект диска, открытый в двоичном режиме
+    :param number: номер раздела, начиная с 1
+    :return: Partition
+    """
+    for partition in read_partitions(image):
+        if partition.number == number:
+            return partition
+    raise ValueError(f'Раздел {number} не найден')
+
+
+class PartitionWindow:
+    """
+    Файловый объект над разделом диска: смещения отсчитываются от начала раздела, чтение и запись не выходят за его
+    пределы. Данные не копируются, все операции передаются файлу диска со сдвигом
+    """
+    def __init__(self, image, partition: Partition):
+        """
+        :param image: файловый объект диска
+        :param partition: раздел
+        """
+        self._image = image
+        self._offset = partition.offset
+        self._size = partition.size
+        self._position = 0
+
+    def read(self, count: int = -1):
+        available = max(0, self._size - self._position)
+        count = available if count < 0 else min(count, available)
+        self._image.seek(self._offset + self._position)
+        result = self._image.read(count)
+        self._position += len(result)
+        return result
+
+    def write(self, value: bytes):
+        if self._position + len(value) > self._size:
+            raise ValueError('Запись за пределы раздела')
+        self._image.seek(self._offset + self._position)
+        self._image.write(value)
+        self._position += len(value)
+        return len(value)
+
+    def seek(self, position: int, whence: int = os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            position += self._position
+        elif whence == os.SEEK_END:
+            position += self._size
+        self._position = position
+        return position
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        self._image.flush()
+
+    def close(self):
+        self._image.close()
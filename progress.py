@@ -0,0 +1,141 @@
+import json
+import sys
+import time
+
+
+class ProgressReporter:
+    """
+    Прогресс долгой операции (дефрагментации, фрагментации, проверки таблиц FAT): количество обработанных кластеров,
+    перемещённых байт, текущая фрагментированность и оценка оставшегося времени
+
+    update вызывается в цикле операции и только прибавляет счётчики и сравнивает время со временем следующего отчёта,
+    callback вызывается не чаще раза в min_interval секунд. Фрагментированность считается чтением всей таблицы FAT,
+    поэтому - не чаще раза в fragmentation_interval секунд, в промежутках сообщается последнее посчитанное значение
+    """
+    def __init__(self, callback, min_interval: float = 1.0, fragmentation_interval: float = 30.0):
+        """
+        :param callback: callback(report: dict) - получает отчёт о прогрессе (см. _get_report), например,
+                         TerminalRenderer или NdjsonRenderer
+        :param min_interval: наименьший промежуток между отчётами в секундах
+        :param fragmentation_interval: наименьший промежуток между подсчётами фрагментированности в секундах
+        """
+        self._callback = callback
+        self._min_interval = min_interval
+        self._fragmentation_interval = fragmentation_interval
+        self._start(None, 0, None)
+
+    def _start(self, operation: str or None, total: int, fragmentation):
+        self.operation = operation
+        self.total = total
+        self.clusters_processed = 0
+        self.bytes_moved = 0
+        self._fragmentation = fragmentation
+        self._fragmentation_value = None
+        self._next_fragmentation = 0.0
+        self._start_time = time.monotonic()
+        self._next_report = self._start_time + self._min_interval
+
+    def start(self, operation: str, total: int, fragmentation=None):
+        """
+        Начинает отчёт о новой операции и сообщает о её начале
+        :param operation: название операции
+        :param total: количество кластеров, которые обработает операция
+        :param fragmentation: fragmentation() -> float, фрагментированность образа в процентах; None - не сообщается
+        """
+        self._start(operation, total, fragmentation)
+        self._report(self._start_time, 'start')
+
+    def update(self, count_of_clusters: int = 1, count_of_bytes: int = 0):
+        """
+        Учитывает обработанные кластеры и перемещённые байты, сообщает прогресс, если с прошлого отчёта прошло не меньше
+        min_interval секунд
+        """
+        self.clusters_processed += count_of_clusters
+        self.bytes_moved += count_of_bytes
+        now = time.monotonic()
+        if now >= self._next_report:
+            self._report(now, 'progress')
+
+    def finish(self):
+        """
+        Сообщает о завершении операции
+        """
+        self._next_fragmentation = 0.0
+        self._report(time.monotonic(), 'finish')
+
+    def _report(self, now: float, event: str):
+        self._next_report = now + self._min_interval
+        if self._fragmentation is not None and now >= self._next_fragmentation:
+            self._fragmentation_value = self._fragmentation()
+            self._next_fragmentation = now + self._fragmentation_interval
+        self._callback(self._get_report(now, event))
+
+    def _get_report(self, now: float, event: str):
+        """
+        :return: dict: event - 'start', 'progress' или 'finish'; operation; clusters_processed; total_clusters;
+                 bytes_moved; fragmentation - процент или None; elapsed_seconds; eta_seconds - None, пока оценить нельзя
+        """
+        elapsed = now - self._start_time
+        eta = None
+        if event == 'finish':
+            eta = 0.0
+        elif self.clusters_processed > 0 and self.total > 0:
+            eta = max(0.0, elapsed * (self.total - self.clusters_processed) / self.clusters_processed)
+        return {
+            'event': event,
+            'operation': self.operation,
+            'clusters_processed': self.clusters_processed,
+            'total_clusters': self.total,
+            'bytes_moved': self.bytes_moved,
+            'fragmentation': self._fragmentation_value,
+            'elapsed_seconds': elapsed,
+            'eta_seconds': eta
+        }
+
+
+class TerminalRenderer:
+    """
+    Выводит прогресс одной обновляемой строкой в терминал (по умолчанию - в stderr)
+    """
+    def __init__(self, stream=None):
+        self._stream = stream if stream is not None else sys.stderr
+
+    def __call__(self, report: dict):
+        line = f'\r{report["operation"]}: {report["clusters_processed"]}/{report["total_clusters"]} кластеров'
+        if report['total_clusters']:
+            line += f' ({min(100.0, report["clusters_processed"] * 100 / report["total_clusters"]):.1f}%)'
+        if report['bytes_moved']:
+            line += f', перемещено {report["bytes_moved"] / (1 << 20):.1f} МиБ'
+        if report['fragmentation'] is not None:
+            line += f', фрагментированность ~{int(report["fragmentation"])}%'
+        if report['eta_seconds'] is not None and report['event'] != 'finish':
+            line += f', осталось ~{_format_seconds(report["eta_seconds"])}'
+        self._stream.write(line + '\x1b[K')  # \x1b[K стирает остаток прошлой, более длинной строки
+        if report['event'] == 'finish':
+            self._stream.write(f', {_format_seconds(report["elapsed_seconds"])}\n')
+        self._stream.flush()
+
+
+class NdjsonRenderer:
+    """
+    Выводит каждый отчёт о прогрессе отдельной строкой JSON (NDJSON, по умолчанию - в stderr, чтобы не смешиваться
+    с выводом действия), для планировщиков заданий и других программ
+    """
+    def __init__(self, stream=None):
+        self._stream = stream if stream is not None else sys.stderr
+
+    def __call__(self, report: dict):
+        self._stream.write(json.dumps(report) + '\n')
+        self._stream.flush()
+
+
+PROGRESS_RENDERERS = {
+    'terminal': TerminalRenderer,
+    'ndjson': NdjsonRenderer
+}
+
+
+def _format_seconds(seconds: float):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02}:{seconds:02}'
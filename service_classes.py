@@ -1,107 +1,117 @@
+import datetime
+import struct
+from collections import namedtuple
+
 from IOManager import IOManager
 from enums import TypeOfFAT
 
 
-class InfoAboutImage:
-    def __init__(self, io_manager: IOManager):
-        io_manager.seek(0)
-
-        self.BS_jmpBoot = io_manager.read_bytes_and_convert_to_int(3)
-        self.BS_OEMName = io_manager.read_bytes_and_convert_to_int(8)
-        self.BPB_BytsPerSec = io_manager.read_bytes_and_convert_to_int(2)  # Количество байт в одном секторе
-        #                                                               (512, 1024, 2048 or 4096)
-        self.BPB_SecPerClus = io_manager.read_bytes_and_convert_to_int(1)  # Количество секторов в кластере
-        self.BPB_ResvdSecCnt = io_manager.read_bytes_and_convert_to_int(2)
-        self.BPB_NumFATs = io_manager.read_bytes_and_convert_to_int(1)  # Количество таблиц FAT на диске
-        self.BPB_RootEntCnt = io_manager.read_bytes_and_convert_to_int(2)  # Для FAT16 поле содержит число 32-байтных
-        #                                                               элементов корневой директории. Для FAT32 дисков,
-        #                                                               это поле должно быть 0
-        self.BPB_TotSec16 = io_manager.read_bytes_and_convert_to_int(2)  # Старое 16-битное поле: общее количество
-        #                                                              секторов на диске
-        self.BPB_Media = io_manager.read_bytes_and_convert_to_int(1)
-        self.BPB_FATSz16 = io_manager.read_bytes_and_convert_to_int(2)  # FAT16 это количество секторов одной FAT. Для
-        #                                                            FAT32 это значение 0
-        self.BPB_SecPerTrk = io_manager.read_bytes_and_convert_to_int(2)
-        self.BPB_NumHeads = io_manager.read_bytes_and_convert_to_int(2)
-        self.BPB_HiddSec = io_manager.read_bytes_and_convert_to_int(4)
-        self.BPB_TotSec32 = io_manager.read_bytes_and_convert_to_int(4)  # Новое 32-битное поле: общее количество
-        #                                                             секторов на диске
-
-        self.BPB_FATSz32 = io_manager.read_bytes_and_convert_to_int(4)  # Поле, необходимое для некоторых вычислений,
-        #                                                            может быть некорректным в некоторых ситуациях
-        io_manager.jump_back(4)  # сохранение целостности данных
-
-        if self.BPB_FATSz16 != 0:
-            fat_sz = self.BPB_FATSz16
-        else:
-            fat_sz = self.BPB_FATSz32
+_BOOT_SECTOR_FIELDS = (
+    'BS_jmpBoot', 'BS_OEMName',
+    'BPB_BytsPerSec',  # Количество байт в одном секторе (512, 1024, 2048 or 4096)
+    'BPB_SecPerClus',  # Количество секторов в кластере
+    'BPB_ResvdSecCnt',
+    'BPB_NumFATs',  # Количество таблиц FAT на диске
+    'BPB_RootEntCnt',  # Для FAT16 поле содержит число 32-байтных элементов корневой директории. Для FAT32 дисков,
+    #                    это поле должно быть 0
+    'BPB_TotSec16',  # Старое 16-битное поле: общее количество секторов на диске
+    'BPB_Media',
+    'BPB_FATSz16',  # FAT16 это количество секторов одной FAT. Для FAT32 это значение 0
+    'BPB_SecPerTrk', 'BPB_NumHeads', 'BPB_HiddSec',
+    'BPB_TotSec32',  # Новое 32-битное поле: общее количество секторов на диске
+    'BPB_FATSz32',  # Поле, необходимое для некоторых вычислений, может быть некорректным в некоторых ситуациях
+    'BPB_ExtFlags', 'BPB_FSVer',
+    'BPB_RootClus',  # номер первого кластера корневой директории (только FAT32)
+    'BPB_FSInfo', 'BPB_BkBootSec', 'BPB_Reserved',
+    'BS_DrvNum', 'BS_Reserved1', 'BS_BootSig', 'BS_VolID', 'BS_VolLab', 'BS_FilSysType'
+)
+
+_GEOMETRY_FIELDS = (
+    'fat_sz',  # количество секторов одной FAT
+    'root_dir_sectors',  # количество секторов корневой директории FAT16
+    'first_data_sector', 'count_of_clusters', 'fat_type',
+    'first_root_dir_sec',  # входная точка корневой директории
+    'bytes_per_cluster',
+    'fat_entry_size',  # длина значения кластера в таблице FAT в байтах
+    'fat_offsets',  # входные точки таблиц FAT
+    'data_offset'  # входная точка области данных
+)
+
+
+class InfoAboutImage(namedtuple('InfoAboutImage', _BOOT_SECTOR_FIELDS + _GEOMETRY_FIELDS)):
+    """
+    Параметры тома из загрузочного сектора (BPB) и вычисленная по ним геометрия
 
-        self._root_dir_sectors = ((self.BPB_RootEntCnt * 32) + (self.BPB_BytsPerSec - 1)) // self.BPB_BytsPerSec
-        self.first_data_sector = self.BPB_ResvdSecCnt + self._root_dir_sectors + self.BPB_NumFATs * fat_sz
+    Загрузочный сектор считывается одним чтением и разбирается заранее скомпилированными структурами struct.
+    Производные величины (размер FAT, первый сектор области данных, размер кластера, смещения таблиц FAT) вычисляются
+    один раз. Объект неизменяемый, поля, которых нет в BPB этого типа FAT, равны None
+    """
+    __slots__ = ()
 
-        self.count_of_clusters = self._get_count_of_clusters()
-        self.fat_type = self._get_fat_type()
+    BOOT_SECTOR_SIZE = 512
+    COMMON_STRUCT = struct.Struct('<3s8sHBHBHHBHHHII')
+    FAT16_STRUCT = struct.Struct('<BBBI11s8s')
+    FAT32_STRUCT = struct.Struct('<IHHIHH12sBBBI11s8s')
 
-        if self.fat_type == TypeOfFAT.fat16:
-            self._parse_fat16_structure(io_manager)
-        else:
-            self._parse_fat32_structure(io_manager)
-
-        self.first_root_dir_sec = self._get_first_root_dir_sec()
-
-    def _parse_fat16_structure(self, io_manager: IOManager):
-        self.BS_DrvNum = io_manager.read_bytes_and_convert_to_int(1)
-        self.BS_Reserved1 = io_manager.read_bytes_and_convert_to_int(1)
-        self.BS_bootSig = io_manager.read_bytes_and_convert_to_int(1)
-        self.BS_VolID = io_manager.read_bytes_and_convert_to_int(4)
-        self.BS_VolLab = io_manager.read_bytes_and_convert_to_int(11)
-        self.BS_FilSysType = io_manager.read_bytes_and_convert_to_int(8)
-
-    def _parse_fat32_structure(self, io_manager: IOManager):
-        self.BPB_FATSz32 = io_manager.read_bytes_and_convert_to_int(4)
-        self.BPB_ExtFlags = io_manager.read_bytes_and_convert_to_int(2)
-        self.BPB_FSVer = io_manager.read_bytes_and_convert_to_int(2)
-        self.BPB_RootClus = io_manager.read_bytes_and_convert_to_int(4)  # номер первого кластера корневой директории
-        self.BPB_FSInfo = io_manager.read_bytes_and_convert_to_int(2)
-        self.BPB_BkBootSec = io_manager.read_bytes_and_convert_to_int(2)
-        self.BPB_Reserved = io_manager.read_bytes_and_convert_to_int(12)
-        self.BS_DrvNum = io_manager.read_bytes_and_convert_to_int(1)
-        self.BS_Reserved1 = io_manager.read_bytes_and_convert_to_int(1)
-        self.BS_BootSig = io_manager.read_bytes_and_convert_to_int(1)
-        self.BS_VolID = io_manager.read_bytes_and_convert_to_int(4)
-        self.BS_VolLab = io_manager.read_bytes_and_convert_to_int(11)
-        self.BS_FilSysType = io_manager.read_bytes_and_convert_to_int(8)
-
-    def _get_first_root_dir_sec(self):
-        if self.fat_type == TypeOfFAT.fat32:
-            return (self.first_data_sector + (self.BPB_RootClus - 2) * self.BPB_SecPerClus) * self.BPB_BytsPerSec
-        else:
-            return (self.BPB_ResvdSecCnt + (self.BPB_NumFATs * self.BPB_FATSz16)) * self.BPB_BytsPerSec
-
-    def _get_count_of_clusters(self):
-        if self.BPB_TotSec16 != 0:
-            tot_sec = self.BPB_TotSec16
+    def __new__(cls, io_manager: IOManager):
+        io_manager.seek(0)
+        raw = io_manager.read_some_bytes(InfoAboutImage.BOOT_SECTOR_SIZE)
+        if len(raw) < InfoAboutImage.BOOT_SECTOR_SIZE:
+            raise ValueError("Incorrect Image. Size of boot sector: " + str(len(raw)))
+
+        common = InfoAboutImage.COMMON_STRUCT.unpack_from(raw, 0)
+        _, _, bytes_per_sector, sec_per_clus, resvd_sec_cnt, num_fats, root_ent_cnt, tot_sec16, _, fat_sz16, _, _, _, \
+            tot_sec32 = common
+        if bytes_per_sector == 0 or sec_per_clus == 0:
+            raise ValueError(f"Incorrect Image. Bytes per sector: {bytes_per_sector}, sectors per cluster: "
+                             f"{sec_per_clus}")
+        fat_sz32 = int.from_bytes(raw[36:40], 'little')
+
+        fat_sz = fat_sz16 if fat_sz16 != 0 else fat_sz32
+        root_dir_sectors = ((root_ent_cnt * 32) + (bytes_per_sector - 1)) // bytes_per_sector
+        first_data_sector = resvd_sec_cnt + root_dir_sectors + num_fats * fat_sz
+        count_of_clusters = ((tot_sec16 if tot_sec16 != 0 else tot_sec32) - first_data_sector) // sec_per_clus
+        fat_type = cls._get_fat_type(count_of_clusters)
+
+        if fat_type == TypeOfFAT.fat16:
+            drv_num, reserved1, boot_sig, vol_id, vol_lab, fil_sys_type = \
+                InfoAboutImage.FAT16_STRUCT.unpack_from(raw, 36)
+            fat32_fields = (fat_sz32, None, None, None, None, None, None)
+            first_root_dir_sec = (resvd_sec_cnt + num_fats * fat_sz16) * bytes_per_sector
         else:
-            tot_sec = self.BPB_TotSec32
-
-        data_sec = tot_sec - self.first_data_sector
-
-        return data_sec // self.BPB_SecPerClus
-
-    def _get_fat_type(self):
-        if self.count_of_clusters <= 0:
-            raise ValueError("Incorrect Image. Count of clusters: " + str(self.count_of_clusters))
-        elif self.count_of_clusters < 65525:
+            fat32_fields = InfoAboutImage.FAT32_STRUCT.unpack_from(raw, 36)
+            drv_num, reserved1, boot_sig, vol_id, vol_lab, fil_sys_type = fat32_fields[7:]
+            fat32_fields = fat32_fields[:7]
+            first_root_dir_sec = (first_data_sector + (fat32_fields[3] - 2) * sec_per_clus) * bytes_per_sector
+
+        return tuple.__new__(cls, common + fat32_fields + (
+            drv_num, reserved1, boot_sig, vol_id, vol_lab, fil_sys_type,
+            fat_sz,
+            root_dir_sectors,
+            first_data_sector,
+            count_of_clusters,
+            fat_type,
+            first_root_dir_sec,
+            bytes_per_sector * sec_per_clus,
+            TypeOfFAT.get_length_fat_entry[fat_type],
+            tuple((resvd_sec_cnt + i * fat_sz) * bytes_per_sector for i in range(num_fats)),
+            first_data_sector * bytes_per_sector))
+
+    @staticmethod
+    def _get_fat_type(count_of_clusters: int):
+        if count_of_clusters <= 0:
+            raise ValueError("Incorrect Image. Count of clusters: " + str(count_of_clusters))
+        elif count_of_clusters < 65525:
             fat_type = TypeOfFAT.fat16
         else:
             fat_type = TypeOfFAT.fat32
         return fat_type
 
     def get_count_entries_in_dir_cluster(self):
-        return self.BPB_BytsPerSec * self.BPB_SecPerClus // 32
+        return self.bytes_per_cluster // 32
 
     def get_bytes_per_cluster(self):
-        return self.BPB_BytsPerSec * self.BPB_SecPerClus
+        return self.bytes_per_cluster
 
     @classmethod
     def get_in_bytes(cls, value: int):
@@ -113,6 +123,101 @@ class InfoAboutImage:
         return val if val != '' else '0'
 
 
+class FSInfo:
+    """
+    Сектор FSInfo тома FAT32: подсказки о количестве свободных кластеров (FSI_Free_Count) и о кластере, с которого
+    стоит начинать поиск свободного (FSI_Nxt_Free). Значение UNKNOWN означает, что подсказка не задана. Подсказки
+    меняются в памяти (dirty) и записываются в образ методом flush
+    """
+    LEAD_SIG = 0x41615252
+    STRUC_SIG = 0x61417272
+    TRAIL_SIG = 0xAA550000
+    UNKNOWN = 0xFFFFFFFF
+    STRUCT = struct.Struct('<I480sIII12sI')
+    FREE_COUNT_OFFSET = 488
+
+    __slots__ = ('entry_point', 'count_of_clusters', 'free_count', 'nxt_free', 'dirty')
+
+    def __init__(self, entry_point: int, count_of_clusters: int):
+        """
+        :param entry_point: входная точка сектора FSInfo
+        :param count_of_clusters: количество кластеров тома: количество свободных больше него и номер кластера вне
+                                  2..count_of_clusters + 1 считаются незаданными
+        """
+        self.entry_point = entry_point
+        self.count_of_clusters = count_of_clusters
+        self.free_count = FSInfo.UNKNOWN
+        self.nxt_free = FSInfo.UNKNOWN
+        self.dirty = False
+
+    @classmethod
+    def read(cls, io_manager: IOManager, info: InfoAboutImage):
+        """
+        Считывает сектор FSInfo образа одним чтением
+        :return: FSInfo, None - для FAT16, а также если сектора нет или его сигнатуры неверны
+        """
+        if info.fat_type != TypeOfFAT.fat32 or info.BPB_FSInfo in (0, 0xFFFF) or \
+           info.BPB_FSInfo >= info.BPB_ResvdSecCnt:
+            return None
+        fs_info = cls(info.BPB_FSInfo * info.BPB_BytsPerSec, info.count_of_clusters)
+        return fs_info if fs_info.reload(io_manager) else None
+
+    def reload(self, io_manager: IOManager):
+        """
+        Перечитывает подсказки из образа, отбрасывая изменения в памяти
+        :return: bool, верны ли сигнатуры сектора (если нет, подсказки считаются незаданными)
+        """
+        io_manager.seek(self.entry_point)
+        raw = io_manager.read_some_bytes(FSInfo.STRUCT.size)
+        self.free_count = self.nxt_free = FSInfo.UNKNOWN
+        self.dirty = False
+        if len(raw) != FSInfo.STRUCT.size:
+            return False
+        lead_sig, _, struc_sig, free_count, nxt_free, _, trail_sig = FSInfo.STRUCT.unpack(raw)
+        if lead_sig != FSInfo.LEAD_SIG or struc_sig != FSInfo.STRUC_SIG or trail_sig != FSInfo.TRAIL_SIG:
+            return False
+
+        if free_count <= self.count_of_clusters:
+            self.free_count = free_count
+        if 2 <= nxt_free <= self.count_of_clusters + 1:
+            self.nxt_free = nxt_free
+        return True
+
+    def flush(self, io_manager: IOManager):
+        """
+        Записывает изменившиеся подсказки в сектор FSInfo образа
+        """
+        if self.dirty:
+            io_manager.seek(self.entry_point + FSInfo.FREE_COUNT_OFFSET)
+            io_manager.write_some_bytes(struct.pack('<II', self.free_count, self.nxt_free))
+            self.dirty = False
+
+    def get_free_count(self):
+        """
+        :return: int, количество свободных кластеров, None - если подсказка не задана
+        """
+        return self.free_count if self.free_count != FSInfo.UNKNOWN else None
+
+    def on_allocated(self, clus: int):
+        """
+        Учитывает, что свободный кластер clus стал занятым
+        """
+        if self.free_count != FSInfo.UNKNOWN:
+            self.free_count = max(self.free_count - 1, 0)
+        self.nxt_free = clus
+        self.dirty = True
+
+    def on_freed(self, clus: int):
+        """
+        Учитывает, что занятый кластер clus стал свободным
+        """
+        if self.free_count != FSInfo.UNKNOWN:
+            self.free_count += 1
+        if self.nxt_free == FSInfo.UNKNOWN or clus < self.nxt_free:
+            self.nxt_free = clus
+        self.dirty = True
+
+
 class DirectoryInfo:
     """
     Информация о содержимом директории
@@ -140,50 +245,241 @@ class DirectoryInfo:
 class DirectoryEntryInfo:
     """
     Получение информации о записи в директории
+
+    Имя записи хранится в сыром виде (короткое имя 8.3 и байты длинного имени в UTF-16) и декодируется только при
+    первом обращении к name, поэтому обходы, которым нужны только номера кластеров, не работают со строками
     """
-    def __init__(self, name: str, attr: int or None, first_cluster_num: int, entry_point: int):
+    __slots__ = ('_name', '_short_name', '_long_name', '_long_name_check_sum', 'attr', 'first_cluster_num',
+                 'entry_point', 'file_size', 'creation_time', 'write_time', 'access_date')
+
+    def __init__(self, name: str or bytes, attr: int or None, first_cluster_num: int, entry_point: int,
+                 file_size: int = 0, creation_time: int = 0, write_time: int = 0, access_date: int = 0):
         """
-        :param name:
+        :param name: имя записи, или сырые 11 байт короткого имени
         :param attr:
         :param first_cluster_num: первый кластре расположения файла, соответсвующего записи
         :param entry_point: входная точка записи на диске
+        :param file_size: размер файла в байтах (для директорий - 0)
+        :param creation_time: время создания: (CrtDate << 24) | (CrtTime << 8) | CrtTimeTenth
+        :param write_time: время последней записи: (WrtDate << 16) | WrtTime
+        :param access_date: дата последнего доступа LstAccDate
+
+        Время хранится сырыми значениями FAT, упакованными так, что более позднее время - большее число, поэтому
+        записи можно сравнивать и сортировать по времени без декодирования
         """
-        self.name = name
+        if isinstance(name, bytes):
+            self._name = None
+            self._short_name = name
+        else:
+            self._name = name
+            self._short_name = None
+        self._long_name = None
+        self._long_name_check_sum = None
         self.attr = attribute_parser(attr)
         self.first_cluster_num = first_cluster_num
         self.entry_point = entry_point
+        self.file_size = file_size
+        self.creation_time = creation_time
+        self.write_time = write_time
+        self.access_date = access_date
+
+    @property
+    def name(self):
+        if self._name is None:
+            self._name = self._decode_name()
+        return self._name
+
+    @name.setter
+    def name(self, value: str):
+        self._name = value
+
+    def set_long_name(self, long_name: bytes, check_sum: int):
+        """
+        Сохраняет сырое длинное имя записи, декодирование откладывается до первого обращения к name
+        :param long_name: байты длинного имени в UTF-16 в порядке следования частей
+        :param check_sum: контрольная сумма короткого имени из записей длинного имени
+        :return: None
+        """
+        self._name = None
+        self._long_name = long_name
+        self._long_name_check_sum = check_sum
+
+    def get_count_of_clusters(self, bytes_per_cluster: int):
+        """
+        Количество кластеров, которое должен занимать файл по своему размеру
+        :param bytes_per_cluster: размер кластера в байтах
+        :return: int, None - для директорий (их размер в записи не хранится)
+        """
+        if self.attr is None or self.attr.is_directory():
+            return None
+        return -(-self.file_size // bytes_per_cluster)
+
+    def get_creation_datetime(self):
+        return fat_datetime_to_datetime(self.creation_time >> 24, (self.creation_time >> 8) & 0xFFFF,
+                                        self.creation_time & 0xFF)
+
+    def get_write_datetime(self):
+        return fat_datetime_to_datetime(self.write_time >> 16, self.write_time & 0xFFFF)
+
+    def get_access_date(self):
+        result = fat_datetime_to_datetime(self.access_date, 0)
+        return result.date() if result is not None else None
+
+    def has_long_name(self):
+        """
+        Есть ли у записи длинное имя с верной контрольной суммой
+        :return: bool
+        """
+        return self._long_name is not None and \
+            self._long_name_check_sum == get_short_name_check_sum(self._short_name)
+
+    def get_short_name(self):
+        """
+        Короткое имя записи в виде 'NAME.EXT' (без дополняющих пробелов)
+        :return: str
+        """
+        if self._short_name is None:
+            return self._name
+        name = self._short_name[:8].decode().rstrip()
+        extension = self._short_name[8:].decode().rstrip()
+        return name + '.' + extension if extension else name
+
+    def get_path_name(self):
+        """
+        Имя записи для путей внутри образа: длинное имя, если оно есть, иначе короткое в виде 'NAME.EXT'
+        :return: str
+        """
+        return self.name if self.has_long_name() else self.get_short_name()
+
+    def is_dot_entry(self):
+        """
+        Является ли запись служебной записью '.' или '..', проверяется без декодирования имени
+        :return: bool
+        """
+        if self._short_name is not None:
+            return self._short_name[0] == 0x2E
+        return self._name.strip() == '.' or self._name.strip() == '..'
+
+    def _decode_name(self):
+        """
+        Декодирует имя записи. Длинное имя используется, только если его контрольная сумма совпадает с контрольной
+        суммой короткого имени, иначе части длинного имени считаются осиротевшими
+        :return: str
+        """
+        if self.has_long_name():
+            name = self._long_name.decode('utf-16')
+            cut = name.find('\x00')
+            return name[:cut] if cut != -1 else name
+        return self._short_name.decode()
 
 
 class DirectoryEntryLongNameInfo:
     """
     олучение информации о записи в директории являющаяся частью длинного имени
     """
+    __slots__ = ('value', '_names', 'check_sum')
+
+    LAST_LONG_ENTRY = 0x40
+
     def __init__(self, value: int, name1: bytes, check_sum: int, name2: bytes, name3: bytes):
         self.value = value
-        self._names = [name1, name2, name3]
+        self._names = name1 + name2 + name3
         self.check_sum = check_sum
 
+    def is_last_long_entry(self):
+        """
+        Является ли запись последней частью длинного имени (в директории она располагается первой)
+        :return: bool
+        """
+        return self.value & DirectoryEntryLongNameInfo.LAST_LONG_ENTRY != 0
+
+    def get_raw_name(self):
+        return self._names
+
     def get_full_name(self):
-        return b''.join(self._names).decode('utf-16')
+        return self._names.decode('utf-16')
+
+
+def fat_datetime_to_datetime(fat_date: int, fat_time: int, tenth: int = 0):
+    """
+    Декодирует дату и время в формате FAT (дата: год с 1980 - 7 бит, месяц - 4, день - 5; время: часы - 5 бит,
+    минуты - 6, секунды / 2 - 5; tenth - сотые доли секунды, 0-199)
+    :return: datetime.datetime, None - если дата не задана или некорректна
+    """
+    try:
+        return datetime.datetime(1980 + (fat_date >> 9), (fat_date >> 5) & 0x0F, fat_date & 0x1F,
+                                 fat_time >> 11, (fat_time >> 5) & 0x3F, (fat_time & 0x1F) * 2 + tenth // 100,
+                                 tenth % 100 * 10000)
+    except ValueError:
+        return None
+
+
+def get_short_name_check_sum(short_name: bytes):
+    """
+    Контрольная сумма короткого имени 8.3, которая хранится в каждой записи его длинного имени
+    :param short_name: 11 байт короткого имени
+    :return: int
+    """
+    check_sum = 0
+    for byte in short_name:
+        check_sum = (((check_sum & 1) << 7) + (check_sum >> 1) + byte) & 0xFF
+    return check_sum
 
 
 class Attribute:
     """
-    Класс для обработки атрибутов файла
+    Класс для обработки атрибутов файла. Атрибуты хранятся одним байтом, отдельные флаги вычисляются при обращении
     """
-    def __init__(self, archive: bool, directory: bool, volume_id: bool, system: bool, hidden: bool, read_only: bool):
-        self.archive = archive
-        self.dir = directory
-        self.volume_id = volume_id
-        self.system = system
-        self.hidden = hidden
-        self.read_only = read_only
+    __slots__ = ('value',)
+
+    ATTR_READ_ONLY = 0x01
+    ATTR_HIDDEN = 0x02
+    ATTR_SYSTEM = 0x04
+    ATTR_VOLUME_ID = 0x08
+    ATTR_DIRECTORY = 0x10
+    ATTR_ARCHIVE = 0x20
+    ATTR_LONG_NAME = ATTR_READ_ONLY | ATTR_HIDDEN | ATTR_SYSTEM | ATTR_VOLUME_ID
+    ATTR_LONG_NAME_MASK = ATTR_LONG_NAME | ATTR_DIRECTORY | ATTR_ARCHIVE
+
+    def __init__(self, value: int):
+        """
+        :param value: байт атрибутов записи в директории
+        """
+        self.value = value
+
+    @property
+    def archive(self):
+        return self.value & Attribute.ATTR_ARCHIVE != 0
+
+    @property
+    def dir(self):
+        return self.value & Attribute.ATTR_DIRECTORY != 0
+
+    @property
+    def volume_id(self):
+        return self.value & Attribute.ATTR_VOLUME_ID != 0
+
+    @property
+    def system(self):
+        return self.value & Attribute.ATTR_SYSTEM != 0
+
+    @property
+    def hidden(self):
+        return self.value & Attribute.ATTR_HIDDEN != 0
+
+    @property
+    def read_only(self):
+        return self.value & Attribute.ATTR_READ_ONLY != 0
 
     def is_long_name(self):
-        return self.read_only and self.hidden and self.system and self.volume_id and not self.dir and not self.archive
+        return is_long_name_attr(self.value)
 
     def is_directory(self):
-        return self.dir
+        return self.value & Attribute.ATTR_DIRECTORY != 0
+
+
+# атрибуты неизменяемы, поэтому на каждое из 256 значений байта атрибутов достаточно одного объекта
+_ATTRIBUTES = tuple(Attribute(value) for value in range(256))
 
 
 def attribute_parser(attr: int or None):
@@ -194,8 +490,16 @@ def attribute_parser(attr: int or None):
     """
     if attr is None:
         return None
-    return Attribute(attr & 0x20 == 32, attr & 0x10 == 16, attr & 0x08 == 8,
-                     attr & 0x04 == 4, attr & 0x02 == 2, attr & 0x01 == 1)
+    return _ATTRIBUTES[attr & 0xFF]
+
+
+def is_long_name_attr(attr: int):
+    """
+    Проверка байта атрибутов на принадлежность записи к длинному имени, без создания Attribute
+    :param attr: число, обозначающее байт атрибутов
+    :return: bool
+    """
+    return attr & Attribute.ATTR_LONG_NAME_MASK == Attribute.ATTR_LONG_NAME
 
 
 class IndexedEntryInfo:
@@ -205,6 +509,8 @@ class IndexedEntryInfo:
 
     Если кластер являетяся первым в файле или дириктории, то last_clus - None
     """
+    __slots__ = ('dir_entry_info', 'cur_clus', 'last_clus', 'is_directory')
+
     def __init__(self, dir_entry_info: DirectoryEntryInfo, cur_clus: int, last_clus: int or None, is_directory: bool):
         self.dir_entry_info = dir_entry_info
         self.cur_clus = cur_clus
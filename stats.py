@@ -0,0 +1,187 @@
+import cProfile
+import contextlib
+import functools
+import os
+import time
+
+
+class OperationStats:
+    """
+    Количество вызовов операции, суммарное и наибольшее время выполнения, количество байт (для ввода/вывода)
+    """
+    __slots__ = ('count', 'seconds', 'max_seconds', 'count_of_bytes')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.count_of_bytes = 0
+
+    def add(self, seconds: float, count_of_bytes: int = 0):
+        self.count += 1
+        self.seconds += seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+        self.count_of_bytes += count_of_bytes
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'seconds': self.seconds,
+            'mean_seconds': self.seconds / self.count if self.count else 0.0,
+            'max_seconds': self.max_seconds,
+            'bytes': self.count_of_bytes
+        }
+
+
+class Stats:
+    """
+    Статистика работы с образом: счётчики и время операций ввода/вывода (см. CountingFile, IOManager.start_stats) и
+    методов классов, подменённых instrument
+
+    Пока статистика не включена, ни один метод не подменяется и слой CountingFile не добавляется, поэтому выключенная
+    статистика ничего не стоит. Время вложенных операций входит и во время внешней (например, время чтений FAT входит
+    во время swap_cluster)
+    """
+    def __init__(self):
+        self.operations = {}
+        self._patched = []
+
+    def get_operation(self, name: str):
+        """
+        :return: OperationStats операции name, создаётся при первом обращении
+        """
+        operation = self.operations.get(name)
+        if operation is None:
+            operation = self.operations[name] = OperationStats()
+        return operation
+
+    def instrument(self, cls, method_names: list):
+        """
+        Подменяет методы method_names класса cls обёртками, считающими вызовы и время под именем 'Класс.метод'.
+        Действует на все экземпляры класса до вызова restore
+        """
+        for method_name in method_names:
+            method = cls.__dict__[method_name]
+            self._patched.append((cls, method_name, method))
+            setattr(cls, method_name, self._wrap(method, self.get_operation(f'{cls.__name__}.{method_name}')))
+
+    def restore(self):
+        """
+        Возвращает методы, подменённые instrument
+        """
+        for cls, method_name, method in reversed(self._patched):
+            setattr(cls, method_name, method)
+        self._patched = []
+
+    @staticmethod
+    def _wrap(method, operation: OperationStats):
+        perf_counter = time.perf_counter
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                operation.add(perf_counter() - start)
+        return wrapper
+
+    def to_dict(self):
+        """
+        :return: dict {имя операции: dict со счётчиками (см. OperationStats.to_dict)}
+        """
+        return {name: operation.to_dict() for name, operation in sorted(self.operations.items())}
+
+    def format_summary(self):
+        """
+        Текстовая сводка: выполнявшиеся операции по убыванию суммарного времени
+        :return: str
+        """
+        lines = []
+        for name, operation in sorted(self.operations.items(), key=lambda item: -item[1].seconds):
+            if not operation.count:
+                continue
+            line = f'{name}: {operation.count} вызовов, {operation.seconds:.3f} с, в среднем ' \
+                   f'{operation.seconds / operation.count * 1e6:.1f} мкс, наибольшее ' \
+                   f'{operation.max_seconds * 1e6:.1f} мкс'
+            if operation.count_of_bytes:
+                line += f', байт: {operation.count_of_bytes}'
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+class CountingFile:
+    """
+    Файловый объект, считающий чтения, записи и смещения в нижележащем файле образа, количество байт и время каждой
+    операции (операции 'io.read', 'io.write', 'io.seek', 'io.flush' в Stats). Данные передаются без изменений
+    """
+    def __init__(self, base, stats: Stats):
+        """
+        :param base: файловый объект образа
+        :param stats: статистика, в которую записываются счётчики
+        """
+        self.base = base
+        self._read = stats.get_operation('io.read')
+        self._write = stats.get_operation('io.write')
+        self._seek = stats.get_operation('io.seek')
+        self._flush = stats.get_operation('io.flush')
+
+    def read(self, count: int = -1):
+        start = time.perf_counter()
+        result = self.base.read(count)
+        self._read.add(time.perf_counter() - start, len(result))
+        return result
+
+    def readinto(self, buffer):
+        start = time.perf_counter()
+        readinto = getattr(self.base, 'readinto', None)
+        if readinto is not None:
+            count = readinto(buffer)
+        else:
+            data = self.base.read(len(buffer))
+            count = len(data)
+            buffer[:count] = data
+        self._read.add(time.perf_counter() - start, count)
+        return count
+
+    def write(self, value: bytes):
+        start = time.perf_counter()
+        result = self.base.write(value)
+        self._write.add(time.perf_counter() - start, len(value))
+        return result
+
+    def seek(self, position: int, whence: int = os.SEEK_SET):
+        start = time.perf_counter()
+        result = self.base.seek(position, whence)
+        self._seek.add(time.perf_counter() - start)
+        return result
+
+    def tell(self):
+        return self.base.tell()
+
+    def flush(self):
+        start = time.perf_counter()
+        self.base.flush()
+        self._flush.add(time.perf_counter() - start)
+
+    def close(self):
+        self.base.close()
+
+
+@contextlib.contextmanager
+def profiling(path: str or None):
+    """
+    Профилирует выполнение блока with с помощью cProfile и сохраняет результат в path (для pstats, snakeviz и т.п.).
+    Если path - None, ничего не делает
+    """
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
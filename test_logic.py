@@ -1,14 +1,34 @@
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+import struct
 import unittest
 from random import Random
+from unittest import mock
 
+import ImageTools
 from IOManager import IOManager
-from ImageTools import FatProcessor, DirectoryParser, get_fragmentation_data
+from ImageTools import Fat16Accessor, Fat32Accessor, FatPageCache, FatProcessor, DirectoryParser, FileReader, \
+    get_fragmentation_data, find_empty_clusters, FreeSpaceIndex
 from ParsingDiskImage import parse_disk_image
-from defrag import Defragmenter
+from batch import process_image, run_batch
+from compact import DirectoryCompactor
+from defrag import Defragmenter, place_by_directories, place_by_recency, place_by_size
 from enums import TypeOfFAT
-from error_in_fat import ErrorMaker
+from error_in_fat import ErrorDetector, ErrorMaker, find_differences_fats
+from extract import Extractor
 from fragm import Fragmenter
-from service_classes import InfoAboutImage
+from fsck import ConsistencyChecker
+from partitions import get_fat_partitions_of_image, read_partitions, GPT_BASIC_DATA_TYPE
+from verify import ManifestBuilder, compare_manifests
+from vhd import VhdFooter, VhdDynamicHeader, get_vhd_check_sum
+from progress import NdjsonRenderer, ProgressReporter
+from stats import Stats
+from service_classes import InfoAboutImage, DirectoryEntryInfo, attribute_parser, is_long_name_attr, \
+    get_short_name_check_sum, fat_datetime_to_datetime
 
 
 FAT_16_IMAGE = 'fat16_test'
@@ -27,6 +47,26 @@ class TestParseDiskImage(unittest.TestCase):
         self.assertEqual(file_system.get_type_of_fat(), TypeOfFAT.fat32)
 
 
+class TestInfoAboutImage(unittest.TestCase):
+    def test_boot_sector_fields_and_geometry(self):
+        for path in [FAT_16_IMAGE, FAT_32_IMAGE]:
+            io_manager = IOManager(path, read_only=True)
+            info = InfoAboutImage(io_manager)
+            io_manager.close()
+
+            self.assertIsInstance(info.BS_OEMName, bytes)
+            self.assertEqual(len(info.BS_VolLab), 11)
+            self.assertTrue(info.BS_FilSysType.startswith(b'FAT'))
+            self.assertEqual(info.get_bytes_per_cluster(), info.BPB_BytsPerSec * info.BPB_SecPerClus)
+            self.assertEqual(len(info.fat_offsets), info.BPB_NumFATs)
+            self.assertEqual(info.fat_offsets[0], info.BPB_ResvdSecCnt * info.BPB_BytsPerSec)
+            self.assertEqual(info.fat_offsets[1] - info.fat_offsets[0], info.fat_sz * info.BPB_BytsPerSec)
+            self.assertEqual(info.data_offset, info.first_data_sector * info.BPB_BytsPerSec)
+
+            with self.assertRaises(AttributeError):
+                info.BPB_NumFATs = 1
+
+
 class TestIOManager(unittest.TestCase):
     def test_io_manager_with_wrong_path(self):
         self.check_error(IOManager, FileNotFoundError, True, 'wrong_path')
@@ -54,6 +94,36 @@ class TestIOManager(unittest.TestCase):
         self.check_error(io_manager.read_bytes_and_convert_to_int, ValueError, True, 0)
         self.check_error(io_manager.read_bytes_and_convert_to_int, ValueError, True, -10)
 
+    def test_read_only_io_manager(self):
+        io_manager = IOManager('test_io_manager', read_only=True)
+        self.assertEqual(b'5', io_manager.read_some_bytes(1))
+        io_manager.seek(0)
+        self.check_error(io_manager.write_some_bytes, PermissionError, True, b'6')
+        self.check_error(io_manager.write_int_value, PermissionError, True, 6, 1)
+        io_manager.close()
+
+    def test_parse_read_only_image(self):
+        io_manager = IOManager(FAT_16_IMAGE, read_only=True)
+        file_system = parse_disk_image(io_manager)
+        error_detector = file_system.get_error_detector()
+        self.assertFalse(error_detector.is_looped_files())
+        self.assertEqual(error_detector.get_orphan_clusters(file_system.get_indexed_fat_table()), [])
+        io_manager.close()
+
+    def test_overlay(self):
+        io_manager = IOManager('test_io_manager', read_only=True)
+        io_manager.start_overlay()
+        io_manager.write_some_bytes(b'6')
+        io_manager.seek(0)
+        self.assertEqual(b'6', io_manager.read_some_bytes(1))
+        self.assertEqual(io_manager.get_count_of_changed_sectors(), 1)
+        self.check_error(io_manager.commit_overlay, PermissionError, True)
+
+        io_manager.discard_overlay()
+        io_manager.seek(0)
+        self.assertEqual(b'5', io_manager.read_some_bytes(1))
+        io_manager.close()
+
     def test_jump_back_with_correct_value(self):
         io_manager = IOManager('test_io_manager')
         io_manager.read_some_bytes(1)
@@ -129,6 +199,35 @@ class TestFatProcessor(unittest.TestCase):
         self.assertEqual(value_for_16, answer_for_16)
         self.assertEqual(value_for_32, answer_for_32)
 
+    def test_accessor_by_fat_type(self):
+        self.assertIsInstance(self.fp_16.accessor, Fat16Accessor)
+        self.assertIsInstance(self.fp_32.accessor, Fat32Accessor)
+        self.assertEqual(self.fp_32.accessor.decode(b'\xff\xff\xff\xff'), FatProcessor.END_CLUSTER_IN_WIN_FAT_32)
+        self.assertEqual(self.fp_16.accessor.encode(0xFFF8), b'\xf8\xff')
+
+    def test_batch_entries_and_values(self):
+        for fp in self.fp_16, self.fp_32:
+            count = fp.info.count_of_clusters
+            clusters = [count, 2, 5, 3, count - 1, 2]
+            self.assertEqual(list(fp.accessor.get_entries_in_fat(clusters, 1)),
+                             [fp.get_entry_for_cluster_in_fat(n, 1) for n in clusters])
+            self.assertEqual(list(fp.accessor.get_entries_in_data(clusters)),
+                             [fp.get_entry_for_cluster_in_data(n) for n in clusters])
+            self.assertEqual(list(fp.accessor.read_values(fp.io_manager, clusters, 0)),
+                             [fp.get_value_fat_cluster(n) for n in clusters])
+            self.assertEqual(len(fp.accessor.read_values(fp.io_manager, [], 0)), 0)
+            self.check_error(fp.accessor.get_entries_in_fat, ValueError, [2, count + 1], 0)
+            self.check_error(fp.accessor.read_values, ValueError, fp.io_manager, [-1, 2], 0)
+
+    def test_get_and_set_values(self):
+        for fp in self.fp_16, self.fp_32:
+            clusters = [c for c in range(2, fp.info.count_of_clusters) if fp.get_value_fat_cluster(c) == 0][:3]
+            fp.set_values(clusters + clusters[:1], [clusters[1], 0x1234, fp.end_cluster, fp.end_cluster])
+            for fat_num in range(fp.info.BPB_NumFATs):
+                self.assertEqual(list(fp.get_values(clusters, fat_num)), [fp.end_cluster, 0x1234, fp.end_cluster])
+            fp.set_values(clusters, [0] * len(clusters))
+            self.assertEqual(list(fp.get_values(clusters, 1)), [0] * len(clusters))
+
 
 class TestDirectoryParser(unittest.TestCase):
     def setUp(self):
@@ -187,6 +286,95 @@ class TestDirectoryParser(unittest.TestCase):
             self.assertIn(i, map(lambda x: x.name.strip(), dir_info.get_directories()))
 
 
+class TestAttribute(unittest.TestCase):
+    def test_flags(self):
+        attr = attribute_parser(0x31)
+        self.assertTrue(attr.is_directory())
+        self.assertTrue(attr.archive)
+        self.assertTrue(attr.read_only)
+        self.assertFalse(attr.hidden)
+        self.assertFalse(attr.is_long_name())
+
+    def test_long_name(self):
+        self.assertTrue(attribute_parser(0x0F).is_long_name())
+        self.assertTrue(is_long_name_attr(0xCF))
+        self.assertFalse(is_long_name_attr(0x1F))
+
+    def test_compact_representation(self):
+        self.assertIs(attribute_parser(0x20), attribute_parser(0x20))
+        self.assertIsNone(attribute_parser(None))
+        self.assertFalse(hasattr(DirectoryEntryInfo('NAME', 0x20, 2, 0), '__dict__'))
+
+
+class TestDirectoryEntryInfo(unittest.TestCase):
+    SHORT_NAME = b'LONGFI~1TXT'
+    LONG_NAME = 'long file.txt'.encode('utf-16-le') + b'\x00\x00' + b'\xff' * 10
+
+    def test_short_name(self):
+        entry = DirectoryEntryInfo(b'FILE    TXT', 0x20, 2, 0)
+        self.assertEqual(entry.name, 'FILE    TXT')
+        self.assertFalse(entry.is_dot_entry())
+        self.assertTrue(DirectoryEntryInfo(b'..         ', 0x10, 0, 0).is_dot_entry())
+
+    def test_long_name_with_correct_check_sum(self):
+        entry = DirectoryEntryInfo(self.SHORT_NAME, 0x20, 2, 0)
+        entry.set_long_name(self.LONG_NAME, get_short_name_check_sum(self.SHORT_NAME))
+        self.assertEqual(entry.name, 'long file.txt')
+
+    def test_long_name_with_wrong_check_sum(self):
+        entry = DirectoryEntryInfo(self.SHORT_NAME, 0x20, 2, 0)
+        entry.set_long_name(self.LONG_NAME, (get_short_name_check_sum(self.SHORT_NAME) + 1) & 0xFF)
+        self.assertEqual(entry.name, 'LONGFI~1TXT')
+
+    def test_size_and_timestamps(self):
+        # 2021-03-15 12:34:56.70, дата последнего доступа 2021-03-16
+        crt_date = (41 << 9) | (3 << 5) | 15
+        crt_time = (12 << 11) | (34 << 5) | (56 // 2)
+        entry = DirectoryEntryInfo(b'FILE    TXT', 0x20, 2, 0, 5000,
+                                   (crt_date << 24) | (crt_time << 8) | 170, (crt_date << 16) | crt_time, crt_date + 1)
+        self.assertEqual(entry.get_count_of_clusters(2048), 3)
+        self.assertEqual(entry.get_creation_datetime(), datetime.datetime(2021, 3, 15, 12, 34, 57, 700000))
+        self.assertEqual(entry.get_write_datetime(), datetime.datetime(2021, 3, 15, 12, 34, 56))
+        self.assertEqual(entry.get_access_date(), datetime.date(2021, 3, 16))
+        self.assertIsNone(DirectoryEntryInfo(b'DIR        ', 0x10, 2, 0).get_count_of_clusters(2048))
+        self.assertIsNone(fat_datetime_to_datetime(0, 0))
+
+
+class TestPathIndex(unittest.TestCase):
+    def setUp(self):
+        self.file_system_16 = parse_disk_image(IOManager(FAT_16_IMAGE))
+
+    def test_root_path(self):
+        root = self.file_system_16.get_entry_by_path('\\')
+        self.assertIs(root, self.file_system_16.get_entry_by_path('/'))
+        self.assertEqual(root.name, '\\')
+
+    def test_nested_directory_path(self):
+        entry = self.file_system_16.get_entry_by_path('FIRST/inside_folder')
+        self.assertIsNotNone(entry)
+        self.assertTrue(entry.attr.is_directory())
+        self.assertIs(entry, self.file_system_16.get_entry_by_path('\\FIRST\\inside_folder\\'))
+        self.assertEqual(self.file_system_16.get_entry_by_path('/FIRST').first_cluster_num, 8)
+
+    def test_file_path(self):
+        entry = self.file_system_16.get_entry_by_path('/FIRST/first file.txt')
+        self.assertIsNotNone(entry)
+        self.assertFalse(entry.attr.is_directory())
+
+    def test_short_name_and_case_insensitive_path(self):
+        entry = self.file_system_16.get_entry_by_path('/first/FIRST FILE.TXT')
+        self.assertIs(entry, self.file_system_16.get_entry_by_path('/FIRST/first file.txt'))
+        file_system_32 = parse_disk_image(IOManager(FAT_32_IMAGE))
+        entry = file_system_32.get_entry_by_path('/big folder/GEN.PY')
+        self.assertIsNotNone(entry)
+        self.assertFalse(entry.has_long_name())
+        self.assertIs(entry, file_system_32.get_entry_by_path('Big Folder/gen.py'))
+
+    def test_missing_path(self):
+        self.assertIsNone(self.file_system_16.get_entry_by_path('inside_folder'))
+        self.assertIsNone(self.file_system_16.get_entry_by_path('FIRST/missing'))
+
+
 FAT_16_IMAGE_FOR_DEFRAG = "fat16.vhd"
 FAT_32_IMAGE_FOR_DEFRAG = "fat32.vhd"
 
@@ -231,6 +419,133 @@ class DefragFragmTests(unittest.TestCase):
         value = get_fragmentation_data(self.file_system_32.get_fat_processor())
         self.assertTrue(value < 10)
 
+    def test_defragmentation_by_directories_fat_32(self):
+        Fragmenter(self.file_system_32, self.io_manager_32, Random(1)).fragmentation(100)
+        Defragmenter(self.file_system_32, self.io_manager_32).defragmentation('directories')
+
+        f_proc = self.file_system_32.get_fat_processor()
+        clusters = []
+        for entry in self.file_system_32.get_path_index().get_entries_in_tree_order():
+            if entry.name == '\\' or entry.first_cluster_num == 0:
+                continue
+            clus = entry.first_cluster_num
+            while not f_proc.is_end_cluster(clus):
+                clusters.append(clus)
+                clus = f_proc.get_value_fat_cluster(clus)
+        self.assertEqual(clusters, sorted(clusters))
+        self.io_manager_32.flush()
+        self.assertTrue(ConsistencyChecker(FAT_32_IMAGE_FOR_DEFRAG, 1).check()['clean'])
+
+    def test_placement_policies_order(self):
+        files = [e for e in place_by_size(self.file_system_16) if not e.attr.is_directory()]
+        self.assertEqual([e.file_size for e in files], sorted(e.file_size for e in files))
+        entries = place_by_recency(self.file_system_16)
+        self.assertEqual(sorted(entries, key=id), sorted(place_by_directories(self.file_system_16), key=id))
+        keys = [(e.access_date, e.write_time) for e in entries]
+        self.assertEqual(keys, sorted(keys, reverse=True))
+
+    def test_defragmentation_in_overlay_fat_32(self):
+        fragm = Fragmenter(self.file_system_32, self.io_manager_32, Random(1))
+        fragm.fragmentation(100)
+        self.io_manager_32.seek(0)
+        image_before = self.io_manager_32.read_some_bytes(self.file_system_32.get_fat_processor().info.BPB_TotSec32 *
+                                                          512)
+
+        self.io_manager_32.start_overlay()
+        Defragmenter(self.file_system_32, self.io_manager_32).defragmentation()
+        value = get_fragmentation_data(self.file_system_32.get_fat_processor())
+        self.assertTrue(value < 10)
+        self.assertTrue(self.io_manager_32.get_count_of_changed_sectors() > 0)
+
+        self.io_manager_32.seek(0)
+        image_after = self.io_manager_32.read_some_bytes(len(image_before))
+        self.io_manager_32.commit_overlay()
+        self.io_manager_32.seek(0)
+        self.assertEqual(self.io_manager_32.read_some_bytes(len(image_before)), image_after)
+        self.assertNotEqual(image_after, image_before)
+
+    def test_defragmentation_with_write_back_fat_16(self):
+        self.io_manager_16.start_write_back(1 << 20)
+        Fragmenter(self.file_system_16, self.io_manager_16, Random(1)).fragmentation(100)
+        Defragmenter(self.file_system_16, self.io_manager_16).defragmentation()
+        self.assertTrue(get_fragmentation_data(self.file_system_16.get_fat_processor()) < 2)
+        self.assertTrue(self.io_manager_16.stop_write_back() > 0)
+        self.io_manager_16.close()
+
+        self.assertTrue(ConsistencyChecker(FAT_16_IMAGE_FOR_DEFRAG, 1).check()['clean'])
+
+    def test_write_back_is_flushed_at_safe_point(self):
+        self.io_manager_16.start_write_back(512)
+        self.io_manager_16.seek(0)
+        boot_sector = self.io_manager_16.read_some_bytes(512)
+        self.io_manager_16.seek(0)
+        self.io_manager_16.write_some_bytes(boot_sector)
+
+        self.io_manager_16.safe_point()
+        self.assertEqual(self.io_manager_16.stop_write_back(), 0)
+
+    def test_defragmentation_of_directory_with_empty_file_fat_16(self):
+        f_proc = self.file_system_16.get_fat_processor()
+        dir_parser = DirectoryParser(f_proc)
+        entry_point = ErrorMaker(dir_parser, self.file_system_16)._get_free_entry_point_in_dir('docs')
+        dir_parser.create_entry_in_directory(entry_point, 'EMPTY   TXT', 0x00, 0)
+        self.io_manager_16.seek(entry_point + 28)
+        self.io_manager_16.write_int_value(0, 4)  # нулевой размер файла
+        try:
+            file_system = parse_disk_image(self.io_manager_16)
+            self.assertEqual(file_system.get_entry_by_path('docs/EMPTY.TXT').file_size, 0)
+            Fragmenter(file_system, self.io_manager_16, Random(1)).fragmentation(300)
+            Defragmenter(file_system, self.io_manager_16).defragmentation()
+            self.assertTrue(get_fragmentation_data(f_proc) < 2)
+        finally:
+            file_system = parse_disk_image(self.io_manager_16)
+            dir_entry = file_system.get_entry_by_path('docs')
+            dir_info = dir_parser.get_full_directory_info(dir_entry.first_cluster_num)
+            for entry in dir_info.entries_list:
+                if entry.get_path_name() == 'EMPTY.TXT':
+                    dir_parser.delete_entry_in_directory(entry.entry_point)
+        self.assertIsNone(parse_disk_image(self.io_manager_16).get_entry_by_path('docs/EMPTY.TXT'))
+
+    def test_defragmentation_of_path_fat_16(self):
+        fragm = Fragmenter(self.file_system_16, self.io_manager_16, Random(1))
+        fragm.fragmentation(100)
+
+        value_before = get_fragmentation_data(self.file_system_16.get_fat_processor())
+
+        defrag = Defragmenter(self.file_system_16, self.io_manager_16)
+        self.assertTrue(defrag.defragmentation_of_path('\\') > 0)
+
+        value_after = get_fragmentation_data(self.file_system_16.get_fat_processor())
+        self.assertTrue(value_after < value_before)
+
+    def test_defragmentation_of_path_skips_bad_cluster_fat_16(self):
+        Fragmenter(self.file_system_16, self.io_manager_16, Random(1)).fragmentation(100)
+        f_proc = self.file_system_16.get_fat_processor()
+        path_index = self.file_system_16.get_path_index()
+        for entry in path_index.get_entries_in_tree_order():
+            if entry.attr is None or entry.attr.is_directory() or entry.first_cluster_num == 0:
+                continue
+            second_clus = f_proc.get_value_fat_cluster(entry.first_cluster_num)
+            if not f_proc.is_end_cluster(second_clus) and second_clus != entry.first_cluster_num + 1:
+                break
+        else:
+            self.fail('no fragmented file')
+        f_proc.write_val_in_all_fat(f_proc.bad_cluster, entry.first_cluster_num)
+        try:
+            defrag = Defragmenter(self.file_system_16, self.io_manager_16)
+            files = defrag._get_files_by_path('\\')
+            self.assertIn(entry, files)
+            self.assertFalse(any(e.attr is None or e.attr.is_directory() or e.attr.volume_id for e in files))
+            self.assertFalse(defrag._relocate_file(entry, FreeSpaceIndex(f_proc)))
+            self.assertEqual(f_proc.get_value_fat_cluster(entry.first_cluster_num), f_proc.bad_cluster)
+        finally:
+            f_proc.write_val_in_all_fat(second_clus, entry.first_cluster_num)
+
+    def test_defragmentation_of_wrong_path(self):
+        defrag = Defragmenter(self.file_system_16, self.io_manager_16)
+        with self.assertRaises(ValueError):
+            defrag.defragmentation_of_path('wrong/path')
+
 
 class ErrorTest(unittest.TestCase):
     def setUp(self):
@@ -261,6 +576,50 @@ class ErrorTest(unittest.TestCase):
         error_detector.fix_differences_fats(0)
         self.assertFalse(error_detector.check_differences_fats())
 
+    def test_clearing_orphan_clusters_fat_16(self):
+        self.clearing_orphan_clusters(self.io_manager_16)
+
+    def test_clearing_orphan_clusters_fat_32(self):
+        self.clearing_orphan_clusters(self.io_manager_32)
+
+    def clearing_orphan_clusters(self, io_manager):
+        file_system = parse_disk_image(io_manager)
+        f_proc = file_system.get_fat_processor()
+        orphans = find_empty_clusters(4, f_proc.info, file_system.get_indexed_fat_table())
+        for clus in orphans:
+            f_proc.write_val_in_all_fat(clus + 1, clus)
+
+        error_detector = file_system.get_error_detector()
+        self.assertTrue(error_detector.clearing_fat_table(file_system.get_indexed_fat_table()))
+        self.assertEqual(error_detector.refresh_clus, orphans)
+        for clus in orphans:
+            for fat_num in range(f_proc.info.BPB_NumFATs):
+                self.assertEqual(f_proc.get_cluster_value_in_certain_fat(clus, fat_num), 0)
+
+        self.assertFalse(error_detector.clearing_fat_table(file_system.get_indexed_fat_table()))
+
+    def test_fat_scans_by_chunks_fat_16(self):
+        file_system = parse_disk_image(self.io_manager_16)
+        f_proc = file_system.get_fat_processor()
+        orphans = find_empty_clusters(4, f_proc.info, file_system.get_indexed_fat_table())
+        f_proc.set_values(orphans, [clus + 1 for clus in orphans])
+        clusters = [3, 10, 11, 25]
+        values = f_proc.get_values(clusters, 1)
+        for clus, value in zip(clusters, values):
+            f_proc.write_val_in_certain_fat(value ^ 1, clus, 1)
+        try:
+            count_of_free = f_proc.read_fat_table(0, 2).count(0)
+            with mock.patch.object(ImageTools, 'FAT_SCAN_CHUNK', 7):
+                self.assertEqual(f_proc.get_count_of_free_clusters(), count_of_free)
+                self.assertEqual(find_differences_fats(f_proc), clusters)
+                self.assertEqual(find_differences_fats(f_proc, 10, 10), [10, 11])
+                error_detector = ErrorDetector(f_proc)
+                self.assertEqual(error_detector.get_orphan_clusters(file_system.get_indexed_fat_table()), orphans)
+        finally:
+            for clus, value in zip(clusters, values):
+                f_proc.write_val_in_certain_fat(value, clus, 1)
+            f_proc.set_values(orphans, [0] * len(orphans))
+
     def test_looped_file_fat_16(self):
         self.looped_file_fat(self.error_maker_16, self.io_manager_16, '\\')
 
@@ -278,6 +637,55 @@ class ErrorTest(unittest.TestCase):
         error_detector.clearing_fat_table(file_system.get_indexed_fat_table())
         self.assertFalse(error_detector.is_looped_files())
 
+    def test_looped_file_is_reported_once_fat_16(self):
+        self.error_maker_16.make_looped_file('\\')
+        file_system = parse_disk_image(self.io_manager_16)
+        error_detector = file_system.get_error_detector()
+
+        self.assertEqual([entry.dir_entry_info.name for entry in error_detector.looped_files], ['ERRORLOOP  '])
+        self.assertFalse(error_detector.is_intersecting_files())
+
+        error_detector.fix_looped_files()
+        error_detector.clearing_fat_table(file_system.get_indexed_fat_table())
+
+    def test_check_reports_looped_file_fat_16(self):
+        self.assertTrue(ConsistencyChecker(FAT_16_IMAGE_FOR_DEFRAG, 1).check()['clean'])
+        self.error_maker_16.make_looped_file('\\')
+        self.io_manager_16.close()
+
+        report = ConsistencyChecker(FAT_16_IMAGE_FOR_DEFRAG, 2).check()
+        self.assertFalse(report['clean'])
+        self.assertEqual(report['looped_files'], ['/ERRORLOO.P'])
+        self.assertEqual(report['intersecting_files'], [])
+
+        io_manager = IOManager(FAT_16_IMAGE_FOR_DEFRAG)
+        file_system = parse_disk_image(io_manager)
+        error_detector = file_system.get_error_detector()
+        error_detector.fix_looped_files()
+        error_detector.clearing_fat_table(file_system.get_indexed_fat_table())
+        io_manager.close()
+        self.assertTrue(ConsistencyChecker(FAT_16_IMAGE_FOR_DEFRAG, 1).check()['clean'])
+
+    def test_check_reports_chain_longer_than_size_fat_16(self):
+        f_proc = FatProcessor(InfoAboutImage(self.io_manager_16), self.io_manager_16)
+        root = DirectoryParser(f_proc).get_fat16_root_directory_info()
+        entry = max((f for f in root.get_files() if not f.attr.volume_id), key=lambda f: f.file_size)
+        self.assertTrue(entry.get_count_of_clusters(f_proc.info.get_bytes_per_cluster()) > 1)
+        self.io_manager_16.seek(entry.entry_point + 28)
+        self.io_manager_16.write_int_value(1, 4)
+        self.io_manager_16.close()
+
+        report = ConsistencyChecker(FAT_16_IMAGE_FOR_DEFRAG, 1).check()
+        self.assertFalse(report['clean'])
+        self.assertEqual([(e['path'], e['problem']) for e in report['bad_entries']],
+                         [('/' + entry.name, 'chain_longer_than_size')])
+
+        io_manager = IOManager(FAT_16_IMAGE_FOR_DEFRAG)
+        io_manager.seek(entry.entry_point + 28)
+        io_manager.write_int_value(entry.file_size, 4)
+        io_manager.close()
+        self.assertTrue(ConsistencyChecker(FAT_16_IMAGE_FOR_DEFRAG, 1).check()['clean'])
+
     def test_intersecting_files_fat_16(self):
         self.intersecting_files(self.error_maker_16, self.io_manager_16, "\\")
 
@@ -296,5 +704,618 @@ class ErrorTest(unittest.TestCase):
         self.assertFalse(error_detector.is_intersecting_files())
 
 
+class BatchTest(unittest.TestCase):
+    def test_process_image_check(self):
+        result = process_image(FAT_16_IMAGE_FOR_DEFRAG, 'check')
+        self.assertEqual(result['status'], 'ok')
+        self.assertTrue(result['report']['clean'])
+
+    def test_process_image_fragmentation_and_defragmentation(self):
+        result = process_image(FAT_16_IMAGE_FOR_DEFRAG, 'fragmentation', 100, 1)
+        self.assertEqual(result['status'], 'ok')
+        self.assertTrue(result['fragmentation_after'] > result['fragmentation_before'])
+
+        result = process_image(FAT_16_IMAGE_FOR_DEFRAG, 'defragmentation')
+        self.assertEqual(result['status'], 'ok')
+        self.assertTrue(result['fragmentation_after'] < result['fragmentation_before'])
+
+    def test_process_missing_image(self):
+        result = process_image('missing.vhd', 'check')
+        self.assertEqual(result['status'], 'failed')
+
+    def test_run_batch(self):
+        output = io.StringIO()
+        summary = run_batch([FAT_16_IMAGE_FOR_DEFRAG, FAT_32_IMAGE_FOR_DEFRAG], 'check', output, 2)
+        self.assertEqual(summary, {'ok': 2})
+
+        results = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(sorted(result['image'] for result in results),
+                         [FAT_16_IMAGE_FOR_DEFRAG, FAT_32_IMAGE_FOR_DEFRAG])
+
+
+FAT_16_DYNAMIC_VHD = 'fat16_dynamic.vhd'
+
+
+def make_dynamic_vhd(raw_path: str, vhd_path: str, block_size: int):
+    """
+    Создаёт динамический образ VHD с содержимым сырого образа, нулевые блоки не выделяются
+    """
+    with open(raw_path, 'rb') as raw_image:
+        data = raw_image.read()
+    count_of_blocks = -(-len(data) // block_size)
+    table_size = -(-4 * count_of_blocks // 512) * 512
+
+    footer = bytearray(VhdFooter.STRUCT.pack(VhdFooter.COOKIE, 2, 0x00010000, 512, 0, b'test', 0, b'Wi2k', len(data),
+                                             len(data), 0, VhdFooter.DISK_TYPE_DYNAMIC, 0, bytes(16), 0, bytes(427)))
+    footer[64:68] = get_vhd_check_sum(footer, 64).to_bytes(4, 'big')
+    header = bytearray(VhdDynamicHeader.SIZE)
+    VhdDynamicHeader.STRUCT.pack_into(header, 0, VhdDynamicHeader.COOKIE, 0xFFFFFFFFFFFFFFFF, 1536, 0x00010000,
+                                      count_of_blocks, block_size, 0)
+    header[36:40] = get_vhd_check_sum(header, 36).to_bytes(4, 'big')
+
+    bat = []
+    blocks = []
+    next_sector = (1536 + table_size) // 512
+    for i in range(count_of_blocks):
+        block = data[i * block_size:(i + 1) * block_size].ljust(block_size, b'\x00')
+        if block.count(0) == block_size:
+            bat.append(0xFFFFFFFF)
+            continue
+        bat.append(next_sector)
+        blocks.append(b'\xff' * 512 + block)
+        next_sector += (512 + block_size) // 512
+
+    with open(vhd_path, 'wb') as vhd_image:
+        vhd_image.write(footer + header + struct.pack(f'>{count_of_blocks}I', *bat).ljust(table_size, b'\xff'))
+        vhd_image.write(b''.join(blocks) + footer)
+
+
+class DynamicVhdTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.vhd_path = os.path.join(temp_dir.name, FAT_16_DYNAMIC_VHD)
+        make_dynamic_vhd(FAT_16_IMAGE_FOR_DEFRAG, self.vhd_path, 1 << 16)
+
+    def test_read_dynamic_vhd(self):
+        with open(FAT_16_IMAGE_FOR_DEFRAG, 'rb') as raw_image:
+            data = raw_image.read()
+        io_manager = IOManager(self.vhd_path)
+        self.assertEqual(io_manager.read_some_bytes(len(data)), data)
+        io_manager.seek(100000)
+        self.assertEqual(io_manager.read_some_bytes(300000), data[100000:400000])
+        io_manager.close()
+
+    def test_write_to_unused_block(self):
+        size = os.path.getsize(FAT_16_IMAGE_FOR_DEFRAG)
+        io_manager = IOManager(self.vhd_path)
+        io_manager.seek(size - 70000)
+        io_manager.write_some_bytes(b'\x01' * 70000)
+        io_manager.close()
+
+        io_manager = IOManager(self.vhd_path)
+        io_manager.seek(size - 70001)
+        self.assertEqual(io_manager.read_some_bytes(70001), b'\x00' + b'\x01' * 70000)
+        io_manager.close()
+
+    def test_defragmentation_of_dynamic_vhd(self):
+        io_manager = IOManager(self.vhd_path)
+        file_system = parse_disk_image(io_manager)
+        self.assertEqual(file_system.get_type_of_fat(), TypeOfFAT.fat16)
+
+        Fragmenter(file_system, io_manager, Random(1)).fragmentation(100)
+        Defragmenter(file_system, io_manager).defragmentation()
+        self.assertTrue(get_fragmentation_data(file_system.get_fat_processor()) < 2)
+        io_manager.close()
+
+        self.assertTrue(ConsistencyChecker(self.vhd_path, 1).check()['clean'])
+
+
+FAT_16_MBR_DISK = 'fat16_mbr_disk'
+FAT_16_GPT_DISK = 'fat16_gpt_disk'
+PARTITION_OFFSET = 1 << 20
+
+
+def make_disk(raw_path: str, disk_path: str, gpt: bool):
+    """
+    Создаёт образ диска с таблицей разделов: раздел с томом из сырого образа и пустой раздел не FAT после него
+    """
+    with open(raw_path, 'rb') as raw_image:
+        data = raw_image.read()
+    first_lba = PARTITION_OFFSET // 512
+    count_of_sectors = len(data) // 512
+    disk = bytearray(PARTITION_OFFSET + len(data) + PARTITION_OFFSET)
+    disk[PARTITION_OFFSET:PARTITION_OFFSET + len(data)] = data
+
+    if gpt:
+        struct.pack_into('<B3sB3sII', disk, 446, 0, bytes(3), 0xEE, bytes(3), 1, len(disk) // 512 - 1)
+        struct.pack_into('<8sIIIIQQQQ16sQIII', disk, 512, b'EFI PART', 0x00010000, 92, 0, 0, 1, 0, 34, 0, bytes(16),
+                         2, 128, 128, 0)
+        struct.pack_into('<16s16sQQQ72s', disk, 1024, GPT_BASIC_DATA_TYPE.bytes_le, bytes(16), first_lba,
+                         first_lba + count_of_sectors - 1, 0, bytes(72))
+        struct.pack_into('<16s16sQQQ72s', disk, 1152, b'\x01' * 16, bytes(16), first_lba + count_of_sectors,
+                         first_lba + count_of_sectors + 2047, 0, bytes(72))
+    else:
+        struct.pack_into('<B3sB3sII', disk, 446, 0, bytes(3), 0x0E, bytes(3), first_lba, count_of_sectors)
+        struct.pack_into('<B3sB3sII', disk, 462, 0, bytes(3), 0x83, bytes(3), first_lba + count_of_sectors, 2048)
+    disk[510:512] = b'\x55\xaa'
+
+    with open(disk_path, 'wb') as disk_image:
+        disk_image.write(disk)
+
+
+class PartitionsTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.mbr_disk = os.path.join(temp_dir.name, FAT_16_MBR_DISK)
+        self.gpt_disk = os.path.join(temp_dir.name, FAT_16_GPT_DISK)
+        make_disk(FAT_16_IMAGE_FOR_DEFRAG, self.mbr_disk, False)
+        make_disk(FAT_16_IMAGE_FOR_DEFRAG, self.gpt_disk, True)
+
+    def test_volume_has_no_partitions(self):
+        with open(FAT_16_IMAGE_FOR_DEFRAG, 'rb') as image:
+            self.assertEqual(read_partitions(image), [])
+
+    def test_get_fat_partitions(self):
+        for disk in [self.mbr_disk, self.gpt_disk]:
+            partitions = get_fat_partitions_of_image(disk)
+            self.assertEqual([partition.number for partition in partitions], [1])
+            self.assertEqual(partitions[0].offset, PARTITION_OFFSET)
+
+    def test_parse_partition(self):
+        for disk in [self.mbr_disk, self.gpt_disk]:
+            io_manager = IOManager(disk, 1)
+            file_system = parse_disk_image(io_manager)
+            self.assertEqual(file_system.get_type_of_fat(), TypeOfFAT.fat16)
+            self.assertIsNotNone(file_system.get_entry_by_path('/'))
+            io_manager.close()
+
+            self.assertTrue(ConsistencyChecker(disk, 2, 1).check()['clean'])
+
+    def test_defragmentation_of_partition(self):
+        with open(self.mbr_disk, 'rb') as disk:
+            data_before = disk.read()
+
+        io_manager = IOManager(self.mbr_disk, 1)
+        file_system = parse_disk_image(io_manager)
+        Fragmenter(file_system, io_manager, Random(1)).fragmentation(100)
+        Defragmenter(file_system, io_manager).defragmentation()
+        io_manager.close()
+
+        with open(self.mbr_disk, 'rb') as disk:
+            data = disk.read()
+        self.assertEqual(data[:PARTITION_OFFSET], data_before[:PARTITION_OFFSET])
+        self.assertEqual(data[-PARTITION_OFFSET:], data_before[-PARTITION_OFFSET:])
+        self.assertNotEqual(data, data_before)
+        self.assertTrue(ConsistencyChecker(self.mbr_disk, 1, 1).check()['clean'])
+
+    def test_wrong_partition(self):
+        with self.assertRaises(ValueError):
+            IOManager(self.mbr_disk, 3)
+
+    def _make_extended_disk(self, disk_path: str, looped: bool = False):
+        """
+        Создаёт диск с расширенным разделом MBR: в цепочке два EBR, том FAT - во втором логическом разделе (номер 6)
+        """
+        with open(FAT_16_IMAGE_FOR_DEFRAG, 'rb') as raw_image:
+            data = raw_image.read()
+        first_lba = PARTITION_OFFSET // 512
+        disk = bytearray(PARTITION_OFFSET + len(data))
+        disk[PARTITION_OFFSET:] = data
+        struct.pack_into('<B3sB3sII', disk, 446, 0, bytes(3), 0x0F, bytes(3), 1, len(disk) // 512 - 1)
+        disk[510:512] = b'\x55\xaa'
+        for ebr_lba, logical_type, logical_lba, count_of_sectors, next_lba in [
+                (1, 0x83, 1, 16, 100),
+                (101, 0x0E, first_lba - 101, len(data) // 512, 0 if looped else None)]:
+            struct.pack_into('<B3sB3sII', disk, ebr_lba * 512 + 446, 0, bytes(3), logical_type, bytes(3), logical_lba,
+                             count_of_sectors)
+            if next_lba is not None:
+                struct.pack_into('<B3sB3sII', disk, ebr_lba * 512 + 462, 0, bytes(3), 0x05, bytes(3), next_lba, 1)
+            disk[ebr_lba * 512 + 510:ebr_lba * 512 + 512] = b'\x55\xaa'
+        with open(disk_path, 'wb') as disk_image:
+            disk_image.write(disk)
+
+    def test_logical_partitions(self):
+        disk = os.path.join(os.path.dirname(self.mbr_disk), 'extended_disk')
+        self._make_extended_disk(disk)
+        with open(disk, 'rb') as image:
+            partitions = read_partitions(image)
+        self.assertEqual([(partition.number, partition.type) for partition in partitions],
+                         [(1, 0x0F), (5, 0x83), (6, 0x0E)])
+        self.assertEqual(partitions[1].offset, 2 * 512)
+
+        fat_partitions = get_fat_partitions_of_image(disk)
+        self.assertEqual([partition.number for partition in fat_partitions], [6])
+        self.assertEqual(fat_partitions[0].offset, PARTITION_OFFSET)
+        io_manager = IOManager(disk, 6)
+        self.assertIsNotNone(parse_disk_image(io_manager).get_entry_by_path('/'))
+        io_manager.close()
+
+        self._make_extended_disk(disk, looped=True)
+        with open(disk, 'rb') as image, self.assertRaises(ValueError):
+            read_partitions(image)
+
+
+class VerifyTest(unittest.TestCase):
+    def test_manifest_after_fragmentation_and_defragmentation(self):
+        manifest_before = ManifestBuilder(FAT_32_IMAGE_FOR_DEFRAG, workers=4).build()
+        self.assertTrue(len(manifest_before['files']) > 0)
+
+        io_manager = IOManager(FAT_32_IMAGE_FOR_DEFRAG)
+        file_system = parse_disk_image(io_manager)
+        Fragmenter(file_system, io_manager, Random(1)).fragmentation(100)
+        Defragmenter(file_system, io_manager).defragmentation()
+        io_manager.close()
+
+        manifest_after = ManifestBuilder(FAT_32_IMAGE_FOR_DEFRAG, workers=4).build()
+        self.assertTrue(compare_manifests(manifest_before, manifest_after)['same'])
+
+    def test_manifest_of_another_image_is_not_reused(self):
+        manifest = ManifestBuilder(FAT_16_IMAGE_FOR_DEFRAG).build()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            copy_path = shutil.copy2(FAT_16_IMAGE_FOR_DEFRAG, os.path.join(temp_dir, FAT_16_IMAGE_FOR_DEFRAG))
+            manifest_of_copy = ManifestBuilder(copy_path).build(manifest)
+        self.assertIsNot(manifest_of_copy, manifest)
+        self.assertEqual(manifest_of_copy['image'], os.path.abspath(copy_path))
+        self.assertTrue(compare_manifests(manifest, manifest_of_copy)['same'])
+
+    def test_manifest_detects_changed_file(self):
+        manifest_before = ManifestBuilder(FAT_16_IMAGE_FOR_DEFRAG, workers=2).build()
+        self.assertIs(ManifestBuilder(FAT_16_IMAGE_FOR_DEFRAG).build(manifest_before), manifest_before)
+
+        io_manager = IOManager(FAT_16_IMAGE_FOR_DEFRAG)
+        file_system = parse_disk_image(io_manager)
+        f_proc = file_system.get_fat_processor()
+        directory = DirectoryParser(f_proc).get_fat16_root_directory_info()
+        file_entry = [f for f in directory.get_files() if f.first_cluster_num != 0 and not f.attr.volume_id][0]
+        data = f_proc.read_all_cluster_in_data(file_entry.first_cluster_num)
+        f_proc.write_all_cluster_in_data(bytes([data[0] ^ 0xFF]) + data[1:], file_entry.first_cluster_num)
+        io_manager.close()
+
+        comparison = compare_manifests(manifest_before, ManifestBuilder(FAT_16_IMAGE_FOR_DEFRAG).build())
+        self.assertFalse(comparison['same'])
+        self.assertEqual(comparison['changed'], ['/' + file_entry.name])
+        self.assertEqual(comparison['missing'], [])
+
+
+class FileReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.io_manager = IOManager(FAT_16_IMAGE_FOR_DEFRAG)
+        self.file_system = parse_disk_image(self.io_manager)
+        Fragmenter(self.file_system, self.io_manager, Random(1)).fragmentation(100)
+        self.f_proc = self.file_system.get_fat_processor()
+        root = DirectoryParser(self.f_proc).get_fat16_root_directory_info()
+        self.entry = max((f for f in root.get_files() if not f.attr.volume_id), key=lambda f: f.file_size)
+
+    def tearDown(self):
+        self.io_manager.close()
+
+    def _read_by_clusters(self):
+        data = b''
+        clus = self.entry.first_cluster_num
+        while not self.f_proc.is_end_cluster(clus):
+            data += self.f_proc.read_all_cluster_in_data(clus)
+            clus = self.f_proc.get_value_fat_cluster(clus)
+        return data[:self.entry.file_size]
+
+    def test_read_file(self):
+        expected = self._read_by_clusters()
+        reader = FileReader(self.f_proc, self.entry.first_cluster_num, self.entry.file_size)
+        self.assertEqual(reader.read(), expected)
+        self.assertEqual(reader.read(), b'')
+
+        buffer = bytearray(1000)
+        reader.seek(10)
+        count = reader.readinto(buffer)
+        self.assertEqual(bytes(buffer[:count]), expected[10:10 + count])
+
+    def test_read_file_with_wrong_first_cluster(self):
+        for first_cluster in [0, 1, self.f_proc.info.count_of_clusters + 2]:
+            with self.assertRaises(ValueError):
+                FileReader(self.f_proc, first_cluster, self.entry.file_size)
+        self.assertEqual(FileReader(self.f_proc, 0, 0).read(), b'')
+
+    def test_extract(self):
+        with tempfile.TemporaryDirectory() as destination:
+            count_of_files, count_of_bytes, count_of_skipped = Extractor(self.file_system).extract('/', destination)
+            self.assertTrue(count_of_files > 1)
+            self.assertEqual(count_of_skipped, 0)
+            with open(os.path.join(destination, self.entry.name), 'rb') as extracted:
+                self.assertEqual(extracted.read(), self._read_by_clusters())
+
+        with self.assertRaises(ValueError):
+            Extractor(self.file_system).extract('wrong/path', '.')
+
+    def test_extract_skips_broken_file(self):
+        dir_parser = DirectoryParser(self.f_proc)
+        entry_point = ErrorMaker(dir_parser, self.file_system)._get_free_entry_point_in_dir('docs')
+        dir_parser.create_entry_in_directory(entry_point, 'BROKEN  TXT', 0x00, 1)  # непустой файл без цепочки
+        try:
+            with tempfile.TemporaryDirectory() as destination, mock.patch('sys.stderr', new=io.StringIO()) as err:
+                count_of_files, _, count_of_skipped = Extractor(parse_disk_image(self.io_manager)).extract(
+                    '/', destination)
+                self.assertEqual(count_of_skipped, 1)
+                self.assertTrue(count_of_files > 1)
+                self.assertIn('docs/BROKEN.TXT', err.getvalue().replace('\\', '/'))
+                self.assertFalse(os.path.exists(os.path.join(destination, 'docs', 'BROKEN.TXT')))
+        finally:
+            dir_parser.delete_entry_in_directory(entry_point)
+
+
+class DirectoryCompactorTest(unittest.TestCase):
+    def _spread_directory(self, path: str):
+        """
+        Переписывает директорию, вставляя после каждой записи удалённую, и добавляет в её цепочку лишний кластер
+        :return: (исходная цепочка кластеров, исходное содержимое кластеров, количество добавленных кластеров)
+        """
+        io_manager = IOManager(FAT_16_IMAGE_FOR_DEFRAG)
+        file_system = parse_disk_image(io_manager)
+        f_proc = file_system.get_fat_processor()
+        bytes_per_cluster = f_proc.info.get_bytes_per_cluster()
+        chain = []
+        clus = file_system.get_entry_by_path(path).first_cluster_num
+        while not f_proc.is_end_cluster(clus):
+            chain.append(clus)
+            clus = f_proc.get_value_fat_cluster(clus)
+        raw = b''.join(f_proc.read_all_cluster_in_data(clus) for clus in chain)
+
+        spread = bytearray()
+        for offset in range(0, len(raw), 32):
+            if raw[offset] == 0:
+                break
+            spread += raw[offset:offset + 32] + b'\xe5' + raw[offset + 1:offset + 32]
+        count_of_added = -(-len(spread) // bytes_per_cluster) - len(chain) + 1
+        new_chain = chain + find_empty_clusters(count_of_added, f_proc.info, file_system.get_indexed_fat_table())
+        spread += bytes(len(new_chain) * bytes_per_cluster - len(spread))
+        for i, clus in enumerate(new_chain):
+            f_proc.write_all_cluster_in_data(bytes(spread[i * bytes_per_cluster:(i + 1) * bytes_per_cluster]), clus)
+            f_proc.write_val_in_all_fat(new_chain[i + 1] if i + 1 < len(new_chain) else 0xFFFF, clus)
+        io_manager.close()
+        return chain, raw, count_of_added
+
+    def test_compaction_fat_16(self):
+        io_manager = IOManager(FAT_16_IMAGE_FOR_DEFRAG)
+        DirectoryCompactor(parse_disk_image(io_manager), io_manager).compaction()
+        io_manager.close()
+
+        chain, raw, count_of_added = self._spread_directory('many')
+        self.assertTrue(ConsistencyChecker(FAT_16_IMAGE_FOR_DEFRAG, 1).check()['clean'])
+
+        io_manager = IOManager(FAT_16_IMAGE_FOR_DEFRAG)
+        file_system = parse_disk_image(io_manager)
+        count_of_directories, count_of_freed = DirectoryCompactor(file_system, io_manager).compaction()
+        self.assertEqual(count_of_directories, 1)
+        self.assertEqual(count_of_freed, count_of_added)
+
+        f_proc = file_system.get_fat_processor()
+        self.assertEqual(b''.join(f_proc.read_all_cluster_in_data(clus) for clus in chain), raw)
+        self.assertTrue(f_proc.is_end_cluster(f_proc.get_value_fat_cluster(chain[-1])))
+        dir_info = DirectoryParser(f_proc).get_full_directory_info(chain[0])
+        for entry in dir_info.entries_list:
+            if not entry.is_dot_entry():
+                self.assertEqual(file_system.get_entry_by_path('many/' + entry.name).entry_point, entry.entry_point)
+        self.assertEqual(DirectoryCompactor(file_system, io_manager).compaction(), (0, 0))
+        io_manager.close()
+        self.assertTrue(ConsistencyChecker(FAT_16_IMAGE_FOR_DEFRAG, 1).check()['clean'])
+
+    def test_looped_directory_is_skipped_fat_16(self):
+        io_manager = IOManager(FAT_16_IMAGE_FOR_DEFRAG)
+        file_system = parse_disk_image(io_manager)
+        f_proc = file_system.get_fat_processor()
+        entry = file_system.get_entry_by_path('many')
+        compactor = DirectoryCompactor(file_system, io_manager)
+        chain = compactor._get_directory_clusters(entry)
+        self.assertTrue(len(chain) > 0)
+
+        end_value = f_proc.get_value_fat_cluster(chain[-1])
+        f_proc.write_val_in_all_fat(chain[0], chain[-1])
+        try:
+            self.assertEqual(compactor._get_directory_clusters(entry), [])
+        finally:
+            f_proc.write_val_in_all_fat(end_value, chain[-1])
+            io_manager.close()
+
+
+class FSInfoTest(unittest.TestCase):
+    @staticmethod
+    def _count_free_clusters(f_proc: FatProcessor):
+        return f_proc.read_fat_table(0, 2).count(0)
+
+    def test_free_count_is_kept_up_to_date_fat_32(self):
+        io_manager = IOManager(FAT_32_IMAGE_FOR_DEFRAG)
+        file_system = parse_disk_image(io_manager)
+        f_proc = file_system.get_fat_processor()
+        self.assertIsNotNone(f_proc.fs_info)
+        free_count = f_proc.get_count_of_free_clusters()
+        free_count_in_fat = self._count_free_clusters(f_proc)
+
+        clusters = f_proc.find_free_clusters(3)
+        for clus in clusters:
+            f_proc.write_val_in_all_fat(clus, clus)
+        Fragmenter(file_system, io_manager, Random(1)).fragmentation(100)
+        io_manager.close()
+
+        io_manager = IOManager(FAT_32_IMAGE_FOR_DEFRAG)
+        file_system = parse_disk_image(io_manager)
+        f_proc = file_system.get_fat_processor()
+        self.assertEqual(f_proc.fs_info.get_free_count(), free_count - 3)
+        self.assertEqual(f_proc.fs_info.nxt_free, clusters[-1])
+        file_system.get_error_detector().clearing_fat_table(file_system.get_indexed_fat_table())
+        io_manager.close()
+
+        io_manager = IOManager(FAT_32_IMAGE_FOR_DEFRAG, read_only=True)
+        f_proc = FatProcessor(InfoAboutImage(io_manager), io_manager)
+        self.assertEqual(f_proc.get_count_of_free_clusters(), free_count)
+        self.assertEqual(self._count_free_clusters(f_proc), free_count_in_fat)
+        io_manager.close()
+
+    def test_overlay_discard_reloads_fs_info_fat_32(self):
+        io_manager = IOManager(FAT_32_IMAGE_FOR_DEFRAG)
+        f_proc = FatProcessor(InfoAboutImage(io_manager), io_manager)
+        free_count = f_proc.get_count_of_free_clusters()
+        io_manager.start_overlay()
+        clus = f_proc.find_free_clusters(1)[0]
+        f_proc.write_val_in_all_fat(clus, clus)
+        self.assertEqual(f_proc.get_count_of_free_clusters(), free_count - 1)
+        io_manager.discard_overlay()
+        self.assertEqual(f_proc.get_count_of_free_clusters(), free_count)
+        io_manager.close()
+
+    def test_next_free_hint_fat_32(self):
+        io_manager = IOManager(FAT_32_IMAGE_FOR_DEFRAG)
+        f_proc = FatProcessor(InfoAboutImage(io_manager), io_manager)
+        fs_info = f_proc.fs_info
+        nxt_free = fs_info.nxt_free
+        table = f_proc.read_fat_table(0)
+        last_free = max(clus for clus in range(2, len(table)) if table[clus] == 0)
+        fs_info.nxt_free = last_free
+        self.assertEqual(f_proc.find_free_clusters(2)[0], last_free)
+
+        fs_info.nxt_free = f_proc.info.count_of_clusters + 1
+        fs_info.dirty = True
+        fs_info.flush(io_manager)
+        self.assertTrue(fs_info.reload(io_manager))
+        self.assertEqual(fs_info.nxt_free, f_proc.info.count_of_clusters + 1)
+        self.assertEqual(len(f_proc.find_free_clusters(1)), 1)
+
+        fs_info.nxt_free = nxt_free
+        fs_info.dirty = True
+        fs_info.flush(io_manager)
+        io_manager.close()
+
+    def test_no_fs_info(self):
+        io_manager = IOManager(FAT_16_IMAGE_FOR_DEFRAG, read_only=True)
+        f_proc = FatProcessor(InfoAboutImage(io_manager), io_manager)
+        self.assertIsNone(f_proc.fs_info)
+        self.assertEqual(f_proc.get_count_of_free_clusters(), self._count_free_clusters(f_proc))
+        io_manager.close()
+
+
+class StatsTest(unittest.TestCase):
+    def test_io_counters_and_instrumented_methods(self):
+        stats = Stats()
+        get_value = FatProcessor.get_cluster_value_in_certain_fat
+        stats.instrument(FatProcessor, ['get_cluster_value_in_certain_fat', 'read_fat_table'])
+        try:
+            io_manager = IOManager(FAT_16_IMAGE, read_only=True)
+            io_manager.start_stats(stats)
+            f_proc = FatProcessor(InfoAboutImage(io_manager), io_manager)
+            f_proc.get_value_fat_cluster(2)
+            f_proc.get_value_fat_cluster(3)
+            f_proc.read_fat_table(0)
+            io_manager.start_overlay()
+            self.assertRaises(ValueError, io_manager.start_stats, stats)
+            io_manager.close()
+        finally:
+            stats.restore()
+        self.assertIs(FatProcessor.get_cluster_value_in_certain_fat, get_value)
+
+        report = stats.to_dict()
+        self.assertEqual(report['FatProcessor.get_cluster_value_in_certain_fat']['count'], 2)
+        self.assertEqual(report['FatProcessor.read_fat_table']['count'], 1)
+        self.assertEqual(report['io.read']['count'], 4)
+        self.assertEqual(report['io.read']['bytes'], 512 + 2 + 2 + (f_proc.info.count_of_clusters + 1) * 2)
+        self.assertGreaterEqual(report['io.seek']['count'], 4)
+        self.assertIn('FatProcessor.read_fat_table: 1', stats.format_summary())
+
+
+class ProgressTest(unittest.TestCase):
+    def test_reports_are_rate_limited(self):
+        reports = []
+        progress = ProgressReporter(reports.append, min_interval=3600)
+        progress.start('test', 10, lambda: 12.5)
+        for _ in range(10):
+            progress.update(1, 512)
+        progress.finish()
+
+        self.assertEqual([r['event'] for r in reports], ['start', 'finish'])
+        self.assertEqual(reports[-1]['clusters_processed'], 10)
+        self.assertEqual(reports[-1]['bytes_moved'], 5120)
+        self.assertEqual(reports[-1]['fragmentation'], 12.5)
+        self.assertEqual(reports[-1]['eta_seconds'], 0.0)
+
+    def test_defragmentation_progress_ndjson_fat_16(self):
+        stream = io.StringIO()
+        progress = ProgressReporter(NdjsonRenderer(stream), min_interval=0)
+        io_manager = IOManager(FAT_16_IMAGE_FOR_DEFRAG)
+        file_system = parse_disk_image(io_manager, progress)
+        Defragmenter(file_system, io_manager).defragmentation(progress=progress)
+        io_manager.close()
+
+        reports = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([r['operation'] for r in reports if r['event'] != 'progress'],
+                         ['differences_fats', 'differences_fats', 'defragmentation', 'defragmentation'])
+        last = reports[-1]
+        self.assertEqual(last['clusters_processed'], last['total_clusters'])
+        self.assertIsNotNone(last['fragmentation'])
+        self.assertTrue(all(r['clusters_processed'] <= r['total_clusters'] for r in reports))
+
+
+class FatPageCacheTest(unittest.TestCase):
+    def test_defragmentation_with_small_cache_fat_32(self):
+        manifest_before = ManifestBuilder(FAT_32_IMAGE_FOR_DEFRAG).build()
+
+        io_manager = IOManager(FAT_32_IMAGE_FOR_DEFRAG)
+        file_system = parse_disk_image(io_manager, fat_cache_memory=2 * FatPageCache.PAGE_SIZE)
+        f_proc = file_system.get_fat_processor()
+        Fragmenter(file_system, io_manager, Random(3)).fragmentation(300)
+        Defragmenter(file_system, io_manager).defragmentation()
+        self.assertLessEqual(f_proc.cache.get_count_of_pages(), 2)
+        io_manager.close()
+
+        io_manager = IOManager(FAT_32_IMAGE_FOR_DEFRAG, read_only=True)
+        file_system = parse_disk_image(io_manager)
+        error_detector = file_system.get_error_detector()
+        self.assertFalse(error_detector.is_differences_fats())
+        self.assertFalse(error_detector.is_looped_files() or error_detector.is_intersecting_files())
+        self.assertEqual(error_detector.get_orphan_clusters(file_system.get_indexed_fat_table()), [])
+        io_manager.close()
+        self.assertTrue(compare_manifests(manifest_before, ManifestBuilder(FAT_32_IMAGE_FOR_DEFRAG).build())['same'])
+
+    def test_prefetch_and_dirty_values_fat_16(self):
+        io_manager = IOManager(FAT_16_IMAGE)
+        f_proc = FatProcessor(InfoAboutImage(io_manager), io_manager, 1 << 20)
+        entries_per_page = FatPageCache.PAGE_SIZE // 2
+        f_proc.get_value_fat_cluster(2)
+        f_proc.get_value_fat_cluster(entries_per_page)
+        self.assertEqual(f_proc.cache.get_count_of_pages(), 3)  # страница 1 и следующая за ней
+
+        clus = [c for c in range(2, entries_per_page) if f_proc.get_value_fat_cluster(c) == 0][0]
+        f_proc.write_val_in_all_fat(f_proc.end_cluster, clus)
+        self.assertEqual(f_proc.get_value_fat_cluster(clus), f_proc.end_cluster)
+        self.assertEqual(f_proc.accessor.read_value(io_manager, clus, 1), 0)
+        self.assertEqual(f_proc.get_cluster_value_in_certain_fat(clus, 1), f_proc.end_cluster)
+
+        io_manager.start_overlay()
+        f_proc.set_values([clus], [0x1234])
+        io_manager.discard_overlay()
+        self.assertEqual(f_proc.cache.get_count_of_pages(), 0)
+        self.assertEqual(f_proc.get_value_fat_cluster(clus), f_proc.end_cluster)
+
+        f_proc.write_val_in_all_fat(0, clus)
+        io_manager.safe_point()
+        self.assertEqual(f_proc.accessor.read_value(io_manager, clus, 0), 0)
+        self.assertEqual(f_proc.accessor.read_value(io_manager, clus, 1), 0)
+        io_manager.close()
+
+    def test_changes_before_overlay_are_kept_fat_16(self):
+        io_manager = IOManager(FAT_16_IMAGE)
+        f_proc = FatProcessor(InfoAboutImage(io_manager), io_manager, 1 << 20)
+        clus = [c for c in range(2, f_proc.info.count_of_clusters) if f_proc.get_value_fat_cluster(c) == 0][0]
+        f_proc.write_val_in_all_fat(f_proc.end_cluster, clus)
+
+        io_manager.start_overlay()
+        io_manager.discard_overlay()
+        for fat_num in range(f_proc.info.BPB_NumFATs):
+            self.assertEqual(f_proc.accessor.read_value(io_manager, clus, fat_num), f_proc.end_cluster)
+
+        f_proc.write_val_in_all_fat(0, clus)
+        io_manager.close()
+        io_manager = IOManager(FAT_16_IMAGE, read_only=True)
+        self.assertEqual(f_proc.accessor.read_value(io_manager, clus, 0), 0)
+        io_manager.close()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,181 @@
+import array
+import hashlib
+import itertools
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from IOManager import IOManager
+from ImageTools import FatProcessor, DirectoryParser, get_cluster_ranges, normalize_path, PATH_SEPARATOR
+from enums import TypeOfFAT
+from fsck import walk_chain, read_directory
+from service_classes import InfoAboutImage
+
+
+class ManifestBuilder:
+    """
+    Построение манифеста образа: хэша BLAKE2 содержимого каждого файла. Манифесты, построенные до и после
+    фрагментации или дефрагментации, должны совпадать
+
+    Дерево директорий обходится в одном потоке, а файлы хэшируются в пуле потоков: у каждого потока свой
+    IOManager, непрерывные участки цепочки файла читаются большими последовательными чтениями. Хэшируются только
+    первые FileSize байт файла, хвост последнего кластера не учитывается
+    """
+
+    READ_SIZE = 1 << 22
+    DIGEST_SIZE = 32
+
+    def __init__(self, image_path: str, partition: int or None = None, workers: int or None = None):
+        """
+        :param image_path: путь до образа
+        :param partition: номер раздела (см. IOManager)
+        :param workers: количество потоков, None - по числу процессоров
+        """
+        self._image_path = image_path
+        self._partition = partition
+        self._workers = workers if workers is not None else os.cpu_count() or 1
+        self._local = threading.local()
+        self._io_managers = []
+        self._lock = threading.Lock()
+
+    def build(self, previous: dict or None = None):
+        """
+        Строит манифест образа
+        :param previous: сохранённый ранее манифест: если он построен для того же файла образа (совпадает абсолютный
+                         путь) и образ с тех пор не изменялся (совпадают размер и время изменения файла образа), он
+                         возвращается без перечитывания образа
+        :return: dict {'image' - абсолютный путь до образа, 'partition', 'image_size', 'image_mtime_ns',
+                 'files': {путь: хэш}}
+        """
+        image = os.path.abspath(self._image_path)
+        stat = os.stat(self._image_path)
+        if previous is not None and previous.get('image') == image and previous.get('partition') == self._partition \
+           and previous.get('image_size') == stat.st_size and previous.get('image_mtime_ns') == stat.st_mtime_ns:
+            return previous
+
+        files = self._get_files()
+        try:
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                digests = list(executor.map(self._hash_file, [runs for _, runs, _ in files],
+                                            [file_size for _, _, file_size in files]))
+        finally:
+            for io_manager in self._io_managers:
+                io_manager.close()
+            self._io_managers = []
+
+        return {
+            'image': image,
+            'partition': self._partition,
+            'image_size': stat.st_size,
+            'image_mtime_ns': stat.st_mtime_ns,
+            'files': {path: digest for (path, _, _), digest in zip(files, digests)}
+        }
+
+    def _get_files(self):
+        """
+        Обходит дерево директорий
+        :return: list [(путь до файла, [(первый кластер, количество кластеров)], размер файла в байтах)]
+        """
+        io_manager = IOManager(self._image_path, self._partition, read_only=True)
+        f_proc = FatProcessor(InfoAboutImage(io_manager), io_manager)
+        d_parser = DirectoryParser(f_proc)
+        fat_table = f_proc.read_fat_table(0)
+        visited = array.array('i', [-1]) * len(fat_table)
+        bytes_per_cluster = f_proc.info.get_bytes_per_cluster()
+        chain_numbers = itertools.count()
+        files = []
+
+        def get_chain(first_clus: int, expected_count: int or None = None):
+            chain, problem, problem_clus = walk_chain(f_proc, fat_table, first_clus, next(chain_numbers), visited)
+            if problem is None and expected_count is not None and len(chain) < expected_count:
+                problem = 'chain_shorter_than_size'
+            if problem is not None:
+                raise ValueError(f'Цепочка кластеров повреждена ({problem}, кластер {problem_clus}), запустите check')
+            return chain[:expected_count] if expected_count is not None else chain
+
+        if f_proc.fat_type == TypeOfFAT.fat16:
+            stack = [(PATH_SEPARATOR, None)]
+        else:
+            stack = [(PATH_SEPARATOR, get_chain(f_proc.info.BPB_RootClus))]
+        while stack:
+            dir_path, dir_chain = stack.pop()
+            for entry in read_directory(d_parser, dir_chain).entries_list:
+                if entry.is_dot_entry() or entry.attr.volume_id:
+                    continue
+                path = normalize_path(dir_path + PATH_SEPARATOR + entry.get_path_name())
+                expected_count = entry.get_count_of_clusters(bytes_per_cluster)
+                chain = get_chain(entry.first_cluster_num, expected_count) if entry.first_cluster_num != 0 else []
+                if entry.attr.is_directory():
+                    stack.append((path, chain))
+                else:
+                    files.append((path, get_cluster_ranges(chain), entry.file_size))
+
+        io_manager.close()
+        return files
+
+    def _get_fat_processor(self):
+        """
+        FatProcessor со своим IOManager для текущего потока
+        """
+        f_proc = getattr(self._local, 'f_proc', None)
+        if f_proc is None:
+            io_manager = IOManager(self._image_path, self._partition, read_only=True)
+            with self._lock:
+                self._io_managers.append(io_manager)
+            f_proc = self._local.f_proc = FatProcessor(InfoAboutImage(io_manager), io_manager)
+        return f_proc
+
+    def _hash_file(self, runs: list, file_size: int):
+        """
+        Хэширует содержимое файла (выполняется в потоке пула)
+        :param runs: непрерывные участки цепочки файла [(первый кластер, количество кластеров)]
+        :param file_size: размер файла в байтах
+        :return: str, хэш в шестнадцатеричном виде
+        """
+        f_proc = self._get_fat_processor()
+        bytes_per_cluster = f_proc.info.get_bytes_per_cluster()
+        file_hash = hashlib.blake2b(digest_size=ManifestBuilder.DIGEST_SIZE)
+        for first_clus, count in runs:
+            f_proc.io_manager.seek(f_proc.get_entry_for_cluster_in_data(first_clus))
+            left = min(count * bytes_per_cluster, file_size)
+            file_size -= left
+            while left > 0:
+                data = f_proc.io_manager.read_some_bytes(min(left, ManifestBuilder.READ_SIZE))
+                file_hash.update(data)
+                left -= len(data)
+        return file_hash.hexdigest()
+
+
+def compare_manifests(before: dict, after: dict):
+    """
+    Сравнивает два манифеста
+    :return: dict {'missing': [пути файлов, пропавших после операции], 'added': [новые пути], 'changed': [пути
+             файлов с изменившимся содержимым], 'same': bool}
+    """
+    before_files = before['files']
+    after_files = after['files']
+    result = {
+        'missing': sorted(set(before_files) - set(after_files)),
+        'added': sorted(set(after_files) - set(before_files)),
+        'changed': sorted(path for path, digest in before_files.items()
+                          if path in after_files and after_files[path] != digest)
+    }
+    result['same'] = not any(result.values())
+    return result
+
+
+def save_manifest(manifest: dict, manifest_path: str):
+    with open(manifest_path, 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, ensure_ascii=False, indent=1, sort_keys=True)
+
+
+def load_manifest(manifest_path: str):
+    """
+    :return: dict, сохранённый манифест или None, если файла манифеста нет
+    """
+    try:
+        with open(manifest_path, encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return None
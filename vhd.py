@@ -0,0 +1,248 @@
+import array
+import os
+import struct
+import sys
+
+
+class VhdFooter:
+    """
+    Информация из подвала (footer) образа VHD: последние 512 байт файла, у динамических образов копия - в начале файла
+    """
+    SIZE = 512
+    COOKIE = b'conectix'
+    STRUCT = struct.Struct('>8sIIQI4sI4sQQIII16sB427s')
+
+    DISK_TYPE_FIXED = 2
+    DISK_TYPE_DYNAMIC = 3
+    DISK_TYPE_DIFFERENCING = 4
+
+    __slots__ = ('data_offset', 'current_size', 'disk_type')
+
+    def __init__(self, raw: bytes):
+        if len(raw) != VhdFooter.SIZE or raw[:8] != VhdFooter.COOKIE:
+            raise ValueError('Не найден подвал образа VHD')
+        if get_vhd_check_sum(raw, 64) != int.from_bytes(raw[64:68], 'big'):
+            raise ValueError('Неверная контрольная сумма подвала образа VHD')
+        (_, _, _, self.data_offset, _, _, _, _, _, self.current_size, _, self.disk_type, _, _, _,
+         _) = VhdFooter.STRUCT.unpack(raw)
+
+
+class VhdDynamicHeader:
+    """
+    Заголовок динамического образа VHD (1024 байта по смещению data_offset из подвала)
+    """
+    SIZE = 1024
+    COOKIE = b'cxsparse'
+    STRUCT = struct.Struct('>8sQQIIII')
+
+    __slots__ = ('table_offset', 'max_table_entries', 'block_size')
+
+    def __init__(self, raw: bytes):
+        if len(raw) != VhdDynamicHeader.SIZE or raw[:8] != VhdDynamicHeader.COOKIE:
+            raise ValueError('Не найден заголовок динамического образа VHD')
+        if get_vhd_check_sum(raw, 36) != int.from_bytes(raw[36:40], 'big'):
+            raise ValueError('Неверная контрольная сумма заголовка динамического образа VHD')
+        (_, _, self.table_offset, _, self.max_table_entries, self.block_size,
+         _) = VhdDynamicHeader.STRUCT.unpack_from(raw)
+
+
+def get_vhd_check_sum(raw: bytes, check_sum_offset: int):
+    """
+    Подсчёт контрольной суммы структуры VHD: дополнение до единицы суммы всех байт, кроме самой контрольной суммы
+    :param raw: байты структуры
+    :param check_sum_offset: смещение 4-байтной контрольной суммы в структуре
+    :return: int
+    """
+    return ~(sum(raw) - sum(raw[check_sum_offset:check_sum_offset + 4])) & 0xFFFFFFFF
+
+
+def read_vhd_footer(image):
+    """
+    Ищет подвал VHD в конце открытого файла
+    :param image: файл образа, открытый в двоичном режиме
+    :return: VhdFooter или None, если файл не является образом VHD
+    """
+    size = image.seek(0, os.SEEK_END)
+    if size < VhdFooter.SIZE:
+        return None
+    image.seek(size - VhdFooter.SIZE)
+    raw = image.read(VhdFooter.SIZE)
+    if raw[:8] != VhdFooter.COOKIE:
+        return None
+    return VhdFooter(raw)
+
+
+def open_image(file_path: str, mode: str = 'r+b'):
+    """
+    Открывает образ: сырой образ тома и фиксированный VHD (данные тома лежат с начала файла) открываются как обычный
+    файл, динамический VHD - через DynamicVhd
+    :param file_path: путь до образа
+    :param mode: режим открытия файла
+    :return: файловый объект, смещение 0 которого соответствует началу тома
+    """
+    image = open(file_path, mode)
+    try:
+        footer = read_vhd_footer(image)
+        if footer is not None and footer.disk_type == VhdFooter.DISK_TYPE_DIFFERENCING:
+            raise ValueError('Разностные образы VHD не поддерживаются')
+        if footer is not None and footer.disk_type == VhdFooter.DISK_TYPE_DYNAMIC:
+            return DynamicVhd(image, footer)
+    except Exception:
+        image.close()
+        raise
+    image.seek(0)
+    return image
+
+
+class DynamicVhd:
+    """
+    Файловый объект над томом, лежащим в динамическом образе VHD
+
+    Том разбит на блоки одинакового размера, таблица размещения блоков (BAT) считывается один раз в массив, поэтому
+    смещение в томе переводится в смещение в файле за O(1). Блоки, лежащие в файле друг за другом, читаются и
+    записываются одной операцией. Невыделенные блоки читаются как нули, при первой записи блок дописывается в конец
+    файла
+    """
+    UNUSED_BLOCK = 0xFFFFFFFF
+    SECTOR_SIZE = 512
+
+    def __init__(self, image, footer: VhdFooter):
+        """
+        :param image: файл образа, открытый в двоичном режиме
+        :param footer: подвал образа
+        """
+        self._image = image
+        self._footer_raw = self._read_at(image.seek(0, os.SEEK_END) - VhdFooter.SIZE, VhdFooter.SIZE)
+        self._size = footer.current_size
+        self._position = 0
+
+        header = VhdDynamicHeader(self._read_at(footer.data_offset, VhdDynamicHeader.SIZE))
+        self._block_size = header.block_size
+        self._table_offset = header.table_offset
+        bitmap_size = header.block_size // DynamicVhd.SECTOR_SIZE // 8
+        self._bitmap_size = -(-bitmap_size // DynamicVhd.SECTOR_SIZE) * DynamicVhd.SECTOR_SIZE
+        self._stride = self._bitmap_size + self._block_size
+
+        self._bat = array.array('I', self._read_at(header.table_offset, 4 * header.max_table_entries))
+        if sys.byteorder == 'little':
+            self._bat.byteswap()
+
+    def _read_at(self, offset: int, count: int):
+        self._image.seek(offset)
+        return self._image.read(count)
+
+    def _get_runs(self, position: int, count: int):
+        """
+        Разбивает участок тома на отрезки, каждый из которых целиком лежит в непрерывном участке файла или целиком
+        в невыделенных блоках
+        :return: list [(номер первого блока, смещение в первом блоке, длина, смещение в файле или None)]
+        """
+        runs = []
+        end = min(position + count, self._size)
+        while position < end:
+            block, offset_in_block = divmod(position, self._block_size)
+            length = min(self._block_size - offset_in_block, end - position)
+            sector = self._bat[block]
+            if runs and self._is_next_in_file(self._bat[block - 1], sector):
+                first_block, first_offset, run_length, file_offset = runs[-1]
+                runs[-1] = (first_block, first_offset, run_length + length, file_offset)
+            else:
+                file_offset = None if sector == DynamicVhd.UNUSED_BLOCK else \
+                    sector * DynamicVhd.SECTOR_SIZE + self._bitmap_size + offset_in_block
+                runs.append((block, offset_in_block, length, file_offset))
+            position += length
+        return runs
+
+    def _is_next_in_file(self, previous_sector: int, sector: int):
+        """
+        Лежит ли блок в файле сразу за предыдущим блоком тома (или оба блока не выделены)
+        """
+        if previous_sector == DynamicVhd.UNUSED_BLOCK or sector == DynamicVhd.UNUSED_BLOCK:
+            return previous_sector == sector
+        return sector == previous_sector + self._stride // DynamicVhd.SECTOR_SIZE
+
+    def _strip_bitmaps(self, raw: bytes, offset_in_block: int):
+        """
+        Удаляет битовые карты секторов из данных, считанных с нескольких подряд идущих блоков
+        """
+        first_part = self._block_size - offset_in_block
+        if len(raw) <= first_part:
+            return raw
+        parts = [raw[:first_part]]
+        for start in range(first_part + self._bitmap_size, len(raw), self._stride):
+            parts.append(raw[start:start + self._block_size])
+        return b''.join(parts)
+
+    def _get_file_length(self, offset_in_block: int, length: int):
+        """
+        Длина участка файла, в котором лежат length байт тома, начиная со смещения offset_in_block в первом блоке
+        """
+        return length + (offset_in_block + length - 1) // self._block_size * self._bitmap_size
+
+    def read(self, count: int = -1):
+        if count < 0:
+            count = self._size - self._position
+        parts = []
+        for _, offset_in_block, length, file_offset in self._get_runs(self._position, count):
+            if file_offset is None:
+                parts.append(bytes(length))
+            else:
+                raw = self._read_at(file_offset, self._get_file_length(offset_in_block, length))
+                parts.append(self._strip_bitmaps(raw, offset_in_block))
+        result = b''.join(parts)
+        self._position += len(result)
+        return result
+
+    def write(self, value: bytes):
+        value = bytes(value)
+        if self._position + len(value) > self._size:
+            raise ValueError('Запись за пределы образа VHD')
+        done = 0
+        for block, offset_in_block, length, file_offset in self._get_runs(self._position, len(value)):
+            if file_offset is None:
+                for i in range(block, block + (offset_in_block + length - 1) // self._block_size + 1):
+                    self._allocate_block(i)
+                file_offset = self._bat[block] * DynamicVhd.SECTOR_SIZE + self._bitmap_size + offset_in_block
+
+            data = value[done:done + length]
+            first_part = self._block_size - offset_in_block
+            self._image.seek(file_offset)
+            self._image.write(data[:first_part])
+            for start in range(first_part, length, self._block_size):
+                self._image.seek(self._bitmap_size, os.SEEK_CUR)
+                self._image.write(data[start:start + self._block_size])
+            done += length
+        self._position += done
+        return done
+
+    def _allocate_block(self, block: int):
+        """
+        Дописывает нулевой блок в конец файла (на место подвала), отмечает все его сектора как записанные, обновляет
+        BAT в памяти и в файле и переносит подвал в новый конец файла
+        """
+        end = self._image.seek(0, os.SEEK_END) - VhdFooter.SIZE
+        sector = -(-end // DynamicVhd.SECTOR_SIZE)
+        self._image.seek(sector * DynamicVhd.SECTOR_SIZE)
+        self._image.write(b'\xff' * self._bitmap_size + bytes(self._block_size) + self._footer_raw)
+        self._image.truncate()
+
+        self._bat[block] = sector
+        self._image.seek(self._table_offset + 4 * block)
+        self._image.write(sector.to_bytes(4, 'big'))
+
+    def seek(self, position: int, whence: int = os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            position += self._position
+        elif whence == os.SEEK_END:
+            position += self._size
+        self._position = position
+        return position
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        self._image.flush()
+
+    def close(self):
+        self._image.close()